@@ -0,0 +1,106 @@
+"""Offline address search over the street addresses in the dataset.
+
+``AddressIndex`` collapses all sales at the same street address into one
+entry with the median coordinates, the most common location area and the
+number of sales. Entries are kept in a sorted array of normalized keys, so
+the completions of a prefix are one contiguous slice found by two binary
+searches, and resolving an address needs no network geocoder.
+
+Usage:
+    python address_index.py Götgatan
+    python address_index.py "hornsgatan 1" --limit 5
+"""
+
+import argparse
+import time
+from bisect import bisect_left
+
+import pandas as pd
+
+DEFAULT_LIMIT = 10
+# Sorts after every character that appears in an address
+_MAX_CHAR = "\U0010ffff"
+
+
+def normalize(text: str) -> str:
+    """Case and whitespace insensitive key of an address."""
+    return " ".join(str(text).casefold().split())
+
+
+def _most_common(df: pd.DataFrame, col: str) -> pd.Series:
+    # Per key, the value with the most rows; ties go to the first in sort order
+    counts = df.groupby(["key", col], observed=True).size().reset_index(name="n")
+    counts = counts.sort_values(["key", "n"], ascending=[True, False], kind="stable")
+    return counts.drop_duplicates("key").set_index("key")[col]
+
+
+class AddressIndex:
+    """Sorted prefix index of unique street addresses."""
+
+    def __init__(self, df: pd.DataFrame):
+        df = df[["adress", "latitude", "longitude", "location_area"]].dropna(subset=["adress"])
+        keys = df["adress"].map(normalize)
+        df = df[keys != ""].assign(key=keys[keys != ""])
+
+        groups = df.groupby("key", sort=True)
+        self._keys = groups.size().index.tolist()
+        # The most common spelling and location area of every address
+        self.addresses = _most_common(df, "adress").loc[self._keys].tolist()
+        self.location_areas = _most_common(df, "location_area").loc[self._keys].astype(str).tolist()
+        self.latitude = groups["latitude"].median().to_numpy(dtype=float)
+        self.longitude = groups["longitude"].median().to_numpy(dtype=float)
+        self.sales = groups.size().to_numpy()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def _entry(self, i: int) -> dict:
+        return {
+            "adress": self.addresses[i],
+            "latitude": float(self.latitude[i]),
+            "longitude": float(self.longitude[i]),
+            "location_area": self.location_areas[i],
+            "sales": int(self.sales[i]),
+        }
+
+    def complete(self, prefix: str, limit: int = DEFAULT_LIMIT) -> list:
+        """Up to ``limit`` addresses starting with ``prefix``, alphabetically."""
+        key = normalize(prefix)
+        if not key:
+            return []
+        lo = bisect_left(self._keys, key)
+        hi = bisect_left(self._keys, key + _MAX_CHAR, lo)
+        return [self._entry(i) for i in range(lo, min(hi, lo + limit))]
+
+    def resolve(self, address: str):
+        """Coordinates and area of an exact address, or None."""
+        key = normalize(address)
+        i = bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            return self._entry(i)
+        return None
+
+
+if __name__ == "__main__":
+    from dataset import DATASET_FILE, RAW_CSV, load_apartments
+
+    parser = argparse.ArgumentParser(description="Complete a street address from the dataset.")
+    parser.add_argument("prefix", help="Beginning of the address")
+    parser.add_argument("--limit", type=int, default=DEFAULT_LIMIT, help="Maximum number of completions")
+    parser.add_argument("--dataset", default=DATASET_FILE, help="Typed dataset written by dataset.py")
+    parser.add_argument("--csv", default=RAW_CSV, help="Raw CSV, ingested when the dataset is missing or stale")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = AddressIndex(load_apartments(args.dataset, args.csv))
+    build_ms = (time.perf_counter() - start) * 1000
+    repeats = 1000
+    start = time.perf_counter()
+    for _ in range(repeats):
+        matches = index.complete(args.prefix, args.limit)
+    lookup_us = (time.perf_counter() - start) / repeats * 1e6
+
+    for match in matches:
+        print(f"{match['adress']:<28} {match['location_area']:<18} "
+              f"{match['latitude']:.5f}, {match['longitude']:.5f}  {match['sales']} sales")
+    print(f"{len(index):,} addresses indexed in {build_ms:.0f} ms, lookup took {lookup_us:.1f} µs")
@@ -0,0 +1,141 @@
+"""Score whole listing files with the apartment price models.
+
+Streams a CSV or Parquet file shaped like ``apartments_sweden.csv`` in chunks,
+encodes each chunk with the persisted feature schema and calls every selected
+model once per chunk. The output keeps the input columns and adds
+``<model>_pred``, ``<model>_lower`` and ``<model>_upper`` per model. Rows with a
+missing feature get empty predictions instead of being dropped.
+
+Usage:
+    python batch_predict.py listings.csv scored.csv --alpha 0.1
+    python batch_predict.py listings.parquet scored.parquet --models "Random Forest" AdaBoost
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from features import FEATURE_COLS, SCHEMA_FILE, FeatureEncoder, load_schema, parse_rent
+from model_store import MODEL_DIR, ModelStore, model_slug
+
+
+def _is_parquet(path: str) -> bool:
+    return path.lower().endswith((".parquet", ".pq"))
+
+
+def read_chunks(path: str, chunk_size: int):
+    """Yield DataFrames of at most ``chunk_size`` rows from a CSV or Parquet file."""
+    if _is_parquet(path):
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_size)
+
+
+class _ChunkWriter:
+    """Appends scored chunks to a CSV or Parquet file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._parquet_writer = None
+        self._first = True
+
+    def write(self, df: pd.DataFrame) -> None:
+        if _is_parquet(self.path):
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self._parquet_writer is None:
+                self._parquet_writer = pq.ParquetWriter(self.path, table.schema)
+            self._parquet_writer.write_table(table)
+        else:
+            df.to_csv(self.path, mode="w" if self._first else "a", header=self._first, index=False)
+        self._first = False
+
+    def close(self) -> None:
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+
+
+def score_frame(df: pd.DataFrame, models: dict, encoder: FeatureEncoder, alpha: float) -> pd.DataFrame:
+    """Return ``df`` with prediction and interval columns added for each model."""
+    features = df[FEATURE_COLS].copy()
+    features['rent'] = parse_rent(features['rent'])
+    valid = features.notna().all(axis=1).to_numpy()
+
+    X = encoder.encode_frame(features[valid])
+    scored = df.copy()
+    for name, model in models.items():
+        pred = np.full(len(df), np.nan)
+        lower = np.full(len(df), np.nan)
+        upper = np.full(len(df), np.nan)
+        if len(X):
+            prediction, intervals = model.predict(X, alpha=alpha)
+            pred[valid] = prediction
+            lower[valid] = intervals[:, 0, 0]
+            upper[valid] = intervals[:, 1, 0]
+
+        slug = model_slug(name)
+        scored[f"{slug}_pred"] = pred
+        scored[f"{slug}_lower"] = lower
+        scored[f"{slug}_upper"] = upper
+    return scored
+
+
+def predict_file(
+    input_path: str,
+    output_path: str,
+    model_names=None,
+    alpha: float = 0.1,
+    chunk_size: int = 10_000,
+    model_dir: str = MODEL_DIR,
+    verbose: bool = False,
+) -> dict:
+    """Score ``input_path`` into ``output_path`` and return throughput stats."""
+    names = list(model_names) if model_names else None
+    store = ModelStore(model_dir, max_resident=len(names) if names else 4)
+    encoder = FeatureEncoder(load_schema(model_dir, store.manifest.get("schema", SCHEMA_FILE)))
+    models = {name: store.get(name) for name in (names or store.names)}
+
+    writer = _ChunkWriter(output_path)
+    n_rows = 0
+    start = time.perf_counter()
+    try:
+        for chunk in read_chunks(input_path, chunk_size):
+            writer.write(score_frame(chunk, models, encoder, alpha))
+            n_rows += len(chunk)
+            if verbose:
+                elapsed = time.perf_counter() - start
+                print(f"{n_rows:,} rows scored ({n_rows / elapsed:,.0f} rows/s)")
+    finally:
+        writer.close()
+
+    seconds = time.perf_counter() - start
+    return {
+        "rows": n_rows,
+        "seconds": seconds,
+        "rows_per_second": n_rows / seconds if seconds > 0 else float("inf"),
+        "models": list(models),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batch score apartment listings with the price models.")
+    parser.add_argument("input", help="CSV or Parquet file shaped like apartments_sweden.csv")
+    parser.add_argument("output", help="Where to write the scored rows (.csv or .parquet)")
+    parser.add_argument("--models", nargs="+", help="Models to run (default: all in the manifest)")
+    parser.add_argument("--alpha", type=float, default=0.1, help="Interval alpha, 0.1 gives 90%% intervals")
+    parser.add_argument("--chunk-size", type=int, default=10_000, help="Rows per chunk")
+    parser.add_argument("--model-dir", default=MODEL_DIR, help="Directory with the model manifest")
+    args = parser.parse_args()
+
+    stats = predict_file(args.input, args.output, args.models, args.alpha, args.chunk_size, args.model_dir, verbose=True)
+    print(
+        f"Scored {stats['rows']:,} rows with {len(stats['models'])} models in {stats['seconds']:.2f} s "
+        f"({stats['rows_per_second']:,.0f} rows/s)"
+    )
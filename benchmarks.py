@@ -0,0 +1,365 @@
+"""Latency and memory benchmarks for the app's hot paths.
+
+Suites:
+    load      cold load time and RSS growth of the combined pickle and of each
+              compact model, each measured in a fresh process
+    predict   single-row and batch ``predict`` latency per model and alpha
+    encode    CSV load + ``get_dummies`` encoding (the original prediction page)
+              against the typed dataset and ``FeatureEncoder``
+    map       Map page filtering: pandas masks against ``MapIndex.query``
+    render    Map page marker layer build + HTML render time by marker count
+    sessions  concurrent headless sessions of the prediction page (Streamlit's
+              ``AppTest``, one process each) and their rerun latency percentiles
+
+Every measurement is one record with a unique ``name``, written to a JSON file
+together with the model version and git commit. ``--baseline`` compares the
+p50 latencies with an earlier result file and exits non-zero on regressions.
+
+Usage:
+    python benchmarks.py --output benchmark_results.json
+    python benchmarks.py --suites predict map --baseline benchmark_results.json
+    python benchmarks.py --suites sessions --sessions 8 --reruns 5
+"""
+
+import argparse
+import json
+import os
+import pickle
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+
+from dataset import RAW_CSV, load_apartments
+from features import CAT_COLS, SCHEMA_FILE, FeatureEncoder, build_schema, clean_apartments, load_schema
+from model_store import MODEL_DIR, ModelStore
+from perf_metrics import rss_mb
+
+SUITES = ("load", "predict", "encode", "map", "render", "sessions")
+BENCH_ALPHAS = (None, 0.1, 0.5, 0.9)
+MARKER_COUNTS = (10, 50, 100, 300, 1000)
+BATCH_SIZE = 100
+PICKLE_FILE = "apartment_models.pickle"
+PREDICT_PAGE = "pages/3_Predict_Apartment_Price.py"
+
+
+def _percentiles(milliseconds: list) -> dict:
+    p50, p95, p99 = np.percentile(milliseconds, [50, 95, 99])
+    return {"n": len(milliseconds), "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99)}
+
+
+def _time_calls(fn, repeats: int) -> dict:
+    latencies = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        fn(i)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return _percentiles(latencies)
+
+
+def _sample_inputs(apartments: pd.DataFrame, n: int, seed: int = 0) -> list:
+    # Page inputs taken from real listings, as a user would enter them
+    cols = ["location_area", "number_of_rooms", "area", "rent", "floor",
+            "has_elevator", "has_fireplace", "has_outside"]
+    sample = apartments.sample(n, replace=len(apartments) < n, random_state=seed)
+    return [
+        {col: (value if isinstance(value, str) else float(value)) for col, value in row.items()}
+        for row in sample[cols].astype(object).to_dict("records")
+    ]
+
+
+# ---------------------------------------------------------------------------
+# Suites
+# ---------------------------------------------------------------------------
+
+def _cold_load(kind: str, path: str, name: str = None) -> dict:
+    # Runs in a fresh process, so nothing is imported or mapped yet
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    if kind == "pickle":
+        with open(path, "rb") as f:
+            pickle.load(f)
+    else:
+        store = ModelStore(path, max_resident=1)
+        model = store.get(name)
+        # The first prediction touches the memory-mapped pages it needs
+        model.predict(np.zeros((1, model.n_features_in_)), alpha=0.1)
+    return {"seconds": time.perf_counter() - start, "rss_mb": rss_mb() - rss_before}
+
+
+def bench_load(model_dir: str, pickle_path: str) -> list:
+    jobs = []
+    if pickle_path and os.path.exists(pickle_path):
+        jobs.append(("load/pickle", ("pickle", pickle_path)))
+    for name in ModelStore(model_dir).names:
+        jobs.append((f"load/compact/{name}", ("compact", model_dir, name)))
+
+    records = []
+    for record_name, args in jobs:
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+            result = pool.submit(_cold_load, *args).result()
+        records.append({"name": record_name, "suite": "load", **result})
+    return records
+
+
+def bench_predict(model_dir: str, apartments: pd.DataFrame, repeats: int) -> list:
+    from conformal import ALPHA_GRID
+
+    store = ModelStore(model_dir, max_resident=4)
+    encoder = FeatureEncoder(load_schema(model_dir, store.manifest.get("schema", SCHEMA_FILE)))
+    X = encoder.encode_frame(apartments.sample(max(repeats, BATCH_SIZE), replace=True, random_state=0))
+
+    records = []
+    for name in store.names:
+        model = store.get(name)
+        for alpha in BENCH_ALPHAS + (ALPHA_GRID.tolist(),):
+            label = "point" if alpha is None else ("grid" if isinstance(alpha, list) else f"alpha={alpha}")
+            single = _time_calls(lambda i: model.predict(X[i:i + 1], alpha=alpha), repeats)
+            batch = _time_calls(lambda i: model.predict(X[:BATCH_SIZE], alpha=alpha), max(5, repeats // 10))
+            records.append({"name": f"predict/{name}/{label}/single", "suite": "predict", **single})
+            records.append({"name": f"predict/{name}/{label}/batch{BATCH_SIZE}", "suite": "predict", **batch})
+    return records
+
+
+def _legacy_encode(csv_path: str, user_data: dict) -> pd.DataFrame:
+    # The original prediction page: re-read the CSV and get_dummies it with the user row
+    default_df = pd.read_csv(csv_path)
+    default_df["rent"] = default_df["rent"].str.replace(",", "").astype(float)
+    default_df = default_df[default_df["floor"] <= 10]
+    default_df.dropna(inplace=True)
+    encode_df = default_df.copy().drop(columns=["sold_price", "latitude", "longitude", "adress"])
+    user_df = pd.DataFrame([user_data])[encode_df.columns]
+    encode_df = pd.concat([encode_df, user_df], axis=0)
+    return pd.get_dummies(encode_df, columns=CAT_COLS, dtype=int).tail(1)
+
+
+def bench_encode(csv_path: str, apartments: pd.DataFrame, repeats: int) -> list:
+    inputs = _sample_inputs(apartments, repeats)
+    encoder = FeatureEncoder(build_schema(apartments))
+    legacy_repeats = max(5, repeats // 20)
+    return [
+        {"name": "encode/csv_get_dummies", "suite": "encode",
+         **_time_calls(lambda i: _legacy_encode(csv_path, inputs[i]), legacy_repeats)},
+        {"name": "encode/load_apartments", "suite": "encode",
+         **_time_calls(lambda i: clean_apartments(load_apartments(csv_path=csv_path)), legacy_repeats)},
+        {"name": "encode/feature_encoder", "suite": "encode",
+         **_time_calls(lambda i: encoder.encode(inputs[i]), repeats)},
+    ]
+
+
+def bench_map(apartments_raw: pd.DataFrame, repeats: int) -> list:
+    from map_index import MapIndex
+
+    start = time.perf_counter()
+    index = MapIndex(apartments_raw)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    inputs = _sample_inputs(apartments_raw, repeats, seed=1)
+    df = apartments_raw
+    records = [{"name": "map/index_build", "suite": "map", "n": 1, "p50_ms": build_ms,
+                "p95_ms": build_ms, "p99_ms": build_ms}]
+    for all_areas in (False, True):
+        scope = "all_areas" if all_areas else "one_area"
+
+        def pandas_filter(i):
+            u = inputs[i]
+            # The Map page's original boolean masks
+            mask = ((df["number_of_rooms"] == u["number_of_rooms"]) & df["area"].between(u["area"] - 10, u["area"] + 10)
+                    & (df["floor"] == u["floor"]) & (df["has_elevator"] == u["has_elevator"])
+                    & (df["has_fireplace"] == u["has_fireplace"]) & (df["has_outside"] == u["has_outside"])
+                    & (df["rent"] <= u["rent"] * 2))
+            if not all_areas:
+                mask &= df["location_area"] == u["location_area"]
+            return df[mask]
+
+        def index_query(i):
+            u = inputs[i]
+            positions = index.query(
+                u["location_area"], u["number_of_rooms"], u["floor"], u["has_elevator"], u["has_fireplace"],
+                u["has_outside"], (u["area"] - 10, u["area"] + 10), u["rent"] * 2, all_areas=all_areas,
+            )
+            return index.rows(positions)
+
+        records.append({"name": f"map/get_data/pandas/{scope}", "suite": "map", **_time_calls(pandas_filter, repeats)})
+        records.append({"name": f"map/get_data/index/{scope}", "suite": "map", **_time_calls(index_query, repeats)})
+    return records
+
+
+def _marker_map(rows: pd.DataFrame):
+    import folium
+
+    # Same elements per apartment as add_apartment_markers on the Map page
+    m = folium.Map(location=[59.3293, 18.0686], zoom_start=11, tiles="OpenStreetMap")
+    layer = folium.FeatureGroup(name="Apartments")
+    for row in rows.to_dict("records"):
+        folium.Marker(
+            location=[row["latitude"], row["longitude"]],
+            icon=folium.Icon(color="green", icon="home"),
+            popup=folium.Popup(f"<div><h4>🏠 Apartment Details</h4>{row['sold_price']:,.0f} SEK "
+                               f"{row['location_area']} {row['adress']}</div>", max_width=300),
+            tooltip=f"💰 {row['sold_price']:,.0f} SEK | 📍 {row['location_area']}",
+        ).add_to(layer)
+    layer.add_to(m)
+    return m.get_root().render()
+
+
+def bench_render(apartments_raw: pd.DataFrame, repeats: int) -> list:
+    records = []
+    for count in MARKER_COUNTS:
+        rows = apartments_raw.sample(min(count, len(apartments_raw)), random_state=0)
+        timing = _time_calls(lambda i: _marker_map(rows), max(3, repeats // 50))
+        records.append({"name": f"render/markers={count}", "suite": "render", "markers": len(rows), **timing})
+    return records
+
+
+def _session(inputs: list, reruns: int, seed: int) -> dict:
+    from streamlit.testing.v1 import AppTest
+
+    rng = np.random.default_rng(seed)
+    at = AppTest.from_file(PREDICT_PAGE, default_timeout=600)
+    for key, value in inputs[seed % len(inputs)].items():
+        at.session_state[key] = value
+    at.session_state["form_submitted"] = True
+
+    start = time.perf_counter()
+    at.run()
+    first_ms = (time.perf_counter() - start) * 1000
+    rerun_ms = []
+    for _ in range(reruns):
+        # Alternate between moving the alpha slider and switching models
+        if rng.random() < 0.5:
+            at.slider[0].set_value(float(np.round(rng.uniform(0.1, 0.9), 2)))
+        else:
+            at.sidebar.radio[0].set_value(str(rng.choice(["Random Forest", "Decision Tree", "AdaBoost", "Soft Voting"])))
+        start = time.perf_counter()
+        at.run()
+        rerun_ms.append((time.perf_counter() - start) * 1000)
+    return {"first_ms": first_ms, "rerun_ms": rerun_ms, "errors": len(at.exception)}
+
+
+def bench_sessions(apartments: pd.DataFrame, sessions: int, reruns: int) -> list:
+    inputs = _sample_inputs(apartments, sessions, seed=2)
+    # AppTest is not thread-safe, so every session gets its own process
+    with ProcessPoolExecutor(max_workers=sessions, mp_context=get_context("spawn")) as pool:
+        results = list(pool.map(_session, [inputs] * sessions, [reruns] * sessions, range(sessions)))
+
+    errors = sum(r["errors"] for r in results)
+    return [
+        {"name": "sessions/first_run", "suite": "sessions", "sessions": sessions, "errors": errors,
+         **_percentiles([r["first_ms"] for r in results])},
+        {"name": "sessions/rerun", "suite": "sessions", "sessions": sessions, "errors": errors,
+         **_percentiles([ms for r in results for ms in r["rerun_ms"]])},
+    ]
+
+
+# ---------------------------------------------------------------------------
+# Runner
+# ---------------------------------------------------------------------------
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(suites=SUITES, model_dir: str = MODEL_DIR, csv_path: str = RAW_CSV, pickle_path: str = PICKLE_FILE,
+        repeats: int = 200, sessions: int = 4, reruns: int = 5) -> dict:
+    store = ModelStore(model_dir)
+    apartments_raw = load_apartments(csv_path=csv_path)
+    apartments = clean_apartments(apartments_raw)
+
+    records = []
+    for suite in suites:
+        start = time.perf_counter()
+        if suite == "load":
+            records += bench_load(model_dir, pickle_path)
+        elif suite == "predict":
+            records += bench_predict(model_dir, apartments, repeats)
+        elif suite == "encode":
+            records += bench_encode(csv_path, apartments, repeats)
+        elif suite == "map":
+            records += bench_map(apartments_raw, repeats)
+        elif suite == "render":
+            records += bench_render(apartments_raw, repeats)
+        elif suite == "sessions":
+            records += bench_sessions(apartments, sessions, reruns)
+        else:
+            raise ValueError(f"Unknown suite '{suite}', available: {', '.join(SUITES)}")
+        print(f"{suite:<9} done in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    return {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "commit": _git_commit(),
+        "model_version": store.version,
+        "model_fingerprint": store.fingerprint,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "cpu_count": os.cpu_count(),
+        "results": records,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float = 1.25) -> list:
+    """Records whose p50 latency grew by more than ``tolerance`` times the baseline."""
+    previous = {r["name"]: r for r in baseline["results"]}
+    regressions = []
+    for record in results["results"]:
+        old = previous.get(record["name"])
+        if old is None or not old.get("p50_ms") or "p50_ms" not in record:
+            continue
+        ratio = record["p50_ms"] / old["p50_ms"]
+        if ratio > tolerance:
+            regressions.append({"name": record["name"], "baseline_ms": old["p50_ms"],
+                                "p50_ms": record["p50_ms"], "ratio": ratio})
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the apartment app's hot paths.")
+    parser.add_argument("--suites", nargs="+", default=list(SUITES), choices=SUITES, help="Suites to run")
+    parser.add_argument("--model-dir", default=MODEL_DIR, help="Directory with the model manifest")
+    parser.add_argument("--csv", default=RAW_CSV, help="Raw apartment dataset")
+    parser.add_argument("--pickle", default=PICKLE_FILE, help="Combined pickle for the cold load suite")
+    parser.add_argument("--repeats", type=int, default=200, help="Timed calls per latency measurement")
+    parser.add_argument("--sessions", type=int, default=4, help="Concurrent headless sessions")
+    parser.add_argument("--reruns", type=int, default=5, help="Reruns per headless session")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file for the results")
+    parser.add_argument("--baseline", default=None, help="Earlier result file to compare p50 latencies with")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="Allowed p50 slowdown against the baseline")
+    args = parser.parse_args()
+
+    import warnings
+    # The pickled models were fitted on a DataFrame and warn about plain arrays
+    warnings.filterwarnings("ignore", message="X does not have valid feature names")
+
+    # Read before writing, so the output may overwrite the baseline file
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    results = run(args.suites, args.model_dir, args.csv, args.pickle, args.repeats, args.sessions, args.reruns)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    print(f"{'benchmark':<48} {'p50 ms':>10} {'p99 ms':>10}  extra")
+    for r in results["results"]:
+        if "p50_ms" in r:
+            extra = f"{r['errors']} errors" if r.get("errors") else ""
+            print(f"{r['name']:<48} {r['p50_ms']:>10.2f} {r['p99_ms']:>10.2f}  {extra}")
+        else:
+            print(f"{r['name']:<48} {r['seconds'] * 1000:>10.1f} {'':>10}  +{r['rss_mb']:.1f} MB RSS")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for r in regressions:
+            print(f"REGRESSION {r['name']}: {r['baseline_ms']:.2f} -> {r['p50_ms']:.2f} ms ({r['ratio']:.2f}x)")
+        if regressions:
+            sys.exit(1)
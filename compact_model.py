@@ -0,0 +1,545 @@
+"""Pickle-free, memory-mapped format for the fitted MAPIE models.
+
+A fitted ``MapieRegressor`` (method "plus") is stored as a directory of flat
+NumPy ``.npy`` files plus a small ``meta.json``:
+
+- ``feature``, ``threshold``, ``children_left``, ``children_right`` and
+  ``value`` hold the nodes of every tree (single estimator and all CV clones)
+  back to back, with child indices already pointing into the shared arrays.
+- ``cover`` is the weighted number of training samples that reached each node,
+  which ``explain.py`` needs for TreeSHAP. Models exported before it was added
+  have no ``cover`` file and can predict but not be explained.
+- ``fold_index`` is the CV fold that left out each training sample and
+  ``conformity_scores`` the matching out-of-fold absolute residuals.
+- ``meta.json`` describes how trees combine into Decision Tree, Random Forest,
+  AdaBoost and Voting estimators, and the histogram gradient boosting
+  students of ``distill.py``.
+
+Split-conformal models (``method="base"``, see ``train.py --lightweight``) store
+only the single estimator's trees, an empty ``fold_index`` and their
+calibration residuals sorted ascending.
+
+The files are opened with ``np.load(mmap_mode="r")``, so several Streamlit
+processes on one host share the same physical pages and nothing is unpickled.
+Exporting needs scikit-learn and MAPIE; loading and predicting need only NumPy.
+Prediction walks every tree of a model at once: each (row, tree) pair is one
+lane of a vectorized traversal, so there is no Python loop over trees.
+
+The CLI converts the notebook's pickle into a model directory that has no
+registry history yet; it refuses to replace the manifest of versions published
+by ``train.py``. ``--benchmark`` exports to a temporary directory and leaves
+``--model-dir`` alone.
+
+Usage:
+    python compact_model.py --pickle apartment_models.pickle --model-dir models
+    python compact_model.py --benchmark      # p50/p99 latency against the pickles
+"""
+
+import argparse
+import json
+import os
+import pickle
+import tempfile
+import time
+
+import numpy as np
+
+from conformal import compute_outputs
+from model_registry import publish_version
+from model_store import (
+    MANIFEST_FILE, MODEL_DIR, ModelStore, checksum, model_slug, read_manifest, versioned_name, write_manifest,
+)
+
+FORMAT_VERSION = 1
+TREE_ARRAYS = ("feature", "threshold", "children_left", "children_right", "value")
+# Node arrays that older exports do not have
+OPTIONAL_ARRAYS = ("cover",)
+
+
+# ---------------------------------------------------------------------------
+# Export (needs scikit-learn and MAPIE)
+# ---------------------------------------------------------------------------
+
+class _TreeTable:
+    """Collects the nodes of many sklearn trees into shared flat arrays."""
+
+    def __init__(self):
+        self.roots = []
+        self.parts = {name: [] for name in TREE_ARRAYS + OPTIONAL_ARRAYS}
+        self.n_nodes = 0
+
+    def add(self, tree) -> int:
+        """Add a fitted sklearn ``tree_`` and return its tree id."""
+        return self._append(
+            tree.feature, tree.threshold, tree.children_left, tree.children_right, tree.value[:, 0, 0],
+            tree.weighted_n_node_samples,
+        )
+
+    def add_hist(self, predictor) -> int:
+        """Add one tree of a fitted ``HistGradientBoostingRegressor``."""
+        nodes = predictor.nodes
+        leaf = nodes["is_leaf"].astype(bool)
+        return self._append(
+            np.where(leaf, -2, nodes["feature_idx"]),
+            nodes["num_threshold"],
+            np.where(leaf, -1, nodes["left"]),
+            np.where(leaf, -1, nodes["right"]),
+            nodes["value"],
+            nodes["count"],
+        )
+
+    def add_compact(self, model, tree: int) -> int:
+        """Copy tree ``tree`` of a loaded ``CompactMapieRegressor``."""
+        start = model._roots[tree]
+        end = model._roots[tree + 1] if tree + 1 < len(model._roots) else len(model._feature)
+        # Child indices are global in the source model; make them local again
+        left = np.asarray(model._left[start:end])
+        right = np.asarray(model._right[start:end])
+        return self._append(
+            model._feature[start:end],
+            model._threshold[start:end],
+            np.where(left == -1, -1, left - start),
+            np.where(right == -1, -1, right - start),
+            model._value[start:end],
+            None if model._cover is None else model._cover[start:end],
+        )
+
+    def _append(self, feature, threshold, left, right, value, cover=None) -> int:
+        # Shift child indices so they point into the concatenated arrays
+        offset = self.n_nodes
+        left = np.asarray(left).astype(np.int32)
+        right = np.asarray(right).astype(np.int32)
+        self.parts["children_left"].append(np.where(left == -1, -1, left + offset).astype(np.int32))
+        self.parts["children_right"].append(np.where(right == -1, -1, right + offset).astype(np.int32))
+        self.parts["feature"].append(np.asarray(feature).astype(np.int32))
+        self.parts["threshold"].append(np.asarray(threshold).astype(np.float64))
+        self.parts["value"].append(np.asarray(value).astype(np.float64))
+        self.parts["cover"].append(None if cover is None else np.asarray(cover).astype(np.float64))
+
+        self.roots.append(offset)
+        self.n_nodes += len(left)
+        return len(self.roots) - 1
+
+    def arrays(self) -> dict:
+        arrays = {
+            name: np.concatenate(parts) for name, parts in self.parts.items()
+            # Trees copied from an older export have no cover, so none is written
+            if name not in OPTIONAL_ARRAYS or all(part is not None for part in parts)
+        }
+        arrays["roots"] = np.array(self.roots, dtype=np.int64)
+        return arrays
+
+
+def _describe(estimator, table: _TreeTable) -> dict:
+    # Imported here so loading a compact model never needs scikit-learn
+    from sklearn.ensemble import AdaBoostRegressor, HistGradientBoostingRegressor, RandomForestRegressor, VotingRegressor
+    from sklearn.tree import DecisionTreeRegressor
+
+    if isinstance(estimator, DecisionTreeRegressor):
+        return {"type": "tree", "tree": table.add(estimator.tree_)}
+    if isinstance(estimator, RandomForestRegressor):
+        return {"type": "forest", "trees": [table.add(e.tree_) for e in estimator.estimators_]}
+    if isinstance(estimator, AdaBoostRegressor):
+        n_fitted = len(estimator.estimators_)
+        return {
+            "type": "adaboost",
+            "trees": [table.add(e.tree_) for e in estimator.estimators_],
+            "weights": [float(w) for w in estimator.estimator_weights_[:n_fitted]],
+        }
+    if isinstance(estimator, HistGradientBoostingRegressor):
+        # Categorical splits and missing values need bitsets the traversal does not have
+        if estimator.loss != "squared_error" or estimator.is_categorical_ is not None:
+            raise TypeError("Only numeric squared-error histogram gradient boosting can be exported")
+        return {
+            "type": "boosting",
+            "trees": [table.add_hist(predictor) for (predictor,) in estimator._predictors],
+            "init": float(np.ravel(estimator._baseline_prediction)[0]),
+        }
+    if isinstance(estimator, VotingRegressor):
+        return {
+            "type": "voting",
+            "estimators": [_describe(e, table) for e in estimator.estimators_],
+            "weights": None if estimator.weights is None else [float(w) for w in estimator._weights_not_none],
+        }
+    raise TypeError(f"Cannot export estimator of type {type(estimator).__name__}")
+
+
+def _describe_update(old_spec: dict, old_model, estimator, table: _TreeTable) -> dict:
+    # Forests keep their existing trees and gain the trees of ``estimator``,
+    # like a warm started RandomForestRegressor; other estimators are replaced
+    if old_spec["type"] == "forest":
+        trees = [table.add_compact(old_model, t) for t in old_spec["trees"]]
+        return {"type": "forest", "trees": trees + _describe(estimator, table)["trees"]}
+    if old_spec["type"] == "voting":
+        return {
+            "type": "voting",
+            "estimators": [
+                _describe_update(s, old_model, e, table)
+                for s, e in zip(old_spec["estimators"], estimator.estimators_)
+            ],
+            "weights": None if estimator.weights is None else [float(w) for w in estimator._weights_not_none],
+        }
+    return _describe(estimator, table)
+
+
+def _write_compact(path: str, meta: dict, arrays: dict) -> None:
+    os.makedirs(path, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(path, name + ".npy"), np.ascontiguousarray(array), allow_pickle=False)
+    with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+
+def export_compact(
+    path: str,
+    single_estimator,
+    fold_estimators: list,
+    fold_index,
+    conformity_scores,
+) -> dict:
+    """Write a compact model from its fitted parts and return its meta data."""
+    table = _TreeTable()
+    meta = {
+        "format_version": FORMAT_VERSION,
+        "method": "plus",
+        "n_features": int(single_estimator.n_features_in_),
+        "single_estimator": _describe(single_estimator, table),
+        "fold_estimators": [_describe(e, table) for e in fold_estimators],
+    }
+
+    arrays = table.arrays()
+    arrays["fold_index"] = np.asarray(fold_index, dtype=np.int16)
+    arrays["conformity_scores"] = np.asarray(conformity_scores, dtype=np.float64)
+    _write_compact(path, meta, arrays)
+    return meta
+
+
+def export_split(path: str, single_estimator, conformity_scores) -> dict:
+    """Write a split-conformal model: one estimator and its calibration residuals."""
+    table = _TreeTable()
+    meta = {
+        "format_version": FORMAT_VERSION,
+        "method": "base",
+        "n_features": int(single_estimator.n_features_in_),
+        "single_estimator": _describe(single_estimator, table),
+        "fold_estimators": [],
+    }
+
+    arrays = table.arrays()
+    arrays["fold_index"] = np.zeros(0, dtype=np.int16)
+    arrays["conformity_scores"] = np.sort(np.asarray(conformity_scores, dtype=np.float64))
+    _write_compact(path, meta, arrays)
+    return meta
+
+
+def export_update(
+    path: str,
+    old_model,
+    single_estimator,
+    fold_estimators: list,
+    fold_index,
+    X,
+    y,
+) -> dict:
+    """Write a compact model that updates ``old_model`` with newly fitted parts.
+
+    Forests (also inside voting ensembles) keep the trees of ``old_model`` and
+    add those of the new forests; trees and AdaBoost models are replaced. The
+    conformity scores are recomputed out of fold on the full training set
+    ``X``, ``y``, whose rows ``fold_index`` assigns to the CV folds.
+    """
+    table = _TreeTable()
+    meta = {
+        "format_version": FORMAT_VERSION,
+        "method": "plus",
+        "n_features": int(np.shape(X)[1]),
+        "single_estimator": _describe_update(old_model.meta["single_estimator"], old_model, single_estimator, table),
+        "fold_estimators": [
+            _describe_update(old_spec, old_model, e, table)
+            for old_spec, e in zip(old_model.meta["fold_estimators"], fold_estimators)
+        ],
+    }
+
+    arrays = table.arrays()
+    arrays["fold_index"] = np.asarray(fold_index, dtype=np.int16)
+    updated = CompactMapieRegressor(meta, {**arrays, "conformity_scores": np.zeros(len(y))})
+    arrays["conformity_scores"] = np.abs(np.asarray(y, dtype=np.float64) - updated.predict_out_of_fold(X))
+    _write_compact(path, meta, arrays)
+    return meta
+
+
+def export_mapie(mapie, path: str) -> dict:
+    """Export a fitted ``MapieRegressor`` using CV+ ("plus") or split conformal.
+
+    Split conformal means ``method="base"`` with ``cv="prefit"``: a fitted
+    estimator calibrated on held-out data.
+    """
+    from mapie.conformity_scores import AbsoluteConformityScore
+
+    if type(mapie.conformity_score_function_) is not AbsoluteConformityScore:
+        raise ValueError("Only the absolute conformity score can be exported")
+    if mapie.method == "base" and mapie.cv == "prefit":
+        return export_split(path, mapie.estimator_.single_estimator_, mapie.conformity_scores_)
+    if mapie.method != "plus" or mapie.agg_function not in ("mean", None):
+        raise ValueError(f"Only method='plus' with mean aggregation can be exported, got '{mapie.method}'")
+
+    # k_ marks, for every training sample, the fold that left it out
+    k = np.nan_to_num(mapie.estimator_.k_, nan=0.0)
+    if not np.all(k.sum(axis=1) == 1):
+        raise ValueError("Every training sample must be left out by exactly one CV fold")
+
+    return export_compact(
+        path,
+        mapie.estimator_.single_estimator_,
+        mapie.estimator_.estimators_,
+        np.argmax(k, axis=1),
+        mapie.conformity_scores_,
+    )
+
+
+def compact_entry(model_dir: str, directory: str) -> dict:
+    """Manifest entry for a compact model written to ``model_dir/directory``."""
+    path = os.path.join(model_dir, directory)
+    return {
+        "file": directory,
+        "format": "compact",
+        "size_bytes": sum(entry.stat().st_size for entry in os.scandir(path)),
+        "sha256": checksum(path),
+    }
+
+
+def export_models_compact(models: dict, model_dir: str = MODEL_DIR, version: int = None, fields: dict = None) -> dict:
+    """Export every MapieRegressor in ``models`` and write the store manifest.
+
+    With a ``version`` the models go to new ``<slug>-v<version>`` directories,
+    so processes still reading the previous version are not disturbed, and
+    the version is published to the model registry. ``fields`` are extra
+    manifest entries, e.g. the feature schema file and metrics.
+
+    Without a ``version`` the manifest is replaced, which is refused once the
+    directory holds published versions: running apps would swap to the
+    exported models and the version history would be lost.
+    """
+    if version is None and os.path.exists(os.path.join(model_dir, MANIFEST_FILE)) \
+            and read_manifest(model_dir).get("versions"):
+        raise ValueError(f"{model_dir} holds published model versions; export with a version "
+                         f"or into another directory")
+    entries = {}
+    for name, mapie in models.items():
+        directory = model_slug(name) if version is None else versioned_name(model_slug(name), version)
+        export_mapie(mapie, os.path.join(model_dir, directory))
+        entries[name] = compact_entry(model_dir, directory)
+
+    manifest = {"models": entries, **(fields or {})}
+    if version is None:
+        write_manifest(manifest, model_dir)
+        return manifest
+    return publish_version({**manifest, "version": version}, model_dir)
+
+
+# ---------------------------------------------------------------------------
+# Load and predict (NumPy only)
+# ---------------------------------------------------------------------------
+
+def _spec_trees(spec: dict) -> list:
+    # Tree ids an estimator description reads from
+    if spec["type"] == "tree":
+        return [spec["tree"]]
+    if spec["type"] == "voting":
+        return [t for s in spec["estimators"] for t in _spec_trees(s)]
+    return list(spec["trees"])
+
+
+class CompactMapieRegressor:
+    """Prediction-only stand-in for a fitted ``MapieRegressor``."""
+
+    def __init__(self, meta: dict, arrays: dict):
+        self.meta = meta
+        self.method = meta["method"]
+        self.n_features_in_ = meta["n_features"]
+        self.conformity_scores_ = arrays["conformity_scores"]
+        self.fold_index = arrays["fold_index"]
+        self._roots = arrays["roots"]
+        self._feature = arrays["feature"]
+        self._threshold = arrays["threshold"]
+        self._left = arrays["children_left"]
+        self._right = arrays["children_right"]
+        self._value = arrays["value"]
+        self._cover = arrays.get("cover")
+        self._all_trees = np.arange(len(self._roots))
+        self._single_trees = np.array(_spec_trees(meta["single_estimator"]), dtype=np.int64)
+
+    def _tree_values(self, X: np.ndarray, trees: np.ndarray) -> np.ndarray:
+        """Leaf values of the given trees for every row, shape (n_rows, n_trees_total).
+
+        Every (row, tree) pair is a lane and all lanes step down their trees
+        together, so one loop iteration advances every tree by one level.
+        Lanes that reached a leaf drop out of the next iteration.
+        """
+        n_rows = X.shape[0]
+        rows = np.repeat(np.arange(n_rows), len(trees))
+        node = np.tile(self._roots[trees], n_rows)
+        lanes = np.arange(node.size)
+        while lanes.size:
+            current = node[lanes]
+            left = self._left[current]
+            inner = left != -1
+            lanes, current, left = lanes[inner], current[inner], left[inner]
+            go_left = X[rows[lanes], self._feature[current]] <= self._threshold[current]
+            node[lanes] = np.where(go_left, left, self._right[current])
+
+        values = np.empty((n_rows, len(self._roots)))
+        values[:, trees] = self._value[node].reshape(n_rows, len(trees))
+        return values
+
+    def _predict_spec(self, spec: dict, values: np.ndarray) -> np.ndarray:
+        kind = spec["type"]
+        if kind == "tree":
+            return values[:, spec["tree"]]
+        if kind == "forest":
+            # Sequential sum in tree order, then divide, like RandomForestRegressor
+            preds = values[:, spec["trees"]].T
+            return np.cumsum(preds, axis=0)[-1] / len(spec["trees"])
+        if kind == "adaboost":
+            # Weighted median of the boosted trees, like AdaBoostRegressor
+            preds = values[:, spec["trees"]]
+            sorted_idx = np.argsort(preds, axis=1)
+            weight_cdf = np.cumsum(np.asarray(spec["weights"])[sorted_idx], axis=1, dtype=np.float64)
+            median_or_above = weight_cdf >= 0.5 * weight_cdf[:, -1][:, np.newaxis]
+            median_idx = median_or_above.argmax(axis=1)
+            rows = np.arange(values.shape[0])
+            return preds[rows, sorted_idx[rows, median_idx]]
+        if kind == "voting":
+            preds = np.column_stack([self._predict_spec(s, values) for s in spec["estimators"]])
+            return np.average(preds, axis=1, weights=spec["weights"])
+        if kind == "boosting":
+            # Baseline plus the tree outputs, which already include the learning rate
+            return spec["init"] + values[:, spec["trees"]].sum(axis=1)
+        raise ValueError(f"Unknown estimator type '{kind}'")
+
+    def _prepare(self, X) -> np.ndarray:
+        # Trees compare float32 features against float64 thresholds
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"X has shape {X.shape}, expected (n_samples, {self.n_features_in_})")
+        return X
+
+    def predict_multi(self, X):
+        """Point predictions and the per training sample out-of-fold predictions."""
+        if self.method != "plus":
+            raise ValueError("Split-conformal models have no out-of-fold predictions")
+        X = self._prepare(X)
+        values = self._tree_values(X, self._all_trees)
+        y_pred = self._predict_spec(self.meta["single_estimator"], values)
+        fold_preds = np.column_stack([self._predict_spec(s, values) for s in self.meta["fold_estimators"]])
+        return y_pred, fold_preds[:, self.fold_index]
+
+    def predict_out_of_fold(self, X) -> np.ndarray:
+        """Prediction for every training sample from the fold model that left it out.
+
+        ``X`` holds the training samples in the order of ``fold_index``.
+        """
+        if self.method != "plus":
+            raise ValueError("Split-conformal models have no out-of-fold predictions")
+        X = self._prepare(X)
+        if X.shape[0] != len(self.fold_index):
+            raise ValueError(f"Expected {len(self.fold_index)} training samples, got {X.shape[0]}")
+        y_pred = np.empty(X.shape[0])
+        for k, spec in enumerate(self.meta["fold_estimators"]):
+            rows = np.flatnonzero(np.asarray(self.fold_index) == k)
+            trees = np.array(_spec_trees(spec), dtype=np.int64)
+            y_pred[rows] = self._predict_spec(spec, self._tree_values(X[rows], trees))
+        return y_pred
+
+    def predict(self, X, alpha=None):
+        """Same return values as ``MapieRegressor.predict(X, alpha=alpha)``."""
+        if alpha is None:
+            X = self._prepare(X)
+            values = self._tree_values(X, self._single_trees)
+            return self._predict_spec(self.meta["single_estimator"], values)
+        return compute_outputs(self, X).predict(alpha)
+
+
+def load_compact(path: str, mmap: bool = True) -> CompactMapieRegressor:
+    with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported compact model format {meta.get('format_version')} in {path}")
+
+    mmap_mode = "r" if mmap else None
+    arrays = {
+        name: np.load(os.path.join(path, name + ".npy"), mmap_mode=mmap_mode, allow_pickle=False)
+        for name in TREE_ARRAYS + OPTIONAL_ARRAYS + ("roots", "fold_index", "conformity_scores")
+        if name not in OPTIONAL_ARRAYS or os.path.exists(os.path.join(path, name + ".npy"))
+    }
+    return CompactMapieRegressor(meta, arrays)
+
+
+# ---------------------------------------------------------------------------
+# Benchmark against the scikit-learn / MAPIE models
+# ---------------------------------------------------------------------------
+
+def benchmark(models: dict, X: np.ndarray, model_dir: str = MODEL_DIR, alpha: float = 0.1, repeats: int = 200) -> list:
+    """Single-row ``predict(row, alpha)`` latency of the pickled and compact models.
+
+    Also checks that both give bit-identical predictions and intervals for all of ``X``.
+    """
+    store = ModelStore(model_dir, max_resident=len(models))
+    results = []
+    for name, mapie in models.items():
+        compact = store.get(name)
+        y_ref, pis_ref = mapie.predict(X, alpha=alpha)
+        y, pis = compact.predict(X, alpha=alpha)
+        identical = bool(np.array_equal(y_ref, y) and np.array_equal(pis_ref, pis))
+
+        for engine, model in (("sklearn", mapie), ("compact", compact)):
+            latencies = []
+            for i in range(repeats):
+                row = X[i % len(X)][np.newaxis]
+                start = time.perf_counter()
+                model.predict(row, alpha=alpha)
+                latencies.append((time.perf_counter() - start) * 1000)
+            results.append({
+                "model": name,
+                "engine": engine,
+                "p50_ms": float(np.percentile(latencies, 50)),
+                "p99_ms": float(np.percentile(latencies, 99)),
+                "identical": identical,
+            })
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert apartment_models.pickle into the compact model format.")
+    parser.add_argument("--pickle", default="apartment_models.pickle", help="Combined pickle written by the notebook")
+    parser.add_argument("--model-dir", default=MODEL_DIR,
+                        help="Directory for the compact models and manifest (unused with --benchmark)")
+    parser.add_argument("--benchmark", action="store_true", help="Compare single-row latency with the pickled models")
+    parser.add_argument("--repeats", type=int, default=200, help="Predictions per model and engine when benchmarking")
+    args = parser.parse_args()
+
+    with open(args.pickle, "rb") as f:
+        models = pickle.load(f)
+
+    if not args.benchmark:
+        try:
+            manifest = export_models_compact(models, args.model_dir)
+        except ValueError as exc:
+            parser.exit(1, f"{exc}\n")
+        for name, entry in manifest["models"].items():
+            print(f"{name}: {entry['file']}/ ({entry['size_bytes'] / 1e6:.1f} MB)")
+    else:
+        import warnings
+        from dataset import load_apartments
+        from features import FeatureEncoder, build_schema, clean_apartments
+
+        apartments = clean_apartments(load_apartments())
+        X = FeatureEncoder(build_schema(apartments)).encode_frame(apartments)
+        # The pickled models were fitted on a DataFrame and warn about plain arrays
+        warnings.filterwarnings("ignore", message="X does not have valid feature names")
+        print(f"\n{'model':<14} {'engine':<8} {'p50 ms':>9} {'p99 ms':>9}  identical")
+        # A throwaway export, so the benchmark never touches the served models
+        with tempfile.TemporaryDirectory() as model_dir:
+            export_models_compact(models, model_dir)
+            for r in benchmark(models, X, model_dir, repeats=args.repeats):
+                print(f"{r['model']:<14} {r['engine']:<8} {r['p50_ms']:>9.2f} {r['p99_ms']:>9.2f}  {r['identical']}")
@@ -0,0 +1,148 @@
+"""Nearest-neighbour search for comparable sold apartments.
+
+``ComparablesIndex`` places every sold apartment in a small feature space,
+built once over the cleaned dataset, and indexes it with a KD-tree:
+position in km, area, rent, room count, floor and the three yes/no flags. Each
+feature is divided by ``SCALES``, the difference that counts as about as
+dissimilar as one km of distance, so a query is a plain Euclidean k-nearest
+search that never scans the whole dataset.
+
+A query is placed at the ``latitude``/``longitude`` of ``user_data`` when the
+user picked an address, otherwise at the median position of the sold
+apartments in the chosen location area. Areas without sales use
+``AREA_CENTERS``.
+
+Usage:
+    python comparables.py --location-area Södermalm --rooms 2 --area 50 --rent 2500 --floor 3
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+# Difference in each feature that weighs as much as one km of distance
+SCALES = {
+    "area": 10.0,
+    "rent": 1000.0,
+    "number_of_rooms": 1.0,
+    "floor": 3.0,
+    "has_elevator": 1.0,
+    "has_fireplace": 1.0,
+    "has_outside": 1.0,
+}
+FLAG_COLS = ("has_elevator", "has_fireplace", "has_outside")
+KM_PER_DEGREE = 111.2
+# Approximate centers of the form's location areas that have no sales
+AREA_CENTERS = {
+    "Skeppsholmen": (59.3247, 18.0847),
+    "Djurgården": (59.3262, 18.1157),
+    "Långholmen": (59.3218, 18.0283),
+    "Riddarholmen": (59.3246, 18.0644),
+}
+DEFAULT_K = 5
+
+
+class ComparablesIndex:
+    """KD-tree over scaled apartment features for k-nearest comparables."""
+
+    def __init__(self, df: pd.DataFrame, leafsize: int = 16):
+        self.df = df.reset_index(drop=True)
+        latitude = self.df["latitude"].to_numpy(dtype=float)
+        longitude = self.df["longitude"].to_numpy(dtype=float)
+        # Local flat projection; fine at the scale of one city
+        self._lat0 = float(np.median(latitude)) if len(latitude) else 59.33
+        self._lon_km = KM_PER_DEGREE * np.cos(np.radians(self._lat0))
+
+        self.centers = {
+            area: (float(group["latitude"].median()), float(group["longitude"].median()))
+            for area, group in self.df.groupby("location_area", observed=True)
+        }
+        for area, center in AREA_CENTERS.items():
+            self.centers.setdefault(area, center)
+        # Unknown areas fall back to the middle of the dataset
+        self._fallback = (self._lat0, float(np.median(longitude)) if len(longitude) else 18.07)
+
+        self.tree = cKDTree(self._points(latitude, longitude, self.df), leafsize=leafsize)
+
+    def _points(self, latitude, longitude, values) -> np.ndarray:
+        columns = [
+            (np.asarray(latitude, dtype=float) - self._lat0) * KM_PER_DEGREE,
+            np.asarray(longitude, dtype=float) * self._lon_km,
+        ]
+        for col, scale in SCALES.items():
+            value = values[col]
+            if col in FLAG_COLS:
+                value = (np.asarray(value, dtype=object) == "yes").astype(float)
+            columns.append(np.asarray(value, dtype=float) / scale)
+        return np.column_stack(columns)
+
+    def center(self, location_area: str) -> tuple:
+        return self.centers.get(location_area, self._fallback)
+
+    def position(self, user_data: dict) -> tuple:
+        if user_data.get("latitude") is not None and user_data.get("longitude") is not None:
+            return float(user_data["latitude"]), float(user_data["longitude"])
+        return self.center(user_data["location_area"])
+
+    def nearest(self, user_data: dict, k: int = DEFAULT_K) -> tuple:
+        """Row positions and scaled distances of the ``k`` nearest apartments."""
+        k = min(k, len(self.df))
+        if k == 0:
+            return np.array([], dtype=int), np.array([])
+        latitude, longitude = self.position(user_data)
+        point = self._points([latitude], [longitude], {col: [user_data[col]] for col in SCALES})[0]
+        distances, positions = self.tree.query(point, k=k)
+        return np.atleast_1d(positions), np.atleast_1d(distances)
+
+    def query(self, user_data: dict, k: int = DEFAULT_K) -> pd.DataFrame:
+        """The ``k`` most similar sold apartments, nearest first.
+
+        ``similarity_distance`` is the scaled distance, ``distance_km`` the
+        distance from the query position.
+        """
+        positions, distances = self.nearest(user_data, k)
+        latitude, longitude = self.position(user_data)
+        rows = self.df.iloc[positions].copy()
+        rows["similarity_distance"] = distances
+        rows["distance_km"] = np.hypot(
+            (rows["latitude"].to_numpy(dtype=float) - latitude) * KM_PER_DEGREE,
+            (rows["longitude"].to_numpy(dtype=float) - longitude) * self._lon_km,
+        )
+        return rows
+
+if __name__ == "__main__":
+    from dataset import DATASET_FILE, RAW_CSV, load_apartments
+
+    parser = argparse.ArgumentParser(description="Find comparable sold apartments.")
+    parser.add_argument("--location-area", default="Södermalm", help="Location area of the apartment")
+    parser.add_argument("--rooms", type=float, default=2, help="Number of rooms")
+    parser.add_argument("--area", type=float, default=50, help="Living area in m²")
+    parser.add_argument("--rent", type=float, default=2500, help="Monthly rent in SEK")
+    parser.add_argument("--floor", type=float, default=3, help="Floor level")
+    parser.add_argument("--elevator", default="yes", choices=["yes", "no"])
+    parser.add_argument("--fireplace", default="no", choices=["yes", "no"])
+    parser.add_argument("--outside", default="no", choices=["yes", "no"])
+    parser.add_argument("-k", type=int, default=DEFAULT_K, help="Number of comparables")
+    parser.add_argument("--dataset", default=DATASET_FILE, help="Typed dataset written by dataset.py")
+    parser.add_argument("--csv", default=RAW_CSV, help="Raw CSV, ingested when the dataset is missing or stale")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = ComparablesIndex(load_apartments(args.dataset, args.csv))
+    build_ms = (time.perf_counter() - start) * 1000
+    user_data = {
+        "location_area": args.location_area, "number_of_rooms": args.rooms, "area": args.area,
+        "rent": args.rent, "floor": args.floor, "has_elevator": args.elevator,
+        "has_fireplace": args.fireplace, "has_outside": args.outside,
+    }
+    start = time.perf_counter()
+    index.nearest(user_data, args.k)
+    search_ms = (time.perf_counter() - start) * 1000
+    comparables = index.query(user_data, args.k)
+
+    print(comparables[["adress", "location_area", "number_of_rooms", "area", "rent", "floor",
+                       "sold_price", "distance_km", "similarity_distance"]].to_string(index=False))
+    print(f"Index over {len(index.df):,} apartments built in {build_ms:.0f} ms, search took {search_ms:.3f} ms")
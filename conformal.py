@@ -0,0 +1,104 @@
+"""Conformal prediction intervals for many alphas from one ensemble evaluation.
+
+With MAPIE's CV+ ("plus") method the interval for a row is a pair of quantiles
+over the training samples of ``out-of-fold prediction -/+ conformity score``.
+Only the quantile level depends on alpha, so ``ConformalOutputs`` evaluates the
+ensemble once, sorts both distributions and then answers any alpha, or a whole
+grid of them, with an index lookup. The bounds match
+``MapieRegressor.predict(X, alpha=alpha)`` exactly.
+
+Split-conformal models (MAPIE's ``method="base"`` on a held-out calibration set)
+only need the point prediction and one quantile of the sorted calibration
+residuals per alpha; ``SplitConformalOutputs`` answers them the same way.
+"""
+
+import numpy as np
+
+# Alphas offered by the slider on the prediction page
+ALPHA_GRID = np.round(np.arange(0.10, 0.90 + 1e-9, 0.01), 2)
+
+
+def check_alpha(alpha) -> np.ndarray:
+    alpha_np = np.atleast_1d(np.asarray(alpha, dtype=float))
+    if np.any((alpha_np <= 0) | (alpha_np >= 1)):
+        raise ValueError("Invalid alpha. Allowed values are between 0 and 1.")
+    return alpha_np
+
+
+def _quantile_index(alpha_ref: np.ndarray, n_calib: int) -> np.ndarray:
+    # MAPIE's finite-sample correction followed by NumPy's "lower" quantile
+    alpha_cor = np.clip(np.ceil(alpha_ref * (n_calib + 1)) / n_calib, a_min=0, a_max=1)
+    return np.floor((n_calib - 1) * alpha_cor).astype(np.intp)
+
+
+class ConformalOutputs:
+    """Sorted CV+ distributions for a batch of rows."""
+
+    def __init__(self, y_pred: np.ndarray, y_pred_multi: np.ndarray, conformity_scores: np.ndarray):
+        conformity_scores = np.asarray(conformity_scores, dtype=float)
+        if np.isnan(conformity_scores).any():
+            raise ValueError("Conformity scores must not contain NaN")
+
+        self.y_pred = np.asarray(y_pred)
+        self.n_calib = conformity_scores.shape[0]
+        # The lower bound is a quantile of the negated values, as in MAPIE
+        self._neg_low = np.sort(-(y_pred_multi + (-conformity_scores)), axis=1)
+        self._up = np.sort(y_pred_multi + conformity_scores, axis=1)
+
+    def intervals(self, alpha) -> np.ndarray:
+        """Bounds of shape (n_samples, 2, n_alpha), like ``MapieRegressor.predict``."""
+        alpha_np = check_alpha(alpha)
+        if np.any(self.n_calib < np.maximum(1 / alpha_np, 1 / (1 - alpha_np))):
+            raise ValueError("Number of samples of the score is too low, 1/alpha (or 1/(1 - alpha)) must be lower than the number of samples.")
+
+        # Lower bound: reversed quantile at alpha, i.e. level (1 - 2 * alpha) + alpha
+        # written the way MAPIE computes it so the float rounding is the same
+        low_idx = _quantile_index((1 - 2 * alpha_np) + alpha_np, self.n_calib)
+        up_idx = _quantile_index(1 - alpha_np, self.n_calib)
+        bound_low = -self._neg_low[:, low_idx]
+        bound_up = self._up[:, up_idx]
+        return np.stack([bound_low, bound_up], axis=1)
+
+    def predict(self, alpha=None):
+        if alpha is None:
+            return self.y_pred
+        return self.y_pred, self.intervals(alpha)
+
+
+class SplitConformalOutputs(ConformalOutputs):
+    """Split-conformal intervals: prediction -/+ a quantile of the residuals."""
+
+    def __init__(self, y_pred: np.ndarray, sorted_scores: np.ndarray):
+        sorted_scores = np.asarray(sorted_scores, dtype=float)
+        if np.isnan(sorted_scores).any():
+            raise ValueError("Conformity scores must not contain NaN")
+
+        self.y_pred = np.asarray(y_pred)
+        self.n_calib = sorted_scores.shape[0]
+        self._scores = sorted_scores
+
+    def intervals(self, alpha) -> np.ndarray:
+        alpha_np = check_alpha(alpha)
+        if np.any(self.n_calib < np.maximum(1 / alpha_np, 1 / (1 - alpha_np))):
+            raise ValueError("Number of samples of the score is too low, 1/alpha (or 1/(1 - alpha)) must be lower than the number of samples.")
+
+        # The same symmetric quantile for every row, as MAPIE's "base" method
+        quantile = self._scores[_quantile_index(1 - alpha_np, self.n_calib)]
+        y_pred = self.y_pred[:, np.newaxis]
+        return np.stack([y_pred + (-quantile), y_pred + quantile], axis=1)
+
+
+def compute_outputs(model, X) -> ConformalOutputs:
+    """Evaluate a fitted ``MapieRegressor`` or ``CompactMapieRegressor`` once."""
+    if getattr(model, "method", None) == "base":
+        # Compact split models store their residuals already sorted
+        scores = model.conformity_scores_
+        if not hasattr(model, "predict_multi"):
+            scores = np.sort(scores)
+        return SplitConformalOutputs(model.predict(X), scores)
+    if hasattr(model, "predict_multi"):
+        y_pred, y_pred_multi = model.predict_multi(X)
+    else:
+        # MapieRegressor with method="plus": low and up multi predictions are equal
+        y_pred, y_pred_multi, _ = model.estimator_.predict(X, ensemble=False)
+    return ConformalOutputs(y_pred, y_pred_multi, model.conformity_scores_)
@@ -0,0 +1,102 @@
+"""Compare the CV+ models with the lightweight split-conformal models.
+
+Both model directories are scored on the test rows recorded with the CV+
+version, so the comparison uses exactly the apartments neither was trained on.
+For every model and alpha the report gives the empirical coverage of the
+prediction intervals and their mean width, plus the artifact size, the number
+of stored trees and the single-row ``predict(row, alpha)`` latency.
+
+Usage:
+    python train.py --lightweight --model-dir models-lite
+    python coverage_report.py --model-dir models --lightweight-dir models-lite
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from conformal import compute_outputs
+from dataset import DATASET_FILE, RAW_CSV, load_apartments
+from features import clean_apartments, load_schema
+from model_store import MODEL_DIR, ModelStore
+from train import encode
+
+REPORT_ALPHAS = (0.05, 0.1, 0.2, 0.5)
+
+
+def test_rows(model_dir: str) -> np.ndarray:
+    store = ModelStore(model_dir)
+    if "split" not in store.manifest:
+        raise ValueError(f"The models in {model_dir} have no recorded training split; run train.py first")
+    return np.load(os.path.join(model_dir, store.manifest["split"]))["test"]
+
+
+def evaluate(model_dir: str, apartments, rows: np.ndarray, alphas=REPORT_ALPHAS, repeats: int = 200) -> list:
+    """Coverage, width, size and latency of every model in ``model_dir``."""
+    store = ModelStore(model_dir, max_resident=1)
+    X, y = encode(apartments.loc[rows], load_schema(model_dir, store.manifest["schema"]))
+    mode = store.manifest.get("mode", "cv+")
+
+    results = []
+    for name in store.names:
+        model = store.get(name)
+        intervals = compute_outputs(model, X).intervals(alphas)
+        covered = (y[:, np.newaxis] >= intervals[:, 0]) & (y[:, np.newaxis] <= intervals[:, 1])
+
+        latencies = []
+        for i in range(repeats):
+            start = time.perf_counter()
+            model.predict(X[i % len(X)][np.newaxis], alpha=alphas[0])
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        for k, alpha in enumerate(alphas):
+            results.append({
+                "model": name,
+                "mode": mode,
+                "alpha": float(alpha),
+                "coverage": float(covered[:, k].mean()),
+                "mean_width": float(np.mean(intervals[:, 1, k] - intervals[:, 0, k])),
+                "size_mb": store.manifest["models"][name]["size_bytes"] / 1e6,
+                "n_trees": int(len(model._roots)),
+                "p50_ms": float(np.percentile(latencies, 50)),
+            })
+    return results
+
+
+def compare(
+    model_dir: str,
+    lightweight_dir: str,
+    dataset_path: str = DATASET_FILE,
+    csv_path: str = RAW_CSV,
+    alphas=REPORT_ALPHAS,
+    repeats: int = 200,
+) -> list:
+    apartments = clean_apartments(load_apartments(dataset_path, csv_path))
+    rows = test_rows(model_dir)
+    return (evaluate(model_dir, apartments, rows, alphas, repeats)
+            + evaluate(lightweight_dir, apartments, rows, alphas, repeats))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare CV+ and lightweight split-conformal models.")
+    parser.add_argument("--model-dir", default=MODEL_DIR, help="Directory with the CV+ models")
+    parser.add_argument("--lightweight-dir", default="models-lite", help="Directory with the lightweight models")
+    parser.add_argument("--dataset", default=DATASET_FILE, help="Typed dataset written by dataset.py")
+    parser.add_argument("--csv", default=RAW_CSV, help="Raw CSV, ingested when the dataset is missing or stale")
+    parser.add_argument("--alphas", type=float, nargs="+", default=list(REPORT_ALPHAS), help="Alphas to evaluate")
+    parser.add_argument("--repeats", type=int, default=200, help="Single-row predictions timed per model")
+    parser.add_argument("--output", default=None, help="Also write the report as JSON")
+    args = parser.parse_args()
+
+    results = compare(args.model_dir, args.lightweight_dir, args.dataset, args.csv, args.alphas, args.repeats)
+    print(f"{'model':<14} {'mode':<12} {'alpha':>5} {'coverage':>9} {'width SEK':>11} "
+          f"{'size MB':>8} {'trees':>6} {'p50 ms':>7}")
+    for r in results:
+        print(f"{r['model']:<14} {r['mode']:<12} {r['alpha']:>5.2f} {r['coverage']:>9.3f} "
+              f"{r['mean_width']:>11,.0f} {r['size_mb']:>8.1f} {r['n_trees']:>6} {r['p50_ms']:>7.2f}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
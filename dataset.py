@@ -0,0 +1,129 @@
+"""Cleaned, typed columnar copy of ``apartments_sweden.csv``.
+
+The raw CSV stores ``rent`` with thousands separators ("2,172") and has rows with
+missing values, so every reader used to re-parse and re-clean it. ``ingest``
+does that once and writes an uncompressed Feather file with float32 numerics and
+categorical ``location_area`` / ``has_*`` columns. ``load_apartments`` memory-maps
+that file, re-ingesting first when it is missing or older than its sources.
+
+The stored rows are the CSV without missing values, followed by the sales in
+``APPENDED_CSV``; training-only filters such as ``floor <= 10`` stay in
+``features.clean_apartments``. Sales added by ``retrain.py`` live only in that
+second CSV, so a re-ingest (a fresh checkout, an edited CSV) rebuilds the same
+rows in the same positions and the training splits stay valid.
+``merge_apartments`` adds new listings after the stored rows without writing
+anything and drops listings already present; ``save_appended`` writes them once
+the new model version is published.
+
+Usage:
+    python dataset.py --csv apartments_sweden.csv --output apartments.feather
+    python dataset.py --appended apartments_appended.csv
+"""
+
+import argparse
+import os
+import time
+
+import pandas as pd
+import pyarrow.feather as feather
+
+from features import parse_rent
+
+RAW_CSV = "apartments_sweden.csv"
+DATASET_FILE = "apartments.feather"
+# Sales added after the original dataset, in the CSV's columns
+APPENDED_CSV = "apartments_appended.csv"
+FLOAT_COLS = ["latitude", "longitude", "number_of_rooms", "area", "rent", "floor", "sold_price"]
+CATEGORY_COLS = ["location_area", "has_elevator", "has_fireplace", "has_outside"]
+
+
+def prepare(df: pd.DataFrame) -> pd.DataFrame:
+    """Drop incomplete rows and convert the columns to their stored dtypes."""
+    df = df.dropna().copy()
+    df["rent"] = parse_rent(df["rent"])
+    df = df.dropna(subset=["rent"])
+    df[FLOAT_COLS] = df[FLOAT_COLS].astype("float32")
+    for col in CATEGORY_COLS:
+        df[col] = df[col].astype("category")
+    df["adress"] = df["adress"].astype(str)
+    return df.reset_index(drop=True)
+
+
+def _write(df: pd.DataFrame, output_path: str) -> None:
+    tmp_path = output_path + ".tmp"
+    # Uncompressed so the file can be memory-mapped instead of decoded
+    feather.write_feather(df.reset_index(drop=True), tmp_path, compression="uncompressed")
+    os.replace(tmp_path, output_path)
+
+
+def ingest(csv_path: str = RAW_CSV, output_path: str = DATASET_FILE, appended_path: str = APPENDED_CSV) -> pd.DataFrame:
+    """Parse and clean the CSV and the appended sales once and write the typed Feather file."""
+    raw = pd.read_csv(csv_path)
+    if os.path.exists(appended_path):
+        # Appended rows are complete, so they keep their positions after the CSV's rows
+        # Read as text like the CSV's "2,172", so parse_rent handles both the same way
+        appended = pd.read_csv(appended_path, dtype={"rent": str})[raw.columns]
+        raw = pd.concat([raw, appended], ignore_index=True)
+    df = prepare(raw)
+    _write(df, output_path)
+    return df
+
+
+def load_apartments(path: str = DATASET_FILE, csv_path: str = RAW_CSV, memory_map: bool = True,
+                    appended_path: str = APPENDED_CSV) -> pd.DataFrame:
+    """Load the typed dataset, ingesting the sources first if the file is stale."""
+    if not os.path.exists(path) or any(
+        os.path.exists(source) and os.path.getmtime(source) > os.path.getmtime(path)
+        for source in (csv_path, appended_path)
+    ):
+        ingest(csv_path, path, appended_path)
+    table = feather.read_table(path, memory_map=memory_map)
+    # One block per column avoids copying everything into a consolidated block
+    return table.to_pandas(split_blocks=True)
+
+
+def _row_keys(df: pd.DataFrame) -> pd.Series:
+    # One hash per sale over every stored column
+    return pd.util.hash_pandas_object(df.astype(str), index=False)
+
+
+def merge_apartments(new_rows: pd.DataFrame, path: str = DATASET_FILE, csv_path: str = RAW_CSV,
+                     appended_path: str = APPENDED_CSV) -> tuple:
+    """The stored dataset with raw listings added after it, without writing anything.
+
+    Listings that are already stored, or repeated within ``new_rows``, are
+    dropped, so an update that failed before ``save_appended`` can simply be
+    run again. Returns the combined dataset and the row labels of the new rows.
+    """
+    df = load_apartments(path, csv_path, memory_map=False, appended_path=appended_path)
+    new = prepare(new_rows)[df.columns]
+    keys = _row_keys(new)
+    new = new[~keys.isin(set(_row_keys(df))) & ~keys.duplicated()]
+    new.index = pd.RangeIndex(len(df), len(df) + len(new))
+    combined = pd.concat([df, new])
+    for col in CATEGORY_COLS:
+        # concat falls back to object when the category levels differ
+        combined[col] = combined[col].astype("category")
+    return combined, new.index.to_numpy()
+
+
+def save_appended(combined: pd.DataFrame, new_labels, path: str = DATASET_FILE,
+                  appended_path: str = APPENDED_CSV) -> None:
+    """Record the rows ``merge_apartments`` added in ``APPENDED_CSV`` and the Feather file."""
+    new = combined.loc[new_labels]
+    new.to_csv(appended_path, mode="a", header=not os.path.exists(appended_path), index=False)
+    # Written after the CSV, so the Feather file is not stale
+    _write(combined, path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write the cleaned, typed apartment dataset.")
+    parser.add_argument("--csv", default=RAW_CSV, help="Raw apartment dataset")
+    parser.add_argument("--output", default=DATASET_FILE, help="Feather file to write")
+    parser.add_argument("--appended", default=APPENDED_CSV, help="Sales added by retrain.py")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    df = ingest(args.csv, args.output, args.appended)
+    print(f"Wrote {len(df)} rows to {args.output} "
+          f"({os.path.getsize(args.output) / 1e6:.2f} MB) in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,142 @@
+"""Model diagnostics computed from the deployed models on their test split.
+
+``evaluate_model`` scores one model of a store on the test rows its version
+recorded at training time (``training_split-vN.npz``) and returns small, chart
+ready summaries: RMSE and R², interval coverage and width for every alpha of
+the prediction page's slider, a residual histogram, predicted vs. actual binned
+and as a downsampled scatter, and permutation importance of the form inputs.
+The Additional Information page caches the result per model version, so the
+numbers always describe the models that are being served.
+
+Usage:
+    python diagnostics.py --model-dir models
+    python diagnostics.py --models "Decision Tree" --output diagnostics.json
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+
+from conformal import ALPHA_GRID, compute_outputs
+from dataset import DATASET_FILE, RAW_CSV, load_apartments
+from features import clean_apartments, load_schema
+from model_store import MODEL_DIR, ModelStore
+
+RESIDUAL_BINS = 40
+CALIBRATION_BINS = 20
+SCATTER_POINTS = 300
+PERMUTATION_SEED = 0
+# Form inputs; a category is permuted together with all of its one-hot columns
+INPUT_FEATURES = (
+    "location_area", "number_of_rooms", "area", "rent", "floor",
+    "has_elevator", "has_fireplace", "has_outside",
+)
+
+
+def has_test_split(manifest: dict) -> bool:
+    return "split" in manifest
+
+
+def load_test_split(store: ModelStore, dataset_path: str = DATASET_FILE, csv_path: str = RAW_CSV) -> tuple:
+    """Encoded inputs and prices of the test rows of the store's version."""
+    from train import encode
+
+    if not has_test_split(store.manifest):
+        raise ValueError(f"Model version {store.version} has no recorded training split; run train.py first")
+    rows = np.load(os.path.join(store.model_dir, store.manifest["split"]))["test"]
+    apartments = clean_apartments(load_apartments(dataset_path, csv_path))
+    schema = load_schema(store.model_dir, store.manifest["schema"])
+    X, y = encode(apartments.loc[rows], schema)
+    return X, y, schema
+
+
+def feature_columns(schema: dict) -> dict:
+    """Column positions of every form input in the encoded rows."""
+    return {
+        feature: [i for i, col in enumerate(schema["columns"])
+                  if col == feature or col.startswith(feature + "_")]
+        for feature in INPUT_FEATURES
+    }
+
+
+def rmse(y_true: np.ndarray, y_pred: np.ndarray) -> float:
+    return float(np.sqrt(np.mean((y_true - y_pred) ** 2)))
+
+
+def r2(y_true: np.ndarray, y_pred: np.ndarray) -> float:
+    return float(1 - np.sum((y_true - y_pred) ** 2) / np.sum((y_true - y_true.mean()) ** 2))
+
+
+def permutation_importance(model, X: np.ndarray, y: np.ndarray, schema: dict, baseline: float) -> dict:
+    """Increase in RMSE when the rows of one input are shuffled."""
+    rng = np.random.default_rng(PERMUTATION_SEED)
+    order = rng.permutation(len(X))
+    importance = {}
+    for feature, columns in feature_columns(schema).items():
+        X_permuted = X.copy()
+        X_permuted[:, columns] = X[order][:, columns]
+        importance[feature] = rmse(y, model.predict(X_permuted)) - baseline
+    return importance
+
+
+def evaluate_model(model, X: np.ndarray, y: np.ndarray, schema: dict, alphas=ALPHA_GRID) -> dict:
+    """Diagnostics of one model on encoded test rows."""
+    outputs = compute_outputs(model, X)
+    y_pred = np.asarray(outputs.y_pred, dtype=float)
+    intervals = outputs.intervals(alphas)
+    covered = (y[:, np.newaxis] >= intervals[:, 0]) & (y[:, np.newaxis] <= intervals[:, 1])
+    residuals = y - y_pred
+    baseline = rmse(y, y_pred)
+
+    counts, edges = np.histogram(residuals, bins=RESIDUAL_BINS)
+    # Mean actual price per quantile bin of the prediction
+    bins = np.unique(np.quantile(y_pred, np.linspace(0, 1, CALIBRATION_BINS + 1)))
+    which = np.clip(np.searchsorted(bins, y_pred, side="right") - 1, 0, len(bins) - 2)
+    filled = np.flatnonzero(np.bincount(which, minlength=len(bins) - 1))
+    # Evenly spaced rows by actual price keep the scatter's shape at any size
+    sample = np.argsort(y)[np.linspace(0, len(y) - 1, min(SCATTER_POINTS, len(y))).astype(int)]
+
+    return {
+        "n_test": int(len(y)),
+        "rmse": baseline,
+        "r2": r2(y, y_pred),
+        "alphas": [float(alpha) for alpha in alphas],
+        "coverage": covered.mean(axis=0).tolist(),
+        "mean_width": (intervals[:, 1] - intervals[:, 0]).mean(axis=0).tolist(),
+        "residual_counts": counts.tolist(),
+        "residual_edges": edges.tolist(),
+        "binned_predicted": [float(y_pred[which == b].mean()) for b in filled],
+        "binned_actual": [float(y[which == b].mean()) for b in filled],
+        "scatter_actual": y[sample].tolist(),
+        "scatter_predicted": y_pred[sample].tolist(),
+        "importance": permutation_importance(model, X, y, schema, baseline),
+    }
+
+
+def evaluate_store(store: ModelStore, names: list = None, dataset_path: str = DATASET_FILE,
+                   csv_path: str = RAW_CSV) -> dict:
+    X, y, schema = load_test_split(store, dataset_path, csv_path)
+    return {name: evaluate_model(store.get(name), X, y, schema) for name in names or store.names}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate the deployed models on their test split.")
+    parser.add_argument("--model-dir", default=MODEL_DIR, help="Directory with the model manifest")
+    parser.add_argument("--models", nargs="+", default=None, help="Models to evaluate (default: all)")
+    parser.add_argument("--dataset", default=DATASET_FILE, help="Typed dataset written by dataset.py")
+    parser.add_argument("--csv", default=RAW_CSV, help="Raw CSV, ingested when the dataset is missing or stale")
+    parser.add_argument("--output", default=None, help="Also write the diagnostics as JSON")
+    args = parser.parse_args()
+
+    store = ModelStore(args.model_dir, max_resident=1)
+    results = evaluate_store(store, args.models, args.dataset, args.csv)
+    print(f"Model version {store.version}")
+    print(f"{'model':<14} {'RMSE':>11} {'R2':>6} {'cov 90%':>8} {'cov 50%':>8}")
+    for name, d in results.items():
+        coverage = dict(zip(np.round(d["alphas"], 2), d["coverage"]))
+        print(f"{name:<14} {d['rmse']:>11,.0f} {d['r2']:>6.3f} {coverage[0.1]:>8.3f} {coverage[0.5]:>8.3f}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
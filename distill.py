@@ -0,0 +1,343 @@
+"""Distilled fast-tier models that answer for the full ensembles.
+
+``distill`` draws a dense uniform sample of the User Input page's input space
+(every location area, room count, floor and yes/no flag, area 10-200 m² and
+rent 500-5000 SEK), labels it with a teacher model's prediction and CV+
+bounds, and fits one histogram gradient boosting student per output: the log
+of the prediction, and the distance from the prediction to the lower and upper
+bound at every ``STUDENT_ALPHAS`` level, relative to the prediction. The
+students are stored like the other compact models, in one
+``<slug>-student-v<N>`` directory per teacher and model version, and walk
+small 31-leaf trees instead of the ensemble's deep ones and its CV+ fold
+distributions.
+
+A second sample, never used for fitting, gives the fidelity report: the
+student's relative error against the teacher for the prediction and the bounds
+at every ``REPORT_ALPHAS`` level, overall and per region (location area and
+room count). ``Student.serves`` only trusts the student in regions where the
+90th percentile of the row's worst output error is at most ``ERROR_THRESHOLD``;
+the prediction page uses the full model everywhere else. Bounds for levels
+between the student's are interpolated linearly.
+
+``train.py`` and ``retrain.py`` distill ``DISTILL_MODELS`` after publishing a
+version, so the app uses the full models until the students exist.
+
+Usage:
+    python distill.py --model-dir models
+    python distill.py --models "Soft Voting" AdaBoost --threshold 0.05
+"""
+
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from compact_model import FORMAT_VERSION, _describe, _TreeTable, _write_compact, load_compact
+from conformal import compute_outputs
+from features import SCHEMA_FILE, FeatureEncoder, load_schema
+from model_store import MODEL_DIR, ModelStore, model_slug
+from price_surface import OTHER_AREA, _interpolation, grid_axes
+
+SAMPLE_SIZE = 40000
+HOLDOUT_SIZE = 5000
+SAMPLE_SEED = 0
+AREA_RANGE = (10.0, 200.0)
+RENT_RANGE = (500.0, 5000.0)
+STUDENT_ALPHAS = (0.1, 0.2, 0.3, 0.5, 0.7, 0.8, 0.9)
+REPORT_ALPHAS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9)
+# max_depth bounds the padded trees of Student; 31 leaves fit in depth 6
+STUDENT_PARAMS = {"max_iter": 150, "max_leaf_nodes": 31, "max_depth": 6, "learning_rate": 0.2,
+                  "early_stopping": False, "random_state": 0}
+# 90th percentile relative error a region may have and still be served by the student
+ERROR_THRESHOLD = 0.07
+DISTILL_MODELS = ("Soft Voting",)
+CHUNK_ROWS = 1000
+
+
+def student_dir(name: str, version: int) -> str:
+    return f"{model_slug(name)}-student-v{version}"
+
+
+def target_names(alphas=STUDENT_ALPHAS) -> list:
+    return ["log_prediction"] + [f"{bound}_{alpha}" for alpha in alphas for bound in ("lower", "upper")]
+
+
+def region_key(location_area, number_of_rooms) -> str:
+    return f"{location_area}|{float(number_of_rooms):g}"
+
+
+def sample_inputs(schema: dict, n: int, seed: int = SAMPLE_SEED) -> pd.DataFrame:
+    """``n`` inputs drawn uniformly from the User Input page's form."""
+    rng = np.random.default_rng(seed)
+    axes = grid_axes(schema)
+    df = pd.DataFrame({
+        axis: rng.choice(np.array(levels, dtype=object), n)
+        for axis, levels in axes.items()
+    })
+    df["number_of_rooms"] = df["number_of_rooms"].astype(float)
+    df["floor"] = df["floor"].astype(float)
+    df["area"] = rng.uniform(*AREA_RANGE, n)
+    df["rent"] = rng.uniform(*RENT_RANGE, n)
+    return df
+
+
+def teacher_outputs(model, X: np.ndarray, alphas) -> tuple:
+    """Prediction and bounds of the teacher, shapes (n,) and (n, 2, len(alphas))."""
+    predictions, intervals = [], []
+    for start in range(0, len(X), CHUNK_ROWS):
+        # Chunks keep the sorted CV+ distributions of a batch small
+        outputs = compute_outputs(model, X[start:start + CHUNK_ROWS])
+        predictions.append(outputs.y_pred)
+        intervals.append(outputs.intervals(alphas))
+    return np.concatenate(predictions), np.concatenate(intervals)
+
+
+def _targets(prediction: np.ndarray, intervals: np.ndarray) -> np.ndarray:
+    # Bounds as distances from the prediction relative to it, in target_names order
+    columns = [np.log(np.maximum(prediction, 1.0))]
+    for k in range(intervals.shape[2]):
+        columns.append((prediction - intervals[:, 0, k]) / prediction)
+        columns.append((intervals[:, 1, k] - prediction) / prediction)
+    return np.column_stack(columns)
+
+
+def fidelity(inputs: pd.DataFrame, prediction: np.ndarray, intervals: np.ndarray,
+             teacher_prediction: np.ndarray, teacher_intervals: np.ndarray, alphas=REPORT_ALPHAS) -> dict:
+    """Relative error of a student against its teacher, overall and per region.
+
+    Errors are divided by the teacher's prediction, so a bound that is off by
+    50,000 SEK on a 5 MSEK apartment counts as 1%.
+    """
+    prediction_error = np.abs(prediction - teacher_prediction) / teacher_prediction
+    bound_error = np.abs(intervals - teacher_intervals) / teacher_prediction[:, np.newaxis, np.newaxis]
+    # Worst output of every row, which decides whether a region is served
+    row_error = np.maximum(prediction_error, bound_error.max(axis=(1, 2)))
+
+    def summary(error):
+        return {"p50": float(np.quantile(error, 0.5)), "p90": float(np.quantile(error, 0.9)),
+                "max": float(error.max())}
+
+    regions = {}
+    keys = [region_key(a, r) for a, r in zip(inputs["location_area"], inputs["number_of_rooms"])]
+    for key, rows in pd.Series(np.arange(len(keys))).groupby(keys):
+        rows = rows.to_numpy()
+        regions[key] = {"rows": int(len(rows)), **summary(row_error[rows])}
+    return {
+        "rows": int(len(prediction)),
+        "prediction": summary(prediction_error),
+        "bounds": {
+            f"{alpha:g}": {"lower": summary(bound_error[:, 0, k]), "upper": summary(bound_error[:, 1, k])}
+            for k, alpha in enumerate(alphas)
+        },
+        "regions": regions,
+    }
+
+
+class Student:
+    """Distilled stand-in for one teacher model of one model version.
+
+    At load time every tree is padded to a complete binary tree of the
+    students' ``max_depth``: a leaf above the last level becomes a node whose
+    threshold is infinite, so every row goes left down to a copy of the leaf.
+    A row then takes exactly ``max_depth`` vectorized steps through all trees
+    at once, and one matrix product sums the leaves of each output.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.meta = model.meta
+        self.teacher = self.meta["teacher"]
+        self.version = self.meta["version"]
+        self.alphas = np.array(self.meta["alphas"])
+        self.threshold = self.meta["threshold"]
+        self.report = self.meta.get("fidelity", {"regions": {}})
+        self._areas = set(self.meta["areas"])
+
+        specs = [self.meta["targets"][name] for name in target_names(self.meta["alphas"])]
+        n_trees = len(model._roots)
+        self._init = np.array([spec["init"] for spec in specs])
+        # Which output every tree adds to
+        self._assign = np.zeros((n_trees, len(specs)))
+        for k, spec in enumerate(specs):
+            self._assign[spec["trees"], k] = 1.0
+
+        left, right = np.asarray(model._left), np.asarray(model._right)
+        node = np.asarray(model._roots)[:, np.newaxis]
+        self._levels = []
+        for _ in range(self.meta["params"]["max_depth"]):
+            leaf = left[node] == -1
+            self._levels.append((
+                np.arange(n_trees) * node.shape[1],
+                np.where(leaf, 0, model._feature[node]).ravel(),
+                np.where(leaf, np.inf, model._threshold[node]).ravel(),
+            ))
+            node = np.stack([np.where(leaf, node, left[node]), np.where(leaf, node, right[node])], axis=-1)
+            node = node.reshape(n_trees, -1)
+        if (left[node] != -1).any():
+            raise ValueError(f"Student trees are deeper than max_depth {self.meta['params']['max_depth']}")
+        self._leaf_base = np.arange(n_trees) * node.shape[1]
+        self._leaf_value = np.asarray(model._value)[node].ravel()
+
+    def region_error(self, user_data: dict) -> float:
+        """90th percentile relative error of the student in the region of ``user_data``."""
+        area = user_data["location_area"]
+        if area not in self._areas:
+            area = OTHER_AREA
+        region = self.report["regions"].get(region_key(area, user_data["number_of_rooms"]))
+        # Regions without holdout rows are never served
+        return region["p90"] if region else float("inf")
+
+    def serves(self, user_data: dict) -> bool:
+        return self.region_error(user_data) <= self.threshold
+
+    def outputs(self, X) -> np.ndarray:
+        """Raw outputs in ``target_names`` order, shape (n_rows, n_outputs)."""
+        X = np.asarray(X, dtype=np.float64).reshape(-1, self.model.n_features_in_)
+        chunks = []
+        for start in range(0, len(X), CHUNK_ROWS):
+            x = X[start:start + CHUNK_ROWS]
+            rows = np.arange(len(x))[:, np.newaxis]
+            position = np.zeros((len(x), len(self._leaf_base)), dtype=np.intp)
+            for base, feature, threshold in self._levels:
+                node = base + position
+                position = 2 * position + (x[rows, feature[node]] > threshold[node])
+            chunks.append(self._leaf_value[self._leaf_base + position] @ self._assign + self._init)
+        return np.concatenate(chunks)
+
+    def predict(self, X, alpha) -> tuple:
+        """Prediction and bounds shaped like ``MapieRegressor.predict(X, alpha)``."""
+        outputs = self.outputs(X)
+        prediction = np.exp(outputs[:, 0])
+        lower, upper = outputs[:, 1::2], outputs[:, 2::2]
+        # Linear between the student's levels, flat outside them
+        i, t = _interpolation(self.alphas, np.atleast_1d(np.asarray(alpha, dtype=float)))
+        lower = lower[:, i] * (1 - t) + lower[:, i + 1] * t
+        upper = upper[:, i] * (1 - t) + upper[:, i + 1] * t
+        # CV+ bounds at large alpha can lie on either side of the prediction, so no clipping
+        intervals = np.stack([prediction[:, np.newaxis] * (1 - lower),
+                              prediction[:, np.newaxis] * (1 + upper)], axis=1)
+        return prediction, intervals
+
+
+def student_mtime(model_dir: str = MODEL_DIR, version: int = 0, name: str = "Soft Voting"):
+    """Modification time of a student's ``meta.json``, or None while it does not exist.
+
+    Callers that cache students key the cache on this, so a student written
+    after its version was published is picked up without a restart.
+    """
+    try:
+        return os.path.getmtime(os.path.join(model_dir, student_dir(name, version), "meta.json"))
+    except FileNotFoundError:
+        return None
+
+
+def load_student(model_dir: str = MODEL_DIR, version: int = 0, name: str = "Soft Voting") -> Student:
+    path = os.path.join(model_dir, student_dir(name, version))
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        raise FileNotFoundError(f"No student of {name} for model version {version}; run distill.py")
+    return Student(load_compact(path))
+
+
+def distill(model_dir: str = MODEL_DIR, models: list = None, threshold: float = ERROR_THRESHOLD) -> dict:
+    """Fit and export students of the active model version; returns their fidelity reports."""
+    from sklearn.ensemble import HistGradientBoostingRegressor
+
+    store = ModelStore(model_dir, max_resident=1)
+    schema = load_schema(model_dir, store.manifest.get("schema", SCHEMA_FILE))
+    encoder = FeatureEncoder(schema)
+    train_inputs = sample_inputs(schema, SAMPLE_SIZE, SAMPLE_SEED)
+    holdout_inputs = sample_inputs(schema, HOLDOUT_SIZE, SAMPLE_SEED + 1)
+    X = encoder.encode_frame(train_inputs)
+    holdout_X = encoder.encode_frame(holdout_inputs)
+    names = target_names()
+
+    reports = {}
+    for name in models or DISTILL_MODELS:
+        start = time.perf_counter()
+        teacher = store.get(name)
+        y = _targets(*teacher_outputs(teacher, X, STUDENT_ALPHAS))
+        holdout_prediction, holdout_intervals = teacher_outputs(teacher, holdout_X, REPORT_ALPHAS)
+        label_seconds = time.perf_counter() - start
+
+        mark = time.perf_counter()
+        # Fitted one after another; each fit already uses every core
+        students = [HistGradientBoostingRegressor(**STUDENT_PARAMS).fit(X, y[:, k]) for k in range(len(names))]
+        fit_seconds = time.perf_counter() - mark
+
+        table = _TreeTable()
+        meta = {
+            "format_version": FORMAT_VERSION,
+            "method": "student",
+            "n_features": int(X.shape[1]),
+            "targets": {target: _describe(student, table) for target, student in zip(names, students)},
+            "fold_estimators": [],
+            "teacher": name,
+            "version": store.version,
+            "fingerprint": store.fingerprint,
+            "areas": grid_axes(schema)["location_area"],
+            "alphas": list(STUDENT_ALPHAS),
+            "params": STUDENT_PARAMS,
+            "sample_size": SAMPLE_SIZE,
+            "threshold": threshold,
+        }
+        # load_compact expects a single estimator; the student's is its prediction
+        meta["single_estimator"] = meta["targets"]["log_prediction"]
+        arrays = table.arrays()
+        arrays["fold_index"] = np.zeros(0, dtype=np.int16)
+        arrays["conformity_scores"] = np.zeros(0)
+
+        out_dir = os.path.join(model_dir, student_dir(name, store.version))
+        tmp_dir = out_dir + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        # Written without the report first, so the student can score itself
+        _write_compact(tmp_dir, meta, arrays)
+        student = Student(load_compact(tmp_dir, mmap=False))
+        prediction, intervals = student.predict(holdout_X, REPORT_ALPHAS)
+        report = fidelity(holdout_inputs, prediction, intervals, holdout_prediction, holdout_intervals)
+        report.update({
+            "threshold": threshold,
+            "served_regions": sum(r["p90"] <= threshold for r in report["regions"].values()),
+            "total_regions": len(report["regions"]),
+            "label_seconds": label_seconds,
+            "fit_seconds": fit_seconds,
+            "nodes": int(len(arrays["feature"])),
+        })
+        meta["fidelity"] = report
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        # Swap the finished directory in, so readers never see a partial student
+        shutil.rmtree(out_dir, ignore_errors=True)
+        os.replace(tmp_dir, out_dir)
+        reports[name] = report
+    return reports
+
+
+def print_report(name: str, report: dict) -> None:
+    print(f"{name}: student of {report['nodes']:,} nodes, labels {report['label_seconds']:.0f}s, "
+          f"fits {report['fit_seconds']:.0f}s")
+    p = report["prediction"]
+    print(f"  prediction   relative error p50 {p['p50']:.2%}  p90 {p['p90']:.2%}  max {p['max']:.2%}")
+    for alpha, bounds in report["bounds"].items():
+        print(f"  alpha {alpha:<5}  lower p50 {bounds['lower']['p50']:.2%} p90 {bounds['lower']['p90']:.2%}  "
+              f"upper p50 {bounds['upper']['p50']:.2%} p90 {bounds['upper']['p90']:.2%}")
+    print(f"  served in {report['served_regions']} of {report['total_regions']} regions "
+          f"(p90 error at most {report['threshold']:.0%}), the full model answers elsewhere")
+
+
+if __name__ == "__main__":
+    import warnings
+
+    parser = argparse.ArgumentParser(description="Distill fast students from the active model version.")
+    parser.add_argument("--model-dir", default=MODEL_DIR, help="Directory with the model manifest")
+    parser.add_argument("--models", nargs="+", default=list(DISTILL_MODELS), help="Teacher models")
+    parser.add_argument("--threshold", type=float, default=ERROR_THRESHOLD,
+                        help="Largest 90th percentile relative error of a served region")
+    args = parser.parse_args()
+    warnings.filterwarnings("ignore")
+
+    for name, report in distill(args.model_dir, args.models, args.threshold).items():
+        print_report(name, report)
@@ -0,0 +1,163 @@
+"""Persisted one-hot feature schema and a direct encoder for prediction rows.
+
+The models were trained on ``pd.get_dummies`` of the cleaned dataset. Instead of
+re-reading ``apartments_sweden.csv`` and re-running ``get_dummies`` to find the
+column layout for one row, the layout is saved once at training time as
+``feature_schema.json`` next to the models and ``FeatureEncoder`` fills in a
+NumPy row directly.
+
+Usage:
+    python features.py --csv apartments_sweden.csv --model-dir models
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from model_store import MODEL_DIR
+
+SCHEMA_FILE = "feature_schema.json"
+NUMERIC_COLS = ["area", "rent"]
+CAT_COLS = ['location_area', 'number_of_rooms', 'floor',
+            'has_elevator', 'has_fireplace', 'has_outside']
+FEATURE_COLS = ['location_area', 'number_of_rooms', 'area', 'rent', 'floor',
+                'has_elevator', 'has_fireplace', 'has_outside']
+
+
+def parse_rent(rent: pd.Series) -> pd.Series:
+    # Rent is stored with thousands separators, e.g. "2,172"
+    if rent.dtype == object:
+        rent = rent.str.replace(',', '', regex=False)
+    return pd.to_numeric(rent, errors='coerce')
+
+
+def clean_apartments(df: pd.DataFrame) -> pd.DataFrame:
+    # Same cleaning as the notebook
+    df = df.dropna()
+    df = df[df['floor'] <= 10].copy()
+    df['rent'] = parse_rent(df['rent'])
+    # Levels only seen in dropped rows must not turn into one-hot columns
+    for col in df.select_dtypes('category').columns:
+        df[col] = df[col].cat.remove_unused_categories()
+    return df
+
+
+def build_schema(features: pd.DataFrame) -> dict:
+    """Record the column order and category levels ``get_dummies`` produces."""
+    features = features[FEATURE_COLS]
+    columns = list(pd.get_dummies(features, columns=CAT_COLS).columns)
+
+    categories = {}
+    for col in CAT_COLS:
+        levels = sorted(features[col].unique())
+        # JSON cannot hold numpy scalars
+        categories[col] = [level.item() if hasattr(level, "item") else level for level in levels]
+
+    return {"columns": columns, "numeric": NUMERIC_COLS, "categories": categories}
+
+
+def extend_schema(schema: dict, features: pd.DataFrame) -> tuple:
+    """Add category levels of ``features`` that ``schema`` does not know yet.
+
+    New one-hot columns are appended after the existing ones, so the columns
+    the current models were trained on keep their positions. Returns the
+    extended schema and the list of added columns.
+    """
+    columns = list(schema["columns"])
+    categories = {col: list(levels) for col, levels in schema["categories"].items()}
+    added = []
+    for col in CAT_COLS:
+        known = {FeatureEncoder._key(level) for level in categories[col]}
+        for level in sorted(features[col].unique()):
+            level = level.item() if hasattr(level, "item") else level
+            if FeatureEncoder._key(level) in known:
+                continue
+            if not isinstance(level, str):
+                # Same column name get_dummies gives a float column, e.g. "floor_11.0"
+                level = float(level)
+            categories[col].append(level)
+            columns.append(f"{col}_{level}")
+            added.append(f"{col}_{level}")
+    return {"columns": columns, "numeric": schema["numeric"], "categories": categories}, added
+
+
+def save_schema(schema: dict, model_dir: str = MODEL_DIR, file_name: str = SCHEMA_FILE) -> None:
+    os.makedirs(model_dir, exist_ok=True)
+    with open(os.path.join(model_dir, file_name), "w", encoding="utf-8") as f:
+        json.dump(schema, f, indent=2, ensure_ascii=False)
+
+
+def load_schema(model_dir: str = MODEL_DIR, file_name: str = SCHEMA_FILE) -> dict:
+    with open(os.path.join(model_dir, file_name), encoding="utf-8") as f:
+        return json.load(f)
+
+
+class FeatureEncoder:
+    """Turns a ``user_data`` dict into the one-hot row the models expect."""
+
+    def __init__(self, schema: dict):
+        self.schema = schema
+        self.columns = schema["columns"]
+        position = {name: i for i, name in enumerate(self.columns)}
+
+        self._numeric = [(col, position[col]) for col in schema["numeric"]]
+        # Map every known level to its column; numeric levels are keyed as floats
+        # so that floor 3 and floor 3.0 land in the same column
+        self._lookup = {}
+        for col, levels in schema["categories"].items():
+            self._lookup[col] = {
+                self._key(level): position[f"{col}_{level}"] for level in levels
+            }
+
+    @staticmethod
+    def _key(value):
+        if isinstance(value, str):
+            return value
+        return float(value)
+
+    @property
+    def n_features(self) -> int:
+        return len(self.columns)
+
+    def encode(self, user_data: dict) -> np.ndarray:
+        """Return a (1, n_features) row. Unseen category levels stay all zero."""
+        row = np.zeros((1, len(self.columns)))
+        for col, i in self._numeric:
+            row[0, i] = float(user_data[col])
+        for col, lookup in self._lookup.items():
+            i = lookup.get(self._key(user_data[col]))
+            if i is not None:
+                row[0, i] = 1.0
+        return row
+
+    def encode_frame(self, df: pd.DataFrame) -> np.ndarray:
+        """Encode every row of ``df`` at once into an (n_rows, n_features) array.
+
+        Numeric features that are missing come out as NaN so callers can skip
+        those rows; unseen category levels stay all zero like in ``encode``.
+        """
+        X = np.zeros((len(df), len(self.columns)))
+        for col, i in self._numeric:
+            X[:, i] = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=float)
+        for col, lookup in self._lookup.items():
+            values = df[col]
+            values = values.astype(float) if pd.api.types.is_numeric_dtype(values) else values.astype(object)
+            positions = values.map(lookup).to_numpy(dtype=float)
+            known = ~np.isnan(positions)
+            X[np.flatnonzero(known), positions[known].astype(int)] = 1.0
+        return X
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write the feature schema used by the prediction page.")
+    parser.add_argument("--csv", default="apartments_sweden.csv", help="Raw apartment dataset")
+    parser.add_argument("--model-dir", default=MODEL_DIR, help="Directory the models are stored in")
+    args = parser.parse_args()
+
+    from dataset import DATASET_FILE, load_apartments
+    schema = build_schema(clean_apartments(load_apartments(DATASET_FILE, args.csv)))
+    save_schema(schema, args.model_dir)
+    print(f"Wrote {len(schema['columns'])} columns to {os.path.join(args.model_dir, SCHEMA_FILE)}")
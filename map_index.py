@@ -0,0 +1,167 @@
+"""Precomputed indexes for the Map page.
+
+``MapIndex`` groups the apartments by their exact-match filters
+(``location_area``, ``number_of_rooms``, ``floor`` and the ``has_*`` flags) once,
+with every group sorted by ``area``. A query is then a dictionary lookup plus a
+binary search for the area range, and only the rows inside that range are
+checked against the maximum rent. ``GridIndex`` buckets latitude/longitude
+into grid cells so bounding-box queries only touch the cells they overlap.
+``cluster_points`` groups points into zoom-dependent cells for the map's
+cluster markers.
+"""
+
+import numpy as np
+import pandas as pd
+
+MATCH_COLS = ["location_area", "number_of_rooms", "floor",
+              "has_elevator", "has_fireplace", "has_outside"]
+
+
+def _normalize(value):
+    # Session state holds ints (2 rooms), the dataset floats (2.0)
+    if isinstance(value, str):
+        return value
+    return float(value)
+
+
+class GridIndex:
+    """Uniform lat/lon grid over point positions for bounding-box queries."""
+
+    def __init__(self, latitude, longitude, cell_size: float = 0.01):
+        self.latitude = np.asarray(latitude, dtype=float)
+        self.longitude = np.asarray(longitude, dtype=float)
+        self.cell_size = cell_size
+
+        if len(self.latitude) == 0:
+            self.lat0 = self.lon0 = 0.0
+            self.n_rows = self.n_cols = 1
+        else:
+            self.lat0 = self.latitude.min()
+            self.lon0 = self.longitude.min()
+            self.n_rows = int((self.latitude.max() - self.lat0) // cell_size) + 1
+            self.n_cols = int((self.longitude.max() - self.lon0) // cell_size) + 1
+
+        # Cell ids are row major, so the cells of one grid row are contiguous
+        cells = self._row(self.latitude) * self.n_cols + self._col(self.longitude)
+        self._order = np.argsort(cells, kind="stable")
+        self._sorted_cells = cells[self._order]
+
+    def _row(self, latitude):
+        return np.clip(((latitude - self.lat0) // self.cell_size).astype(int), 0, self.n_rows - 1)
+
+    def _col(self, longitude):
+        return np.clip(((longitude - self.lon0) // self.cell_size).astype(int), 0, self.n_cols - 1)
+
+    def query(self, south: float, west: float, north: float, east: float) -> np.ndarray:
+        """Positions of the points inside the box, in ascending order."""
+        if len(self.latitude) == 0:
+            return np.array([], dtype=int)
+
+        row_lo, row_hi = self._row(np.array([south, north]))
+        col_lo, col_hi = self._col(np.array([west, east]))
+        candidates = []
+        for row in range(row_lo, row_hi + 1):
+            lo = np.searchsorted(self._sorted_cells, row * self.n_cols + col_lo, side="left")
+            hi = np.searchsorted(self._sorted_cells, row * self.n_cols + col_hi, side="right")
+            candidates.append(self._order[lo:hi])
+
+        positions = np.concatenate(candidates) if candidates else np.array([], dtype=int)
+        # Cells on the edge of the box can hold points just outside it
+        lat = self.latitude[positions]
+        lon = self.longitude[positions]
+        inside = (lat >= south) & (lat <= north) & (lon >= west) & (lon <= east)
+        return np.sort(positions[inside])
+
+
+class MapIndex:
+    """Filter index and spatial index over the cleaned apartment data."""
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df.reset_index(drop=True)
+        self._area = self.df["area"].to_numpy(dtype=float)
+        self._rent = self.df["rent"].to_numpy(dtype=float)
+
+        self._by_area = self._build(MATCH_COLS)
+        # Same groups without location_area for "Show all Stockholm"
+        self._all_areas = self._build(MATCH_COLS[1:])
+        self.grid = GridIndex(self.df["latitude"], self.df["longitude"])
+
+    def _build(self, cols: list) -> dict:
+        groups = {}
+        for key, positions in self.df.groupby(cols, sort=False, observed=True).indices.items():
+            positions = positions[np.argsort(self._area[positions], kind="stable")]
+            key = tuple(_normalize(v) for v in key)
+            groups[key] = (self._area[positions], self._rent[positions], positions)
+        return groups
+
+    def query(
+        self,
+        location_area: str,
+        number_of_rooms: float,
+        floor: float,
+        has_elevator: str,
+        has_fireplace: str,
+        has_outside: str,
+        area_range: tuple,
+        max_rent: float,
+        all_areas: bool = False,
+    ) -> np.ndarray:
+        """Row positions matching the Map page filters, in dataset order."""
+        key = (number_of_rooms, floor, has_elevator, has_fireplace, has_outside)
+        if all_areas:
+            group = self._all_areas.get(tuple(_normalize(v) for v in key))
+        else:
+            group = self._by_area.get(tuple(_normalize(v) for v in (location_area,) + key))
+        if group is None:
+            return np.array([], dtype=int)
+
+        area_sorted, rent, positions = group
+        area_min, area_max = area_range
+        lo = np.searchsorted(area_sorted, area_min, side="left")
+        hi = np.searchsorted(area_sorted, area_max, side="right")
+        matches = positions[lo:hi][rent[lo:hi] <= max_rent]
+        return np.sort(matches)
+
+    def rows(self, positions) -> pd.DataFrame:
+        return self.df.iloc[positions]
+
+
+def cluster_cell_size(zoom: float, cluster_pixels: int = 60) -> float:
+    # A 256 px map tile spans 360 / 2**zoom degrees
+    return 360.0 / 2 ** zoom * cluster_pixels / 256
+
+
+def cluster_points(latitude, longitude, price, zoom: float) -> pd.DataFrame:
+    """Aggregate points into grid clusters sized for the given zoom level.
+
+    Returns one row per non-empty cell with the mean position, the number of
+    apartments and their median price.
+    """
+    latitude = np.asarray(latitude, dtype=float)
+    longitude = np.asarray(longitude, dtype=float)
+    price = np.asarray(price, dtype=float)
+    if len(latitude) == 0:
+        return pd.DataFrame(columns=["latitude", "longitude", "count", "median_price"])
+
+    cell = cluster_cell_size(zoom)
+    rows = np.floor(latitude / cell).astype(np.int64)
+    cols = np.floor(longitude / cell).astype(np.int64)
+    _, cluster = np.unique(np.stack([rows, cols], axis=1), axis=0, return_inverse=True)
+    cluster = cluster.ravel()
+
+    count = np.bincount(cluster)
+    mean_lat = np.bincount(cluster, weights=latitude) / count
+    mean_lon = np.bincount(cluster, weights=longitude) / count
+
+    # Median per cluster: sort by (cluster, price) and take the middle element(s)
+    order = np.lexsort((price, cluster))
+    sorted_price = price[order]
+    start = np.concatenate([[0], np.cumsum(count)[:-1]])
+    median = (sorted_price[start + (count - 1) // 2] + sorted_price[start + count // 2]) / 2
+
+    return pd.DataFrame({
+        "latitude": mean_lat,
+        "longitude": mean_lon,
+        "count": count,
+        "median_price": median,
+    })
@@ -0,0 +1,295 @@
+"""Precomputed market statistics per location area and room count.
+
+``MarketStats`` keeps, for every (``location_area``, ``number_of_rooms``) group
+of the cleaned dataset, the number of sales, column sums for the means and a
+quantile sketch of the sold price, the price per m² and the rent. A sketch is a
+histogram over logarithmic buckets whose bounds grow by ``GAMMA``, so any
+quantile is known to within ``RELATIVE_ACCURACY`` of its value. Sketches,
+counts and sums merge by addition: statistics of a whole area add up its room
+groups, and new sales are added to the existing groups without touching the
+old rows.
+
+The statistics are saved to ``market_stats.npz`` together with the number of
+dataset rows they include. ``refresh_stats`` only adds the rows after that
+watermark, which ``dataset.save_appended`` keeps stable, and rebuilds from
+scratch only when the dataset was rewritten underneath it.
+
+Usage:
+    python market_stats.py                       # build or refresh the file
+    python market_stats.py --location-area Södermalm --rooms 2
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from dataset import DATASET_FILE, RAW_CSV, load_apartments
+from features import clean_apartments
+
+STATS_FILE = "market_stats.npz"
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+# Sketched values and the range their buckets cover; values outside are clamped
+SKETCH_RANGES = {
+    "price": (1e5, 1e9),
+    "price_per_m2": (1e3, 1e7),
+    "rent": (10.0, 1e5),
+}
+MEAN_COLS = ("price", "price_per_m2", "rent", "area")
+QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+
+
+def _bucket_offset(lo: float) -> int:
+    return int(np.ceil(np.log(lo) / np.log(GAMMA)))
+
+
+def n_buckets(metric: str) -> int:
+    lo, hi = SKETCH_RANGES[metric]
+    return _bucket_offset(hi) - _bucket_offset(lo) + 1
+
+
+def bucket_of(metric: str, values) -> np.ndarray:
+    """Sketch bucket of every value; bucket k covers (GAMMA**(k-1), GAMMA**k]."""
+    lo, hi = SKETCH_RANGES[metric]
+    values = np.clip(np.asarray(values, dtype=np.float64), lo, hi)
+    return np.ceil(np.log(values) / np.log(GAMMA)).astype(np.int64) - _bucket_offset(lo)
+
+
+def bucket_value(metric: str, buckets) -> np.ndarray:
+    """Representative value of buckets, within RELATIVE_ACCURACY of any value in them."""
+    k = np.asarray(buckets) + _bucket_offset(SKETCH_RANGES[metric][0])
+    return 2 * GAMMA ** k / (GAMMA + 1)
+
+
+def _columns(df: pd.DataFrame) -> dict:
+    price = df["sold_price"].to_numpy(dtype=np.float64)
+    area = df["area"].to_numpy(dtype=np.float64)
+    return {
+        "price": price,
+        "price_per_m2": price / area,
+        "rent": df["rent"].to_numpy(dtype=np.float64),
+        "area": area,
+    }
+
+
+class MarketStats:
+    """Counts, sums and quantile sketches per (location area, room count)."""
+
+    def __init__(self):
+        self.areas = []
+        self.rooms = np.zeros(0)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.sums = {col: np.zeros(0) for col in MEAN_COLS}
+        self.sketches = {metric: np.zeros((0, n_buckets(metric)), dtype=np.int64) for metric in SKETCH_RANGES}
+        # Dataset rows included so far and the last of them, to detect rewrites
+        self.rows = 0
+        self.last_row = None
+        self._group = {}
+
+    def __len__(self) -> int:
+        return len(self.areas)
+
+    def _group_ids(self, areas: np.ndarray, rooms: np.ndarray) -> np.ndarray:
+        keys = list(zip(areas.tolist(), rooms.tolist()))
+        new = [key for key in dict.fromkeys(keys) if key not in self._group]
+        if new:
+            for key in new:
+                self._group[key] = len(self.areas)
+                self.areas.append(key[0])
+            self.rooms = np.append(self.rooms, [key[1] for key in new])
+            self.counts = np.append(self.counts, np.zeros(len(new), dtype=np.int64))
+            for col in MEAN_COLS:
+                self.sums[col] = np.append(self.sums[col], np.zeros(len(new)))
+            for metric, sketch in self.sketches.items():
+                self.sketches[metric] = np.vstack([sketch, np.zeros((len(new), sketch.shape[1]), dtype=np.int64)])
+        return np.array([self._group[key] for key in keys], dtype=np.int64)
+
+    def add(self, apartments: pd.DataFrame) -> None:
+        """Add cleaned sales to their groups."""
+        if apartments.empty:
+            return
+        groups = self._group_ids(
+            apartments["location_area"].astype(str).to_numpy(),
+            apartments["number_of_rooms"].to_numpy(dtype=np.float64),
+        )
+        n = len(self.areas)
+        self.counts += np.bincount(groups, minlength=n)
+        values = _columns(apartments)
+        for col in MEAN_COLS:
+            self.sums[col] += np.bincount(groups, values[col], minlength=n)
+        for metric, sketch in self.sketches.items():
+            flat = groups * sketch.shape[1] + bucket_of(metric, values[metric])
+            sketch += np.bincount(flat, minlength=sketch.size).reshape(sketch.shape)
+
+    def _select(self, location_area: str = None, rooms: float = None) -> np.ndarray:
+        selected = np.ones(len(self.areas), dtype=bool)
+        if location_area is not None:
+            selected &= np.array(self.areas, dtype=object) == location_area
+        if rooms is not None:
+            selected &= self.rooms == float(rooms)
+        return selected
+
+    def sketch(self, metric: str, location_area: str = None, rooms: float = None) -> np.ndarray:
+        """Merged bucket counts of the matching groups."""
+        return self.sketches[metric][self._select(location_area, rooms)].sum(axis=0)
+
+    def count(self, location_area: str = None, rooms: float = None) -> int:
+        return int(self.counts[self._select(location_area, rooms)].sum())
+
+    def quantiles(self, metric: str, qs=QUANTILES, location_area: str = None, rooms: float = None) -> np.ndarray:
+        counts = self.sketch(metric, location_area, rooms)
+        total = counts.sum()
+        if not total:
+            return np.full(len(qs), np.nan)
+        cumulative = np.cumsum(counts)
+        # Bucket of the sale with rank q * (n - 1), like the nearest-rank quantile
+        buckets = np.searchsorted(cumulative, np.asarray(qs) * (total - 1), side="right")
+        return bucket_value(metric, buckets)
+
+    def percentile(self, metric: str, value: float, location_area: str = None, rooms: float = None) -> float:
+        """Share of the matching sales below ``value``, counting its own bucket as half."""
+        counts = self.sketch(metric, location_area, rooms)
+        total = counts.sum()
+        if not total:
+            return float("nan")
+        bucket = bucket_of(metric, [value])[0]
+        return float((counts[:bucket].sum() + 0.5 * counts[bucket]) / total)
+
+    def histogram(self, metric: str, location_area: str = None, rooms: float = None) -> pd.Series:
+        """Sales per non-empty bucket, indexed by the bucket's value."""
+        counts = self.sketch(metric, location_area, rooms)
+        filled = np.flatnonzero(counts)
+        return pd.Series(counts[filled], index=bucket_value(metric, filled))
+
+    def summary(self, by_rooms: bool = False) -> pd.DataFrame:
+        """Sales, means and medians per location area, or per area and room count."""
+        frame = pd.DataFrame({"location_area": self.areas, "number_of_rooms": self.rooms, "sales": self.counts})
+        for col in MEAN_COLS:
+            frame["sum_" + col] = self.sums[col]
+        keys = ["location_area", "number_of_rooms"] if by_rooms else ["location_area"]
+        groups = frame.groupby(keys, sort=True)
+        table = groups[["sales"] + ["sum_" + col for col in MEAN_COLS]].sum()
+        for col in MEAN_COLS:
+            table["mean_" + col] = table.pop("sum_" + col) / table["sales"]
+        # Medians from the merged sketches of each row's groups
+        codes = groups.ngroup().to_numpy()
+        for metric, sketch in self.sketches.items():
+            merged = np.zeros((len(table), sketch.shape[1]), dtype=np.int64)
+            np.add.at(merged, codes, sketch)
+            cumulative = np.cumsum(merged, axis=1)
+            rank = 0.5 * (cumulative[:, -1] - 1)
+            table["median_" + metric] = bucket_value(metric, (cumulative <= rank[:, np.newaxis]).sum(axis=1))
+        return table.reset_index()
+
+    def save(self, path: str = STATS_FILE) -> None:
+        meta = {"rows": self.rows, "last_row": self.last_row, "relative_accuracy": RELATIVE_ACCURACY,
+                "ranges": SKETCH_RANGES}
+        arrays = {"areas": np.array(self.areas, dtype=str), "rooms": self.rooms, "counts": self.counts}
+        arrays.update({"sum_" + col: values for col, values in self.sums.items()})
+        arrays.update({"sketch_" + metric: sketch for metric, sketch in self.sketches.items()})
+        tmp_path = path + ".tmp.npz"
+        np.savez_compressed(tmp_path, meta=json.dumps(meta), **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str = STATS_FILE) -> "MarketStats":
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta["relative_accuracy"] != RELATIVE_ACCURACY or meta["ranges"] != {
+                metric: list(bounds) for metric, bounds in SKETCH_RANGES.items()
+            }:
+                raise ValueError(f"{path} was written with different sketch settings")
+            stats = cls()
+            stats.areas = data["areas"].tolist()
+            stats.rooms = data["rooms"]
+            stats.counts = data["counts"]
+            stats.sums = {col: data["sum_" + col] for col in MEAN_COLS}
+            stats.sketches = {metric: data["sketch_" + metric] for metric in SKETCH_RANGES}
+        stats.rows, stats.last_row = meta["rows"], meta["last_row"]
+        stats._group = {(area, float(rooms)): i for i, (area, rooms) in enumerate(zip(stats.areas, stats.rooms))}
+        return stats
+
+
+def _row_key(df: pd.DataFrame, row: int) -> list:
+    # Identifies a stored dataset row well enough to notice a rewritten file
+    record = df.iloc[row]
+    return [str(record["adress"]), float(record["sold_price"]), float(record["latitude"]), float(record["longitude"])]
+
+
+def refresh_stats(apartments: pd.DataFrame, path: str = STATS_FILE) -> tuple:
+    """Bring the saved statistics up to date with the raw dataset ``apartments``.
+
+    Only rows after the saved watermark are cleaned and added. Returns the
+    statistics and the number of dataset rows that were added.
+    """
+    stats = None
+    if os.path.exists(path):
+        try:
+            stats = MarketStats.load(path)
+        except (ValueError, KeyError):
+            stats = None
+    if stats is not None and stats.rows and (
+        stats.rows > len(apartments) or _row_key(apartments, stats.rows - 1) != stats.last_row
+    ):
+        # The dataset was rewritten, not appended to
+        stats = None
+    if stats is None:
+        stats = MarketStats()
+    if stats.rows == len(apartments) and os.path.exists(path):
+        return stats, 0
+
+    added = len(apartments) - stats.rows
+    stats.add(clean_apartments(apartments.iloc[stats.rows:]))
+    stats.rows = len(apartments)
+    stats.last_row = _row_key(apartments, stats.rows - 1) if stats.rows else None
+    stats.save(path)
+    return stats, added
+
+
+def source_mtimes(path: str = STATS_FILE, dataset_path: str = DATASET_FILE, csv_path: str = RAW_CSV) -> tuple:
+    """Modification times of the statistics and their sources, as a cache key."""
+    return tuple(os.path.getmtime(p) if os.path.exists(p) else None for p in (path, dataset_path, csv_path))
+
+
+def load_stats(path: str = STATS_FILE, dataset_path: str = DATASET_FILE, csv_path: str = RAW_CSV) -> MarketStats:
+    """Saved statistics, refreshed first when the dataset changed after them."""
+    if os.path.exists(path) and not any(
+        os.path.exists(source) and os.path.getmtime(source) > os.path.getmtime(path)
+        for source in (dataset_path, csv_path)
+    ):
+        try:
+            return MarketStats.load(path)
+        except (ValueError, KeyError):
+            pass
+    return refresh_stats(load_apartments(dataset_path, csv_path), path)[0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or refresh the market statistics per area and room count.")
+    parser.add_argument("--output", default=STATS_FILE, help="Statistics file to write")
+    parser.add_argument("--dataset", default=DATASET_FILE, help="Typed dataset written by dataset.py")
+    parser.add_argument("--csv", default=RAW_CSV, help="Raw CSV, ingested when the dataset is missing or stale")
+    parser.add_argument("--location-area", default=None, help="Print the statistics of one location area")
+    parser.add_argument("--rooms", type=float, default=None, help="Restrict --location-area to one room count")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    stats, added = refresh_stats(load_apartments(args.dataset, args.csv), args.output)
+    print(f"{added:,} new dataset rows added; {int(stats.counts.sum()):,} sales of {stats.rows:,} rows "
+          f"in {len(stats)} groups, "
+          f"{os.path.getsize(args.output) / 1e3:.0f} kB, {time.perf_counter() - start:.2f}s")
+
+    if args.location_area:
+        n = stats.count(args.location_area, args.rooms)
+        print(f"{args.location_area}{'' if args.rooms is None else f', {args.rooms:g} rooms'}: {n} sales")
+        for metric in SKETCH_RANGES:
+            values = stats.quantiles(metric, QUANTILES, args.location_area, args.rooms)
+            print(f"  {metric:<13} " + "  ".join(f"p{q * 100:.0f} {v:>12,.0f}" for q, v in zip(QUANTILES, values)))
+    else:
+        table = stats.summary()
+        print(table[["location_area", "sales", "median_price", "median_price_per_m2", "median_rent"]]
+              .to_string(index=False, float_format=lambda v: f"{v:,.0f}"))
@@ -0,0 +1,107 @@
+"""Side-by-side predictions of every model for one apartment.
+
+``compare_models`` runs one prediction per model in a shared thread pool, so
+comparing all four models takes about as long as the slowest one instead of
+the sum: the compact models' tree traversal and the sort of the CV+
+distributions run in NumPy, which releases the GIL. ``predict_row`` is the
+local prediction for one encoded row; the prediction page passes its own
+function when predictions come from ``prediction_service.py``.
+
+Usage:
+    python model_comparison.py --model-dir models --repeats 50
+"""
+
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from conformal import compute_outputs
+from model_store import MODEL_DIR
+
+
+def predict_row(model, row: np.ndarray, alpha) -> dict:
+    """Prediction and bounds in the prediction cache's format."""
+    prediction, intervals = compute_outputs(model, row).predict(alpha)
+    return {
+        "prediction": float(prediction[0]),
+        "lower": intervals[0, 0].tolist(),
+        "upper": intervals[0, 1].tolist(),
+    }
+
+
+def compare_models(predict, names: list, executor: ThreadPoolExecutor = None) -> tuple:
+    """Run ``predict(name)`` for every model at once.
+
+    Returns ``{name: {"result": ..., "seconds": ...}}`` in the order of
+    ``names`` and the wall time of the whole comparison.
+    """
+    executor = executor or shared_executor()
+
+    def timed(name):
+        start = time.perf_counter()
+        result = predict(name)
+        return {"result": result, "seconds": time.perf_counter() - start}
+
+    start = time.perf_counter()
+    futures = {name: executor.submit(timed, name) for name in names}
+    results = {name: future.result() for name, future in futures.items()}
+    return results, time.perf_counter() - start
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_executor() -> ThreadPoolExecutor:
+    """The thread pool shared by every session in this process."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = ThreadPoolExecutor(max_workers=min(8, (os.cpu_count() or 1) + 4),
+                                         thread_name_prefix="model-comparison")
+        return _shared
+
+
+if __name__ == "__main__":
+    import warnings
+
+    from features import SCHEMA_FILE, FeatureEncoder, load_schema
+    from model_store import ModelStore
+
+    parser = argparse.ArgumentParser(description="Time sequential and parallel predictions of all models.")
+    parser.add_argument("--model-dir", default=MODEL_DIR, help="Directory with the model manifest")
+    parser.add_argument("--alpha", type=float, default=0.1, help="Alpha of the prediction intervals")
+    parser.add_argument("--repeats", type=int, default=50, help="Comparisons timed per mode")
+    args = parser.parse_args()
+    warnings.filterwarnings("ignore")
+
+    store = ModelStore(args.model_dir, max_resident=8)
+    encoder = FeatureEncoder(load_schema(args.model_dir, store.manifest.get("schema", SCHEMA_FILE)))
+    row = encoder.encode({
+        "location_area": "Södermalm", "number_of_rooms": 2, "area": 50, "rent": 2500, "floor": 3,
+        "has_elevator": "yes", "has_fireplace": "no", "has_outside": "no",
+    })
+    models = {name: store.get(name) for name in store.names}
+
+    def predict(name):
+        return predict_row(models[name], row, args.alpha)
+
+    sequential, parallel = [], []
+    for _ in range(args.repeats):
+        start = time.perf_counter()
+        for name in models:
+            predict(name)
+        sequential.append(time.perf_counter() - start)
+        parallel.append(compare_models(predict, list(models))[1])
+    results, _ = compare_models(predict, list(models))
+
+    for name, r in results.items():
+        result = r["result"]
+        print(f"{name:<14} {result['prediction']:>13,.0f} [{result['lower'][0]:>13,.0f}, "
+              f"{result['upper'][0]:>13,.0f}]  {r['seconds'] * 1000:6.2f} ms")
+    print(f"All models: sequential p50 {np.median(sequential) * 1000:.2f} ms, "
+          f"parallel p50 {np.median(parallel) * 1000:.2f} ms on {os.cpu_count()} CPUs")
@@ -0,0 +1,175 @@
+"""Versioned model registry with hot swapping.
+
+``train.py`` and ``retrain.py`` publish every model version into the model
+directory: the artifacts live in ``<slug>-v<N>`` directories, the version's own
+manifest in ``manifest-v<N>.json``, and ``manifest.json`` names the active
+version together with the history of all versions, their SHA-256 checksums and
+their metrics from ``model_performance.csv``.
+
+``ModelRegistry`` serves a ``ModelStore`` for the active version and watches
+``manifest.json`` from a background thread. When it changes, the new version
+is checked and loaded while the old one keeps serving, then the registry
+switches to it in one step and drops the old models.
+
+Usage:
+    python model_registry.py list
+    python model_registry.py verify
+    python model_registry.py activate 3
+"""
+
+import argparse
+import os
+import threading
+import time
+
+from model_store import MANIFEST_FILE, MODEL_DIR, ModelStore, checksum, read_manifest, write_manifest
+
+POLL_SECONDS = float(os.environ.get("MODEL_REGISTRY_POLL", 5))
+
+
+def version_manifest_file(version: int) -> str:
+    return f"manifest-v{version}.json"
+
+
+def publish_version(manifest: dict, model_dir: str = MODEL_DIR) -> dict:
+    """Record ``manifest`` as a new version and make it the active one."""
+    manifest = {key: value for key, value in manifest.items() if key != "versions"}
+    manifest.setdefault("created", time.strftime("%Y-%m-%d %H:%M:%S"))
+    version = manifest["version"]
+    write_manifest(manifest, model_dir, version_manifest_file(version))
+
+    history = []
+    if os.path.exists(os.path.join(model_dir, MANIFEST_FILE)):
+        history = [v for v in read_manifest(model_dir).get("versions", []) if v["version"] != version]
+    history.append({
+        "version": version,
+        "created": manifest["created"],
+        "manifest": version_manifest_file(version),
+        "metrics": manifest.get("metrics", {}),
+    })
+    active = {**manifest, "versions": history}
+    # Written last and atomically; this is what running apps watch
+    write_manifest(active, model_dir)
+    return active
+
+
+def verify(manifest: dict, model_dir: str = MODEL_DIR) -> None:
+    """Raise ``ValueError`` if an artifact does not match its recorded checksum."""
+    for name, entry in manifest["models"].items():
+        expected = entry.get("sha256")
+        if expected and checksum(os.path.join(model_dir, entry["file"])) != expected:
+            raise ValueError(f"Checksum mismatch for {name} in {entry['file']}")
+
+
+def activate(version: int, model_dir: str = MODEL_DIR) -> dict:
+    """Make an already published version the active one, e.g. to roll back."""
+    manifest = read_manifest(model_dir, version_manifest_file(version))
+    verify(manifest, model_dir)
+    history = read_manifest(model_dir).get("versions", [])
+    active = {**manifest, "versions": history}
+    write_manifest(active, model_dir)
+    return active
+
+
+class ModelRegistry:
+    """Serves the active model version and swaps in new ones without a restart."""
+
+    def __init__(self, model_dir: str = MODEL_DIR, max_resident: int = 2,
+                 poll_seconds: float = POLL_SECONDS, watch: bool = True):
+        self.model_dir = model_dir
+        self.poll_seconds = poll_seconds
+        self._lock = threading.Lock()
+        self._mtime = self._manifest_mtime()
+        self._store = ModelStore(model_dir, max_resident)
+        self.status = {"loading": None, "swaps": 0, "last_swap": None, "last_error": None}
+
+        if watch:
+            threading.Thread(target=self._watch, name="model-registry", daemon=True).start()
+
+    @property
+    def store(self) -> ModelStore:
+        """The store of the active version; keep using one store per request."""
+        with self._lock:
+            return self._store
+
+    def _manifest_mtime(self):
+        try:
+            return os.stat(os.path.join(self.model_dir, MANIFEST_FILE)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _watch(self) -> None:
+        while True:
+            time.sleep(self.poll_seconds)
+            try:
+                self.refresh()
+            except Exception as exc:
+                self.status["last_error"] = f"{type(exc).__name__}: {exc}"
+
+    def refresh(self) -> bool:
+        """Switch to the manifest's active version if it changed; True on a swap."""
+        mtime = self._manifest_mtime()
+        if mtime is None or mtime == self._mtime:
+            return False
+        self._mtime = mtime
+
+        current = self.store
+        new_store = ModelStore(self.model_dir, current.max_resident, manifest=read_manifest(self.model_dir))
+        if new_store.fingerprint == current.fingerprint:
+            return False
+
+        self.status["loading"] = new_store.version
+        try:
+            verify(new_store.manifest, self.model_dir)
+            # Load the models sessions use right now before switching, so the
+            # first request on the new version is not a cold start
+            for name in current.resident():
+                if name in new_store.names:
+                    new_store.get(name)
+            with self._lock:
+                old, self._store = self._store, new_store
+        finally:
+            self.status["loading"] = None
+
+        # Sessions still holding an old model keep it until they are done
+        old.clear()
+        self.status["swaps"] += 1
+        self.status["last_swap"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        self.status["last_error"] = None
+        return True
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_registry(model_dir: str = MODEL_DIR, max_resident: int = 2) -> ModelRegistry:
+    """The registry shared by every session and page in this process."""
+    with _shared_lock:
+        if model_dir not in _shared:
+            _shared[model_dir] = ModelRegistry(model_dir, max_resident)
+        return _shared[model_dir]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect and switch published model versions.")
+    parser.add_argument("command", choices=["list", "verify", "activate"])
+    parser.add_argument("version", nargs="?", type=int, help="Version to activate")
+    parser.add_argument("--model-dir", default=MODEL_DIR, help="Directory with the model manifest")
+    args = parser.parse_args()
+
+    if args.command == "activate":
+        if args.version is None:
+            parser.error("activate needs a version")
+        activate(args.version, args.model_dir)
+        print(f"Version {args.version} is now active")
+    elif args.command == "verify":
+        manifest = read_manifest(args.model_dir)
+        verify(manifest, args.model_dir)
+        print(f"Version {manifest.get('version', 0)}: all checksums match")
+    else:
+        manifest = read_manifest(args.model_dir)
+        for entry in manifest.get("versions", []):
+            marker = "*" if entry["version"] == manifest.get("version") else " "
+            r2 = ", ".join(f"{name} R² {m['R2 Score']:.3f}" for name, m in entry["metrics"].items())
+            print(f"{marker} v{entry['version']}  {entry['created']}  {r2}")
@@ -0,0 +1,173 @@
+"""Per-model artifact store for the apartment price models.
+
+The notebook saves all four MapieRegressors into one ``apartment_models.pickle``.
+``split_models`` turns that file into one artifact per model plus a small
+``manifest.json``, and ``ModelStore`` only loads an artifact the first time the
+model is asked for, keeping at most ``max_resident`` models in memory.
+
+Usage:
+    python model_store.py --pickle apartment_models.pickle --model-dir models
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+MODEL_DIR = "models"
+MANIFEST_FILE = "manifest.json"
+MODEL_NAMES = ("Decision Tree", "Random Forest", "AdaBoost", "Soft Voting")
+
+
+def model_slug(name: str) -> str:
+    # "Soft Voting" -> "soft_voting"
+    return name.lower().replace(" ", "_")
+
+
+def versioned_name(name: str, version: int) -> str:
+    # "random_forest", 3 -> "random_forest-v3"
+    return f"{name}-v{version}"
+
+
+def write_manifest(manifest: dict, model_dir: str = MODEL_DIR, file_name: str = MANIFEST_FILE) -> None:
+    path = os.path.join(model_dir, file_name)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    # Replace in one step so a reader never sees a half written manifest
+    os.replace(tmp_path, path)
+
+
+def read_manifest(model_dir: str = MODEL_DIR, file_name: str = MANIFEST_FILE) -> dict:
+    with open(os.path.join(model_dir, file_name), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def checksum(path: str) -> str:
+    """SHA-256 of a file, or of every file in a directory in name order."""
+    digest = hashlib.sha256()
+    paths = [path] if os.path.isfile(path) else [
+        os.path.join(path, name) for name in sorted(os.listdir(path))
+    ]
+    for file_path in paths:
+        digest.update(os.path.basename(file_path).encode("utf-8"))
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def next_version(model_dir: str = MODEL_DIR) -> int:
+    if not os.path.exists(os.path.join(model_dir, MANIFEST_FILE)):
+        return 1
+    manifest = read_manifest(model_dir)
+    # After a rollback the active version is not the newest one
+    versions = [entry["version"] for entry in manifest.get("versions", [])]
+    return max(versions + [manifest.get("version", 0)]) + 1
+
+
+def export_models(models: dict, model_dir: str = MODEL_DIR) -> dict:
+    """Write one pickle per model and a manifest describing them."""
+    os.makedirs(model_dir, exist_ok=True)
+
+    entries = {}
+    for name, model in models.items():
+        file_name = model_slug(name) + ".pickle"
+        path = os.path.join(model_dir, file_name)
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+        entries[name] = {
+            "file": file_name,
+            "format": "pickle",
+            "size_bytes": os.path.getsize(path),
+        }
+
+    manifest = {"models": entries}
+    write_manifest(manifest, model_dir)
+    return manifest
+
+
+def split_models(pickle_path: str = "apartment_models.pickle", model_dir: str = MODEL_DIR) -> dict:
+    """Split the notebook's combined pickle into per-model artifacts."""
+    with open(pickle_path, "rb") as f:
+        models = pickle.load(f)
+    return export_models(models, model_dir)
+
+
+class ModelStore:
+    """Lazily loads models listed in a manifest, with an LRU bound on memory."""
+
+    def __init__(self, model_dir: str = MODEL_DIR, max_resident: int = 2, manifest: dict = None):
+        self.model_dir = model_dir
+        self.max_resident = max(1, max_resident)
+        self.manifest = manifest if manifest is not None else read_manifest(model_dir)
+        # Changes whenever the artifacts are re-exported; used in cache keys.
+        # The version history does not change what this store serves.
+        served = {key: value for key, value in self.manifest.items() if key != "versions"}
+        self.fingerprint = hashlib.sha1(
+            json.dumps(served, sort_keys=True).encode("utf-8")
+        ).hexdigest()[:12]
+        self._resident = OrderedDict()
+        self._lock = threading.Lock()
+        # One lock per model so two sessions never load the same artifact twice
+        self._load_locks = {name: threading.Lock() for name in self.manifest["models"]}
+
+    @property
+    def version(self) -> int:
+        # Manifests written before versioning count as version 0
+        return self.manifest.get("version", 0)
+
+    @property
+    def names(self) -> list:
+        return list(self.manifest["models"])
+
+    def resident(self) -> list:
+        with self._lock:
+            return list(self._resident)
+
+    def get(self, name: str):
+        if name not in self.manifest["models"]:
+            raise KeyError(f"Unknown model '{name}', available: {', '.join(self.names)}")
+
+        with self._load_locks[name]:
+            with self._lock:
+                if name in self._resident:
+                    self._resident.move_to_end(name)
+                    return self._resident[name]
+
+            model = self._load(self.manifest["models"][name])
+
+            with self._lock:
+                self._resident[name] = model
+                # Drop the least recently used models; sessions still holding
+                # a reference keep theirs alive until they are done with it
+                while len(self._resident) > self.max_resident:
+                    self._resident.popitem(last=False)
+        return model
+
+    def clear(self) -> None:
+        with self._lock:
+            self._resident.clear()
+
+    def _load(self, entry: dict):
+        path = os.path.join(self.model_dir, entry["file"])
+        if entry.get("format") == "compact":
+            from compact_model import load_compact
+            return load_compact(path)
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Split apartment_models.pickle into per-model artifacts.")
+    parser.add_argument("--pickle", default="apartment_models.pickle", help="Combined pickle written by the notebook")
+    parser.add_argument("--model-dir", default=MODEL_DIR, help="Directory for the per-model artifacts")
+    args = parser.parse_args()
+
+    manifest = split_models(args.pickle, args.model_dir)
+    for name, entry in manifest["models"].items():
+        print(f"{name}: {entry['file']} ({entry['size_bytes'] / 1e6:.1f} MB)")
@@ -1,5 +1,8 @@
 import streamlit as st
 import pandas as pd
+from address_index import AddressIndex
+from dataset import load_apartments
+from perf_metrics import cached
 
 st.set_page_config(page_title = "Form User Input")
 
@@ -22,34 +25,54 @@ st.markdown('<div class="app-title">Fill out a survey</div>', unsafe_allow_html=
 
 st.image("sthlm.png", width="stretch", caption = "Stockholm Apartments, picture taken from tours-tickets.se")
 
+location_areas = ["Östermalm", 
+                  "Gärdet", 
+                  "Vasastan", 
+                  "Norrmalm", 
+                  "Skeppsholmen", 
+                  "Djurgården", 
+                  "Norra Djurgården", 
+                  "Hjorthagen", 
+                  "Kungsholmen", 
+                  "Kristineberg", 
+                  "Fredhäll", 
+                  "Marieberg", 
+                  "Stadshagen", 
+                  "Lilla Essingen", 
+                  "Stora Essingen", 
+                  "Södermalm", 
+                  "Gamla Stan", 
+                  "Långholmen", 
+                  "Reimersholme", 
+                  "Riddarholmen", 
+                  "Hammarby sjöstad"]
+
+# Street addresses of the dataset, indexed once per process
+@cached(st.cache_resource)
+def load_address_index():
+  return AddressIndex(load_apartments())
+
+# Optional address search; outside the form so the matches update as you type
+address_query = st.text_input("Search for an address (optional):", placeholder="e.g. Götgatan 9",
+              help="Type the beginning of a street address in Stockholm and press Enter")
+address = None
+if address_query:
+  matches = load_address_index().complete(address_query)
+  if matches:
+    address = st.selectbox("Matching addresses:", matches,
+                 format_func=lambda m: f"{m['adress']}, {m['location_area']}",
+                 help="Addresses of sold apartments in the dataset")
+  else:
+    st.caption(f"No sold apartment address starts with '{address_query}'.")
+
 # Create a form for user inputs
 with st.form("user_inputs_form"):
   st.write("Please fill out the following survey about your apartment preferences:")
 
   location_area = st.selectbox(
     "Preferred Location Area:",
-    ["Östermalm", 
-     "Gärdet", 
-     "Vasastan", 
-     "Norrmalm", 
-     "Skeppsholmen", 
-     "Djurgården", 
-     "Norra Djurgården", 
-     "Hjorthagen", 
-     "Kungsholmen", 
-     "Kristineberg", 
-     "Fredhäll", 
-     "Marieberg", 
-     "Stadshagen", 
-     "Lilla Essingen", 
-     "Stora Essingen", 
-     "Södermalm", 
-     "Gamla Stan", 
-     "Långholmen", 
-     "Reimersholme", 
-     "Riddarholmen", 
-     "Hammarby sjöstad"]
-  , index=15,
+    location_areas,
+    index=location_areas.index(address['location_area']) if address and address['location_area'] in location_areas else 15,
   help="Select the neighborhood/area in Stockholm where you'd like to live")
 
   number_of_rooms = st.selectbox("Number of Rooms:", [1, 1.5, 2, 2.5, 3],
@@ -85,6 +108,13 @@ with st.form("user_inputs_form"):
     st.session_state['has_elevator'] = has_elevator
     st.session_state['has_fireplace'] = has_fireplace
     st.session_state['has_outside'] = has_outside
+    # The address only counts if it lies in the chosen area
+    if address and address['location_area'] == location_area:
+      st.session_state['adress'] = address['adress']
+      st.session_state['latitude'] = address['latitude']
+      st.session_state['longitude'] = address['longitude']
+    else:
+      st.session_state['adress'] = 'No adress'
     st.session_state['form_submitted'] = True
 
     st.success("You can now proceed to the Prediction page to see the estimated apartment price.")
@@ -5,14 +5,34 @@ Purpose: Debug matching varible name to training data; Http color coding
 
 
 import streamlit as st
+import altair as alt
 import pandas as pd
+import numpy as np
+import os
 import pickle
+from prediction_cache import canonical_key, shared_cache
+from model_store import MODEL_DIR, MANIFEST_FILE
+from model_registry import shared_registry
+from compact_model import export_models_compact
+from conformal import ALPHA_GRID, compute_outputs
+from prediction_service import SERVICE_ENV, PredictionClient
+from features import SCHEMA_FILE, FeatureEncoder, build_schema, clean_apartments, load_schema, save_schema
+from dataset import load_apartments
+from comparables import ComparablesIndex
+from model_comparison import compare_models, predict_row
+from explain import TreeExplainer
+from distill import load_student, student_mtime
+from market_stats import load_stats, source_mtimes
+from perf_metrics import cached, page_timer
 import warnings
 warnings.filterwarnings('ignore')
 
 st.set_page_config(page_title = "Sold Apartment Prices", 
                    page_icon = "🏢",)
 
+# Stage timings for the performance panel on the Additional Information page
+timer = page_timer("predict")
+
 # Page title
 st.markdown(
     """
@@ -42,39 +62,72 @@ if st.session_state['form_submitted'] == False:
     st.warning("Please fill out the form on the 'User Input' page before viewing predictions.")
     st.stop()
 
-# Load models
-@st.cache_resource
-def load_model(path="apartment_models.pickle"):  
-    with open(path, "rb") as f:
-        return pickle.load(f)
-
-model = load_model() 
-
+model_names = ("Random Forest", "Decision Tree", "AdaBoost", "Soft Voting")
 model_choice = st.sidebar.radio(
     "Choose model for prediction", 
-    ("Random Forest", "Decision Tree", "AdaBoost", "Soft Voting")
+    model_names
+)
+compare_all = st.sidebar.toggle(
+    "Compare all models",
+    help="Run all four models on your apartment at once and show them side by side."
+)
+full_model = st.sidebar.toggle(
+    "Always use the full model",
+    help="Skip the quick distilled estimate and always run the full model, which takes longer."
 )
 
 # Save model choice to session state
 st.session_state['model_choice'] = model_choice
 
-# Predict without button click
-if model_choice == "Random Forest":
-    selected_model = model['Random Forest']
-elif model_choice == "Decision Tree":
-    selected_model = model['Decision Tree']
-elif model_choice == "AdaBoost":
-    selected_model = model['AdaBoost']
-else:
-    selected_model = model['Soft Voting']
+# Load the model registry; only the manifest is read here, models load on
+# first use and new versions are swapped in by the registry in the background
+@cached(st.cache_resource)
+def load_registry(model_dir=MODEL_DIR):
+    if not os.path.exists(os.path.join(model_dir, MANIFEST_FILE)):
+        # One time migration from the notebook's combined pickle to the
+        # memory-mapped compact format
+        with open("apartment_models.pickle", "rb") as f:
+            export_models_compact(pickle.load(f), model_dir)
+    return shared_registry(model_dir, max_resident=2)
+
+# Load the feature schema a model version was trained with
+@cached(st.cache_resource)
+def load_encoder(schema_file, model_dir=MODEL_DIR):
+    if not os.path.exists(os.path.join(model_dir, schema_file)):
+        # One time fallback for models trained before the schema was saved
+        save_schema(build_schema(clean_apartments(load_apartments())), model_dir, schema_file)
+    return FeatureEncoder(load_schema(model_dir, schema_file))
+
+# Nearest-neighbour index over the sold apartments, built once per process
+@cached(st.cache_resource)
+def load_comparables():
+    return ComparablesIndex(load_apartments())
+
+# Per-area price sketches, refreshed only when the dataset changes
+@cached(st.cache_resource)
+def load_market_stats(mtimes):
+    return load_stats()
 
-#match the data in pickle file
-default_df = pd.read_csv('apartments_sweden.csv')
-default_df['rent'] = default_df['rent'].str.replace(',', '').astype(float)
-default_df = default_df[default_df['floor'] <= 10]
-default_df.dropna(inplace = True)
-#drop longitude latitude and sold price from default df
-encode_df = default_df.copy().drop(columns=['sold_price', 'latitude', 'longitude', 'adress'])
+# Distilled fast tier of a model version. Keyed on the student's mtime, so a
+# student distill.py writes after the version was published is picked up
+@cached(st.cache_resource, max_entries=4)
+def load_fast_model(model_name, version, mtime, model_dir=MODEL_DIR):
+    return load_student(model_dir, version, model_name)
+
+@cached(st.cache_resource)
+def load_client(address):
+    return PredictionClient(address)
+
+# With PREDICTION_SERVICE set, predictions come from prediction_service.py and
+# this process loads no models at all
+service_address = os.environ.get(SERVICE_ENV)
+if service_address:
+    client = load_client(service_address)
+else:
+    # One model version for this whole run, even if a new one is swapped in meanwhile
+    store = load_registry().store
+    encoder = load_encoder(store.manifest.get("schema", SCHEMA_FILE))
+timer.mark("load")
 
 # Prepare user input data
 user_data = {
@@ -82,24 +135,70 @@ user_data = {
     'number_of_rooms': (st.session_state['number_of_rooms']),
     'area': st.session_state['area'],
     'rent': st.session_state['rent'],
-    'floor': st.session_state['floor'],  # Convert to str to match training data
+    'floor': st.session_state['floor'],
     'has_elevator': st.session_state['has_elevator'],
     'has_fireplace': st.session_state['has_fireplace'],
     'has_outside': st.session_state['has_outside']
 }
-user_df = pd.DataFrame([user_data])
 
-# Ensure the order of columns in user data is in the same order as that of original data
-user_df = user_df[encode_df.columns]
+# One-hot encode the user row in the same column order as the training data
+encoded_row = None if service_address else encoder.encode(user_data)
+timer.mark("encode")
+
+# The student answers where it is close to the full model; elsewhere the full model runs
+student = None
+if not (service_address or full_model):
+    mtime = student_mtime(MODEL_DIR, store.version, model_choice)
+    if mtime is not None:
+        try:
+            student = load_fast_model(model_choice, store.version, mtime)
+        except FileNotFoundError:
+            # Replaced by a new distill run between the check and the load; errors are not cached
+            student = None
+use_student = student is not None and student.serves(user_data)
+
+# Run the ensemble once per model and row; moving the alpha slider only looks
+# up different quantiles of the cached distributions
+@cached(st.cache_data, max_entries=1000, show_spinner=False)
+def ensemble_outputs(model_name, row, fingerprint):
+    return compute_outputs(store.get(model_name), row)
 
-# Concatenate two dataframes together along rows (axis = 0)
-encode_df = pd.concat([encode_df,user_df], axis = 0)
+# Finished predictions are shared between all sessions of this process
+prediction_cache = shared_cache()
 
-# Define which columns should be one-hot encoded
-cat_cols = ['location_area', 'number_of_rooms', 'floor', 
-            'has_elevator', 'has_fireplace', 'has_outside']
+def service_prediction(alphas):
+    try:
+        with st.spinner(f"Running {model_choice} model..."):
+            return client.predict(user_data, model_choice, alphas)
+    except (OSError, RuntimeError) as exc:
+        st.error(f"The prediction service at {service_address} is not available: {exc}")
+        st.stop()
 
-encode_dummy_df = pd.get_dummies(encode_df, columns=cat_cols, dtype=int).tail(1)
+def cached_prediction(alphas):
+    if service_address:
+        # The service batches and caches predictions for all UI processes
+        return service_prediction(alphas)
+    if use_student:
+        # Cheaper than a cache lookup, so not cached
+        prediction, intervals = student.predict(encoded_row, alphas)
+        return {
+            "prediction": float(prediction[0]),
+            "lower": intervals[0, 0].tolist(),
+            "upper": intervals[0, 1].tolist(),
+        }
+    cache_key = canonical_key(user_data, model_choice, alphas, store.fingerprint)
+    result = prediction_cache.get(cache_key)
+    if result is None:
+        with st.spinner(f"Running {model_choice} model..."):
+            outputs = ensemble_outputs(model_choice, encoded_row, store.fingerprint)
+        prediction, intervals = outputs.predict(alphas)
+        result = {
+            "prediction": float(prediction[0]),
+            "lower": intervals[0, 0].tolist(),
+            "upper": intervals[0, 1].tolist(),
+        }
+        prediction_cache.put(cache_key, result)
+    return result
 
 
 alpha = st.slider(
@@ -111,10 +210,17 @@ alpha = st.slider(
     help="Alpha defines the uncertainty level for the prediction intervals. Higher alpha means larger uncertainty."
 )
 
-prediction, intervals = selected_model.predict(encode_dummy_df, alpha=alpha)
-pred_value = int(prediction[0])
-lower_limit = int(max(0, intervals[:, 0][0][0]) )
-upper_limit = int(max(0, intervals[:, 1][0][0]))
+# The Additional Information page shows the coverage at the same alpha
+st.session_state['alpha'] = alpha
+
+result = cached_prediction(alpha)
+# Intervals for every confidence level at once, from the same ensemble outputs
+fan = cached_prediction(ALPHA_GRID.tolist())
+timer.mark("predict")
+
+pred_value = int(result["prediction"])
+lower_limit = int(max(0, result["lower"][0]))
+upper_limit = int(max(0, result["upper"][0]))
 
 
 st.markdown(
@@ -133,4 +239,194 @@ st.markdown(
     """,
     unsafe_allow_html=True
 )
+rooms_text = f"{user_data['location_area']} with {user_data['number_of_rooms']:g} rooms"
+if use_student:
+    st.caption(f"⚡ Quick estimate from a distilled copy of the {model_choice} model. For apartments in "
+               f"{rooms_text}, 90% of its answers are within {student.region_error(user_data):.1%} of the full model. "
+               f"Turn on *Always use the full model* in the sidebar for the exact prediction.")
+elif student is not None:
+    st.caption(f"Computed with the full {model_choice} model: the quick estimate is less reliable for {rooms_text}.")
+
+# Where the predicted price falls among the sales in the same area
+market_stats = load_market_stats(source_mtimes())
+area_sales = market_stats.count(user_data['location_area'])
+if area_sales:
+    room_sales = market_stats.count(user_data['location_area'], user_data['number_of_rooms'])
+    context = (f"Higher than **{market_stats.percentile('price', pred_value, user_data['location_area']):.0%}** "
+               f"of the {area_sales:,} sold apartments in {user_data['location_area']}")
+    if room_sales:
+        context += (f" and **{market_stats.percentile('price', pred_value, user_data['location_area'], user_data['number_of_rooms']):.0%}** "
+                    f"of the {room_sales:,} with {user_data['number_of_rooms']:g} rooms")
+    st.markdown(context + ".")
+else:
+    st.markdown(f"No recorded sales in {user_data['location_area']} to compare with.")
+timer.mark("market")
+
+fan_df = pd.DataFrame(
+    {
+        "Lower": np.maximum(0, fan["lower"]),
+        "Prediction": np.full(len(ALPHA_GRID), fan["prediction"]),
+        "Upper": np.maximum(0, fan["upper"]),
+    },
+    index=pd.Index(np.round(1 - ALPHA_GRID, 2), name="Confidence level"),
+)
+
+st.subheader("Prediction intervals across confidence levels")
+st.line_chart(fan_df, y_label="Price (SEK)")
+
+# Per-prediction feature contributions (TreeSHAP). The explainer's per-leaf
+# tables are built once per model version, explanations once per row. An
+# explainer holds its model and tens of MB of tables, so at most one per model
+# is kept and swapped-out versions are evicted instead of staying resident
+@cached(st.cache_resource, max_entries=4, show_spinner=False)
+def load_explainer(model_name, fingerprint):
+    return TreeExplainer(store.get(model_name), encoder.schema)
+
+@cached(st.cache_data, max_entries=1000, show_spinner=False)
+def explain_prediction(model_name, row, fingerprint):
+    return load_explainer(model_name, fingerprint).explain(row)
+
+input_labels = {
+    'location_area': f"Location: {user_data['location_area']}",
+    'number_of_rooms': f"Rooms: {user_data['number_of_rooms']:g}",
+    'area': f"Area: {user_data['area']:g} m²",
+    'rent': f"Rent: {user_data['rent']:,.0f} SEK",
+    'floor': f"Floor: {user_data['floor']:g}",
+    'has_elevator': f"Elevator: {user_data['has_elevator']}",
+    'has_fireplace': f"Fireplace: {user_data['has_fireplace']}",
+    'has_outside': f"Balcony/patio: {user_data['has_outside']}",
+}
+
+# The breakdown is computed on request in a fragment, so it never holds up the
+# price above and toggling it reruns only this part of the page
+@st.fragment
+def price_breakdown():
+    st.subheader("Why this price?")
+    if service_address:
+        st.caption("Price breakdowns need the models in this process and are not available with the prediction service.")
+        return
+    # With the quick estimate the breakdown runs the full model, so it is only
+    # paid for when asked
+    explain_help = "Break the prediction down into the effect of each of your answers."
+    if use_student:
+        explain_help += " The breakdown explains the full model, not the quick estimate."
+    if not st.toggle("Explain this price", help=explain_help):
+        return
+
+    # Own timer, as a fragment rerun does not start a new page run
+    explain_timer = page_timer("predict")
+    try:
+        with st.spinner("Explaining the prediction..."):
+            explanation = explain_prediction(model_choice, encoded_row, store.fingerprint)
+    except ValueError:
+        st.caption("This model version was exported without the data needed for price breakdowns. "
+                   "Retrain it with `python train.py` to see them.")
+        return
+    explain_timer.mark("explain")
 
+    # Waterfall from the model's average price to this prediction, largest effects first
+    contributions = sorted(explanation["contributions"].items(), key=lambda kv: -abs(kv[1]))
+    steps = [("Average price", 0.0, explanation["expected"], "Average")]
+    running = explanation["expected"]
+    for feature, value in contributions:
+        steps.append((input_labels[feature], running, running + value, "Raises price" if value >= 0 else "Lowers price"))
+        running += value
+    # With the quick estimate above, the breakdown still explains the full model
+    steps.append(("Full model's price" if use_student else "Predicted price", 0.0, explanation["prediction"], "Prediction"))
+    waterfall = pd.DataFrame(steps, columns=["Step", "Start", "End", "Effect"])
+    waterfall["Change (SEK)"] = waterfall["End"] - waterfall["Start"]
+
+    chart = alt.Chart(waterfall).mark_bar().encode(
+        y=alt.Y("Step:N", sort=None, title=None),
+        x=alt.X("Start:Q", title="Price (SEK)"),
+        x2="End:Q",
+        color=alt.Color("Effect:N", scale=alt.Scale(
+            domain=["Average", "Raises price", "Lowers price", "Prediction"],
+            range=["#9e9e9e", "#4caf50", "#e53935", "#1b5e20"],
+        ), legend=None),
+        tooltip=["Step", alt.Tooltip("Change (SEK):Q", format=",.0f")],
+    )
+    st.altair_chart(chart, use_container_width=True)
+    st.caption(
+        f"How each of your answers moved the {model_choice} prediction away from the model's average price of "
+        f"{explanation['expected']:,.0f} SEK. The effects are exact TreeSHAP values and add up to the full model's "
+        f"prediction of {explanation['prediction']:,.0f} SEK."
+    )
+
+price_breakdown()
+
+# All four models side by side, run in parallel from the same encoded row
+@cached(st.cache_data)
+def load_metrics():
+    return pd.read_csv("model_performance.csv").set_index("Model")
+
+def model_prediction(name, alphas):
+    # Runs in worker threads, so no Streamlit calls in here
+    if service_address:
+        return client.predict(user_data, name, alphas)
+    cache_key = canonical_key(user_data, name, alphas, store.fingerprint)
+    result = prediction_cache.get(cache_key)
+    if result is None:
+        result = predict_row(store.get(name), encoded_row, alphas)
+        prediction_cache.put(cache_key, result)
+    return result
+
+if compare_all:
+    try:
+        with st.spinner("Running all models..."):
+            comparison, wall_seconds = compare_models(lambda name: model_prediction(name, alpha), model_names)
+    except (OSError, RuntimeError) as exc:
+        st.error(f"The prediction service at {service_address} is not available: {exc}")
+        st.stop()
+    timer.mark("compare")
+
+    # Metrics of the serving version; the notebook's CSV for older models
+    metrics = {} if service_address else store.manifest.get("metrics", {})
+    csv_metrics = load_metrics()
+    metric_names = {"Soft Voting": "Voting Regressor"}
+    rows = []
+    for name, r in comparison.items():
+        result = r["result"]
+        model_metrics = metrics.get(name) or csv_metrics.loc[metric_names.get(name, name)].to_dict()
+        rows.append({
+            "Model": name,
+            "Predicted price (SEK)": result["prediction"],
+            "Lower bound (SEK)": max(0, result["lower"][0]),
+            "Upper bound (SEK)": max(0, result["upper"][0]),
+            "Interval width (SEK)": result["upper"][0] - max(0, result["lower"][0]),
+            "RMSE": model_metrics["RMSE"],
+            "R²": model_metrics["R2 Score"],
+            "Time (ms)": r["seconds"] * 1000,
+        })
+
+    st.subheader("All models")
+    st.dataframe(
+        pd.DataFrame(rows).style.format({
+            "Predicted price (SEK)": "{:,.0f}", "Lower bound (SEK)": "{:,.0f}", "Upper bound (SEK)": "{:,.0f}",
+            "Interval width (SEK)": "{:,.0f}", "RMSE": "{:,.0f}", "R²": "{:.3f}", "Time (ms)": "{:.1f}",
+        }),
+        hide_index=True,
+    )
+    st.caption(
+        f"{(1 - alpha):.0%} prediction intervals. RMSE and R² on the test set. "
+        f"All models ran in {wall_seconds * 1000:,.1f} ms "
+        f"({sum(r['seconds'] for r in comparison.values()) * 1000:,.1f} ms of model time)."
+    )
+
+# Sold apartments most similar to the user's input
+# Searched from the user's address when one was picked on the User Input page
+has_address = st.session_state.get('adress', 'No adress') != 'No adress'
+position = {'latitude': st.session_state['latitude'], 'longitude': st.session_state['longitude']} if has_address else {}
+comparables = load_comparables().query({**user_data, **position}, k=5)
+timer.mark("comparables")
+st.subheader("Comparable sales")
+st.dataframe(
+    comparables[["adress", "location_area", "number_of_rooms", "area", "rent", "floor", "sold_price", "distance_km"]].rename(columns={
+        "adress": "Address", "location_area": "Location", "number_of_rooms": "Rooms", "area": "Area (m²)",
+        "rent": "Rent (SEK)", "floor": "Floor", "sold_price": "Sold price (SEK)", "distance_km": "Distance (km)",
+    }).style.format({"Rent (SEK)": "{:,.0f}", "Sold price (SEK)": "{:,.0f}", "Distance (km)": "{:.1f}", "Floor": "{:g}", "Rooms": "{:g}", "Area (m²)": "{:g}"}),
+    hide_index=True,
+)
+st.caption(f"The 5 sold apartments most similar in location, size, rent, rooms, floor and amenities; "
+           f"distance from {st.session_state['adress'] if has_address else 'the center of ' + user_data['location_area']}.")
+timer.finish("render")
@@ -5,12 +5,31 @@ Purpose: Http color coding; display apartment locations on the map; prise tresho
 
 
 import streamlit as st
+import numpy as np
 import pandas as pd
 import folium
 from streamlit_folium import st_folium
+from dataset import load_apartments
+from map_index import MapIndex, cluster_points
+from comparables import ComparablesIndex
+from perf_metrics import cached, page_timer
 
 st.set_page_config(page_title="Apartment Map", page_icon="🗺️")
 
+DEFAULT_ZOOM = 11
+# Hard cap on individual markers per render; above it the view is clustered
+MAX_MARKERS = 300
+# Most similar sold apartments highlighted on the map
+N_COMPARABLES = 10
+# folium.Icon color names as CSS colors for the cluster circles
+CLUSTER_COLORS = {
+    "green": "#72b026",
+    "lightgreen": "#bbf970",
+    "orange": "#f69730",
+    "red": "#d63e2a",
+    "darkred": "#a23336",
+}
+
 # Page title
 st.markdown(
     """
@@ -67,45 +86,56 @@ location_scope = st.radio(
     key="location_scope",
 )
 
-# Load and prepare data
-@st.cache_data
-def load_data():
-    df = pd.read_csv("apartments_sweden.csv")
+show_comparables = st.checkbox(
+    f"Highlight the {N_COMPARABLES} most similar sold apartments",
+    value=True,
+    help="Nearest sold apartments by location, size, rent, rooms, floor and amenities, even if they miss a filter.",
+    key="show_comparables",
+)
 
-    if "rent" in df.columns:
-        df["rent"] = df["rent"].astype(str).str.replace(",", "", regex=False).astype(float)
-    return df.dropna()
+# Load the cleaned, typed dataset; shared by every session in the process
+@cached(st.cache_resource)
+def load_data():
+    return load_apartments()
+
+# Build the filter and spatial indexes once per process
+@cached(st.cache_resource)
+def load_index():
+    return MapIndex(load_data())
+
+# KD-tree over the same apartments for the comparable sales
+@cached(st.cache_resource)
+def load_comparables():
+    return ComparablesIndex(load_data())
+
+# The user's inputs, with defaults for visitors who skipped the form
+def get_user_data() -> dict:
+    return {
+        "location_area": st.session_state.get("location_area", "Södermalm"),
+        "number_of_rooms": float(st.session_state.get("number_of_rooms", 2)),
+        "area": area_input,
+        "rent": rent_input,
+        "floor": float(st.session_state.get("floor", 3)),
+        "has_elevator": st.session_state.get("has_elevator", "no"),
+        "has_fireplace": st.session_state.get("has_fireplace", "no"),
+        "has_outside": st.session_state.get("has_outside", "no"),
+        # Position of the address picked on the User Input page, if any
+        **({"latitude": st.session_state["latitude"], "longitude": st.session_state["longitude"]}
+           if st.session_state.get("adress", "No adress") != "No adress" else {}),
+    }
 
 # Get filtered data based on user inputs
-def get_data(df: pd.DataFrame, area_range: tuple, max_rent_val: float, location_scope_val: str) -> pd.DataFrame:
-    location_area = st.session_state.get("location_area", "Södermalm")
-    number_of_rooms = float(st.session_state.get("number_of_rooms", 2))
-    floor = float(st.session_state.get("floor", 3))
-    has_elevator = st.session_state.get("has_elevator", "no")
-    has_fireplace = st.session_state.get("has_fireplace", "no")
-    has_outside = st.session_state.get("has_outside", "no")
-
-    area_min, area_max = area_range
-    max_rent = max_rent_val
-    scope_choice = location_scope_val
-
-    # Base filtering on user preferences
-    filtered = df[
-        (df["number_of_rooms"] == number_of_rooms) &
-        (df["area"].between(area_min, area_max)) &
-        (df["floor"] == floor) &
-        (df["has_elevator"] == has_elevator) &
-        (df["has_fireplace"] == has_fireplace) &
-        (df["has_outside"] == has_outside) &
-        (df["rent"] <= max_rent)
-    ]
-
-    # Apply location filtering based on scope choice
-    if scope_choice == "Only my chosen area":
-        filtered = filtered[filtered["location_area"] == location_area]
-    # If "Show all Stockholm", don't filter by location_area
+def get_data(index: MapIndex, area_range: tuple, max_rent_val: float, location_scope_val: str) -> pd.DataFrame:
+    user_data = get_user_data()
 
-    return filtered
+    # If "Show all Stockholm", don't filter by location_area
+    positions = index.query(
+        user_data["location_area"], user_data["number_of_rooms"], user_data["floor"],
+        user_data["has_elevator"], user_data["has_fireplace"], user_data["has_outside"],
+        area_range, max_rent_val,
+        all_areas=(location_scope_val == "Show all Stockholm"),
+    )
+    return index.rows(positions)
 
 # Fixed price thresholds
 def get_price_color(price):
@@ -120,7 +150,7 @@ def get_price_color(price):
     else:
         return "darkred"
 
-# Create map with apartment markers
+# Create the base map; markers are added as a separate layer
 def create_map(apartment_data: pd.DataFrame) -> folium.Map:
     if apartment_data.empty:
         center = [59.3293, 18.0686]
@@ -130,25 +160,10 @@ def create_map(apartment_data: pd.DataFrame) -> folium.Map:
             apartment_data["longitude"].mean(),
         ]
 
-    m = folium.Map(location=center, zoom_start=11, tiles="OpenStreetMap")
+    return folium.Map(location=center, zoom_start=DEFAULT_ZOOM, tiles="OpenStreetMap")
 
-    if apartment_data.empty:
-        return m
-
-    def get_price_color(price):
-        if price < 2_000_000:
-            return "green"
-        elif price < 4_000_000:
-            return "lightgreen"
-        elif price < 6_000_000:
-            return "orange"
-        elif price < 8_000_000:
-            return "red"
-        else:
-            return "darkred"
-
-    # Add markers
-    for _, row in apartment_data.iterrows():
+def add_apartment_markers(layer: folium.FeatureGroup, apartment_data: pd.DataFrame) -> None:
+    for row in apartment_data.to_dict("records"):
         price = row["sold_price"]
         color = get_price_color(price)
 
@@ -179,21 +194,112 @@ def create_map(apartment_data: pd.DataFrame) -> folium.Map:
             icon=folium.Icon(color=color, icon="home"),
             popup=folium.Popup(popup_content, max_width=300),
             tooltip=tooltip_content,
-        ).add_to(m)
-
-    return m
-
-
-df = load_data()
-filtered_apartments = get_data(df, (area_min, area_max), max_rent, location_scope)
+        ).add_to(layer)
 
-if filtered_apartments.empty:
+def add_cluster_markers(layer: folium.FeatureGroup, clusters: pd.DataFrame) -> None:
+    for row in clusters.to_dict("records"):
+        count = int(row["count"])
+        color = CLUSTER_COLORS[get_price_color(row["median_price"])]
+        folium.CircleMarker(
+            location=[row["latitude"], row["longitude"]],
+            radius=min(8 + 3 * np.log2(count), 30),
+            color=color,
+            fill=True,
+            fill_color=color,
+            fill_opacity=0.7,
+            tooltip=f"🏠 {count} apartments | 💰 median {row['median_price']:,.0f} SEK",
+        ).add_to(layer)
+
+def add_comparable_markers(layer: folium.FeatureGroup, comparables: pd.DataFrame) -> None:
+    for rank, row in enumerate(comparables.to_dict("records"), start=1):
+        popup_content = f"""
+        <div style="width: 250px;">
+            <h4>⭐ Comparable Sale #{rank}</h4>
+            <strong>Price:</strong> {row['sold_price']:,.0f} SEK<br>
+            <strong>Location:</strong> {row['location_area']}<br>
+            <strong>Adress:</strong> {row['adress']}<br>
+            <strong>Rooms:</strong> {row['number_of_rooms']}<br>
+            <strong>Area:</strong> {row['area']} m²<br>
+            <strong>Floor:</strong> {row['floor']}<br>
+            <strong>Rent:</strong> {row['rent']:,.0f} SEK
+        </div>
+        """
+        folium.Marker(
+            location=[row["latitude"], row["longitude"]],
+            icon=folium.Icon(color="blue", icon="star"),
+            popup=folium.Popup(popup_content, max_width=300),
+            tooltip=f"⭐ Comparable #{rank} | 💰 {row['sold_price']:,.0f} SEK",
+        ).add_to(layer)
+
+# Markers for the part of the map the user is looking at
+def create_marker_layer(index: MapIndex, apartment_data: pd.DataFrame, view: dict) -> tuple:
+    zoom = view.get("zoom") or DEFAULT_ZOOM
+    bounds = view.get("bounds") or {}
+    south_west = bounds.get("_southWest") or {}
+    north_east = bounds.get("_northEast") or {}
+
+    in_view = apartment_data
+    if None not in (south_west.get("lat"), south_west.get("lng"), north_east.get("lat"), north_east.get("lng")):
+        # Rows keep their position in the index, so the grid answers the bounding box
+        visible = index.grid.query(south_west["lat"], south_west["lng"], north_east["lat"], north_east["lng"])
+        in_view = apartment_data.loc[np.intersect1d(apartment_data.index.to_numpy(), visible, assume_unique=True)]
+
+    layer = folium.FeatureGroup(name="Apartments")
+    if len(in_view) <= MAX_MARKERS:
+        add_apartment_markers(layer, in_view)
+        caption = f"Showing {len(in_view):,} of {len(apartment_data):,} matching apartments."
+    else:
+        clusters = cluster_points(in_view["latitude"], in_view["longitude"], in_view["sold_price"], zoom)
+        add_cluster_markers(layer, clusters)
+        caption = (
+            f"{len(in_view):,} apartments in view, grouped into {len(clusters):,} clusters "
+            f"colored by median price. Zoom in to see individual apartments."
+        )
+    return layer, caption
+
+
+# Stage timings for the performance panel on the Additional Information page
+timer = page_timer("map")
+index = load_index()
+timer.mark("load")
+filtered_apartments = get_data(index, (area_min, area_max), max_rent, location_scope)
+timer.mark("filter")
+comparables = load_comparables().query(get_user_data(), k=N_COMPARABLES) if show_comparables else None
+timer.mark("comparables")
+
+if filtered_apartments.empty and comparables is not None:
+    st.warning("⚠️ No apartments match your criteria exactly. Showing the most similar sold apartments instead.")
+    comparables_layer = folium.FeatureGroup(name="Comparables")
+    add_comparable_markers(comparables_layer, comparables)
+    st_folium(
+        create_map(comparables),
+        width=700,
+        height=500,
+        key="comparables_map",
+        feature_group_to_add=comparables_layer,
+        returned_objects=[],
+    )
+elif filtered_apartments.empty:
     st.warning("⚠️ No apartments match your criteria. Try changing inputs on the User Input page.")
     empty_map = create_map(filtered_apartments)  # full dataset map
     st_folium(empty_map, width=700, height=500)
 else:
     stockholm_map = create_map(filtered_apartments)
-    st_folium(stockholm_map, width=700, height=500)
+    # Bounds and zoom of the map as the user last left it
+    view = st.session_state.get("apartment_map") or {}
+    marker_layer, caption = create_marker_layer(index, filtered_apartments, view)
+    if comparables is not None:
+        add_comparable_markers(marker_layer, comparables)
+        caption += f" Stars mark the {len(comparables)} most similar sold apartments."
+    st_folium(
+        stockholm_map,
+        width=700,
+        height=500,
+        key="apartment_map",
+        feature_group_to_add=marker_layer,
+        returned_objects=["bounds", "zoom"],
+    )
+    st.caption(caption)
 
 # Info expander
 with st.expander("ℹ️ How to use this map"):
@@ -202,6 +308,9 @@ with st.expander("ℹ️ How to use this map"):
         - Change apartment details on the **User Input** page.
         - This map shows apartments that match your current inputs.
         - Hover over a marker to see basic info, and click to see full details.
+        - When many apartments are in view they are grouped into circles; zoom in to see them one by one.
         - Marker color reflects price: green = cheaper, dark red = more expensive.
+        - Blue stars mark the sold apartments most similar to yours, even if they miss one of the filters.
         """
     )
+timer.finish("render")
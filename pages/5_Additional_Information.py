@@ -1,7 +1,14 @@
 
 import streamlit as st
 import warnings
+import os
+import numpy as np
 import pandas as pd
+from prediction_cache import shared_cache
+from perf_metrics import ADMIN_TOKEN_ENV, cached, shared_metrics
+from model_store import MODEL_DIR, MANIFEST_FILE
+from model_registry import shared_registry
+from diagnostics import evaluate_model, has_test_split, load_test_split
 warnings.filterwarnings('ignore')
 
 model_choice = st.session_state['model_choice'] 
@@ -11,50 +18,27 @@ st.markdown(
     unsafe_allow_html=True
 )
 
-# Load CSV file with metrics
-metrics_df = pd.read_csv("model_performance.csv")
-
-# Model performance metrics (from training/validation)
-
-
-if model_choice== "Decision Tree":
-    feature_imp="feature_imp_dt.svg"
-    histogram= "residuals_hist_dt.svg"
-    pred_vs_actual = "actual_vs_predicted_dt.svg"
-    coverage = "prediction_intervals_dt.svg"
-    RMSE = metrics_df.loc[metrics_df['Model']=='Decision Tree', 'RMSE'].values[0]
-    R2 = metrics_df.loc[metrics_df['Model']=='Decision Tree', 'R2 Score'].values[0]
-elif model_choice == "Random Forest":
-    feature_imp="feature_imp_rf.svg"
-    histogram= "residuals_hist_rf.svg"
-    pred_vs_actual = "actual_vs_predicted_rf.svg"
-    coverage = "prediction_intervals_rf.svg"
-    RMSE = metrics_df.loc[metrics_df['Model']=='Random Forest', 'RMSE'].values[0]
-    R2 = metrics_df.loc[metrics_df['Model']=='Random Forest', 'R2 Score'].values[0]
-elif model_choice == "AdaBoost":
-    feature_imp="feature_imp_ada.svg"
-    histogram= "residuals_hist_ada.svg"
-    pred_vs_actual = "actual_vs_predicted_ada.svg"
-    coverage = "prediction_intervals_ada.svg"
-    RMSE = metrics_df.loc[metrics_df['Model']=='AdaBoost', 'RMSE'].values[0]
-    R2 = metrics_df.loc[metrics_df['Model']=='AdaBoost', 'R2 Score'].values[0]
-elif model_choice == "Soft Voting":
-    feature_imp="feature_imp_vote.svg"
-    histogram= "residuals_hist_vote.svg"
-    pred_vs_actual = "actual_vs_predicted_vote.svg"
-    coverage = "prediction_intervals_vote.svg"
-    RMSE = metrics_df.loc[metrics_df['Model']=='Voting Regressor', 'RMSE'].values[0]
-    R2 = metrics_df.loc[metrics_df['Model']=='Voting Regressor', 'R2 Score'].values[0]
+has_models = os.path.exists(os.path.join(MODEL_DIR, MANIFEST_FILE))
+if has_models:
+    registry = shared_registry(MODEL_DIR, max_resident=2)
+    store = registry.store
 
-# --- Header ---
-st.markdown("""
-    <h3 style="margin-top: 1.5rem; text-align:center;">Model Performance</h3>
-""", unsafe_allow_html=True)
+# Test rows of the serving version, loaded once per version
+@cached(st.cache_resource)
+def load_test_data(fingerprint, _store):
+    return load_test_split(_store)
+
+# Diagnostics of the deployed model, evaluated once per model version
+@cached(st.cache_data, show_spinner="Evaluating the model on its test split...")
+def model_diagnostics(model_name, fingerprint, _store):
+    X, y, schema = load_test_data(fingerprint, _store)
+    return evaluate_model(_store.get(model_name), X, y, schema)
 
-# --- Metric Cards ---
-col1, col2 = st.columns(2)
+diagnostics = None
+if has_models and has_test_split(store.manifest):
+    diagnostics = model_diagnostics(model_choice, store.fingerprint, store)
 
-with col1:
+def metric_card(title, value):
     st.markdown("""
         <div style="
             padding: 20px;
@@ -62,39 +46,198 @@ with col1:
             text-align: center;
             box-shadow: 0 2px 8px rgba(255, 0, 128, 0.18);
         ">
-            <h4 style="margin-bottom: 5px;">RMSE</h4>
+            <h4 style="margin-bottom: 5px;">""" + title + """</h4>
             <p style="font-size: 32px; font-weight: 700;">
-    """ + f"{RMSE:,.0f}" + """
+    """ + value + """
             </p>
         </div>
     """, unsafe_allow_html=True)
 
-with col2:
+# --- Header ---
+st.markdown("""
+    <h3 style="margin-top: 1.5rem; text-align:center;">Model Performance</h3>
+""", unsafe_allow_html=True)
+
+if diagnostics is not None:
+    alpha = st.slider(
+        "Select alpha value",
+        min_value=0.1,
+        max_value=0.9,
+        value=st.session_state.get('alpha', 0.5),
+        step=0.01,
+        help="Alpha of the prediction intervals whose coverage is shown."
+    )
+    k = int(np.argmin(np.abs(np.array(diagnostics['alphas']) - alpha)))
+
+    # --- Metric Cards ---
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        metric_card("RMSE", f"{diagnostics['rmse']:,.0f}")
+    with col2:
+        metric_card("R²", f"{diagnostics['r2']:.3f}")
+    with col3:
+        metric_card(f"Coverage ({1 - alpha:.0%})", f"{diagnostics['coverage'][k]:.1%}")
+
+    # --- Insights header ---
     st.markdown("""
-        <div style="
-            padding: 20px;
-            border-radius: 12px;
-            text-align: center;
-            box-shadow: 0 2px 8px rgba(255, 0, 128, 0.18);
-        ">
-            <h4 style="margin-bottom: 5px;">R²</h4>
-            <p style="font-size: 32px; font-weight: 700;">
-        """ + f"{R2:.3f}" + """
-            </p>
-        </div>
-        """, unsafe_allow_html=True)
+        <h3 style="margin-top: 2rem; text-align:center;">Model Insights</h3>
+    """, unsafe_allow_html=True)
+
+    tab1, tab2, tab3, tab4 = st.tabs(["Feature Importance", "Histogram of Residuals", "Predicted Vs. Actual", "Coverage Plot"])
+    with tab1:
+        importance = pd.Series(diagnostics['importance']).sort_values(ascending=False) / 1e6
+        st.bar_chart(importance.rename("RMSE increase (MSEK)").rename_axis("Feature"), horizontal=True)
+        st.caption("Increase in RMSE when the values of one input are shuffled across the test apartments.")
+    with tab2:
+        edges = np.array(diagnostics['residual_edges']) / 1e6
+        st.bar_chart(pd.DataFrame(
+            {"Apartments": diagnostics['residual_counts']},
+            index=pd.Index(np.round((edges[:-1] + edges[1:]) / 2, 2), name="Residual (MSEK)"),
+        ))
+        st.caption("Distribution of residuals (actual minus predicted price) to evaluate prediction quality.")
+    with tab3:
+        scatter = pd.DataFrame({
+            "Actual price (MSEK)": np.array(diagnostics['scatter_actual']) / 1e6,
+            "Predicted price (MSEK)": np.array(diagnostics['scatter_predicted']) / 1e6,
+        })
+        st.scatter_chart(scatter, x="Actual price (MSEK)", y="Predicted price (MSEK)")
+        binned = pd.DataFrame({
+            "Mean actual price": np.array(diagnostics['binned_actual']) / 1e6,
+            "Perfect prediction": np.array(diagnostics['binned_predicted']) / 1e6,
+        }, index=pd.Index(np.round(np.array(diagnostics['binned_predicted']) / 1e6, 2), name="Predicted price (MSEK)"))
+        st.line_chart(binned)
+        st.caption(f"{len(scatter)} of {diagnostics['n_test']:,} test apartments, and the mean actual price per "
+                   "range of predicted prices.")
+    with tab4:
+        nominal = 1 - np.array(diagnostics['alphas'])
+        st.line_chart(pd.DataFrame(
+            {"Coverage": diagnostics['coverage'], "Target": nominal},
+            index=pd.Index(np.round(nominal, 2), name="Confidence level"),
+        ))
+        st.caption(f"Share of test apartments whose price lies inside the interval. At {1 - alpha:.0%} the "
+                   f"intervals are on average {diagnostics['mean_width'][k] / 1e6:,.2f} MSEK wide.")
+    st.caption(f"Evaluated on the {diagnostics['n_test']:,} test apartments of model version v{store.version}.")
+else:
+    # Models exported before the training split was recorded: figures from the notebook
+    metrics_df = pd.read_csv("model_performance.csv")
+    metric_names = {"Soft Voting": "Voting Regressor"}
+    suffixes = {"Decision Tree": "dt", "Random Forest": "rf", "AdaBoost": "ada", "Soft Voting": "vote"}
+    row = metrics_df['Model'] == metric_names.get(model_choice, model_choice)
+    RMSE = metrics_df.loc[row, 'RMSE'].values[0]
+    R2 = metrics_df.loc[row, 'R2 Score'].values[0]
+    suffix = suffixes[model_choice]
+
+    # --- Metric Cards ---
+    col1, col2 = st.columns(2)
+    with col1:
+        metric_card("RMSE", f"{RMSE:,.0f}")
+    with col2:
+        metric_card("R²", f"{R2:.3f}")
+
+    # --- Insights header ---
+    st.markdown("""
+        <h3 style="margin-top: 2rem; text-align:center;">Model Insights</h3>
+    """, unsafe_allow_html=True)
+
+    tab1, tab2, tab3, tab4 = st.tabs(["Feature Importance", "Histogram of Residuals", "Predicted Vs. Actual", "Coverage Plot"])
+    with tab1:
+        st.image(f"feature_imp_{suffix}.svg", caption="Relative importance of features in prediction.")
+    with tab2:
+        st.image(f"residuals_hist_{suffix}.svg", caption="Distribution of residuals to evaluate prediction quality.")
+    with tab3:
+        st.image(f"actual_vs_predicted_{suffix}.svg", caption="Visual comparison of predicted and actual values.")
+    with tab4:
+        st.image(f"prediction_intervals_{suffix}.svg", caption="Range of predictions with confidence inte")
+
+# --- Model version ---
+st.markdown("""
+    <h3 style="margin-top: 2rem; text-align:center;">Model Version</h3>
+""", unsafe_allow_html=True)
 
-# --- Insights header ---
+if has_models:
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Serving version", f"v{store.version}")
+    col2.metric("Published versions", f"{max(1, len(store.manifest.get('versions', [])))}")
+    col3.metric("Models in memory", f"{len(store.resident())}")
+    status = registry.status
+    st.caption(
+        f"Created {store.manifest.get('created', 'before versioning')}, fingerprint {store.fingerprint}"
+        + (f", loading v{status['loading']} in the background" if status["loading"] is not None else "")
+        + (f", last switched {status['last_swap']}" if status["last_swap"] else "")
+        + "."
+    )
+    if status["last_error"]:
+        st.warning(f"The newest model version could not be loaded: {status['last_error']}")
+else:
+    st.info("No models have been loaded yet. Make a prediction first.")
+
+# --- Prediction cache ---
 st.markdown("""
-    <h3 style="margin-top: 2rem; text-align:center;">Model Insights</h3>
+    <h3 style="margin-top: 2rem; text-align:center;">Prediction Cache</h3>
 """, unsafe_allow_html=True)
 
-tab1, tab2, tab3, tab4 = st.tabs(["Feature Importance", "Histogram of Residuals", "Predicted Vs. Actual", "Coverage Plot"])
-with tab1:
-    st.image(feature_imp, caption="Relative importance of features in prediction.")
-with tab2:
-    st.image(histogram, caption="Distribution of residuals to evaluate prediction quality.")
-with tab3:
-    st.image(pred_vs_actual, caption="Visual comparison of predicted and actual values.")
-with tab4:
-    st.image(coverage, caption="Range of predictions with confidence inte")
\ No newline at end of file
+cache_stats = shared_cache().stats()
+col1, col2, col3 = st.columns(3)
+col1.metric("Cache hits", f"{cache_stats['hits']:,}")
+col2.metric("Cache misses", f"{cache_stats['misses']:,}")
+col3.metric("Hit rate", f"{cache_stats['hit_rate']:.0%}")
+st.caption(
+    f"{cache_stats['size']:,} of {cache_stats['max_entries']:,} predictions cached in this process, "
+    f"entries expire after {cache_stats['ttl_seconds'] / 3600:.0f} h, "
+    f"{cache_stats['evictions']:,} evicted"
+    + (f", {cache_stats['disk_hits']:,} hits served from disk." if cache_stats['persistent'] else ".")
+)
+
+# --- Performance (admins only, open the page with ?admin=<APP_ADMIN_TOKEN>) ---
+admin_token = os.environ.get(ADMIN_TOKEN_ENV)
+if admin_token and st.query_params.get("admin") == admin_token:
+    st.markdown("""
+        <h3 style="margin-top: 2rem; text-align:center;">Performance</h3>
+    """, unsafe_allow_html=True)
+
+    perf = shared_metrics()
+    stages = pd.DataFrame(perf.stage_summary())
+    if stages.empty:
+        st.info("No page runs recorded in this process yet.")
+    else:
+        st.dataframe(
+            stages[["page", "stage", "count", "p50_ms", "p95_ms", "p99_ms", "max_ms", "total_count"]].rename(columns={
+                "count": "Runs in window", "p50_ms": "p50 ms", "p95_ms": "p95 ms", "p99_ms": "p99 ms",
+                "max_ms": "Max ms", "total_count": "Runs since start",
+            }),
+            hide_index=True,
+        )
+
+        # Rolling histogram of one stage
+        options = [f"{page} / {stage}" for page, stage in zip(stages["page"], stages["stage"])]
+        choice = st.selectbox("Stage", options, index=len(options) - 1)
+        page, stage = choice.split(" / ")
+        durations = perf.stage_window(page, stage)
+        if len(durations):
+            edges = np.histogram_bin_edges(durations, bins=min(20, max(1, len(durations))))
+            counts, edges = np.histogram(durations, bins=edges)
+            st.bar_chart(pd.DataFrame(
+                {"Runs": counts}, index=pd.Index([f"{edge:,.1f}" for edge in edges[:-1]], name="ms"),
+            ))
+
+    caches = pd.DataFrame(perf.cache_summary())
+    if not caches.empty:
+        st.dataframe(caches.rename(columns={
+            "cache": "Cached function", "hits": "Hits", "misses": "Misses", "hit_rate": "Hit rate",
+        }), hide_index=True)
+
+    memory = perf.memory_samples()
+    if memory:
+        st.metric("Process memory (RSS)", f"{memory[-1][1]:,.0f} MB")
+        st.line_chart(pd.DataFrame(
+            {"RSS MB": [value for _, value in memory]},
+            index=pd.to_datetime([t for t, _ in memory], unit="s"),
+        ))
+
+    st.download_button(
+        "Download Prometheus metrics", perf.prometheus(), file_name="app_metrics.prom", mime="text/plain",
+    )
+    st.caption(
+        f"Percentiles over the last {perf.window_seconds / 60:.0f} minutes in this process."
+        + (f" Also written to {perf.export_file}." if perf.export_file else "")
+    )
@@ -0,0 +1,132 @@
+
+import streamlit as st
+import pandas as pd
+import numpy as np
+import os
+from model_store import MODEL_DIR, MANIFEST_FILE
+from model_registry import shared_registry
+from price_surface import FLOORS, OTHER_AREA, load_surface
+from perf_metrics import cached, page_timer
+import warnings
+warnings.filterwarnings('ignore')
+
+st.set_page_config(page_title = "What If",
+                   page_icon = "🔀",)
+
+timer = page_timer("what_if")
+
+st.markdown(
+    """
+    <h2 style="text-align: center;">What If? 🔀</h2>
+    <p style="text-align: center; font-size: 1.1rem;">
+    See how the predicted price changes when you change one of your answers
+    </p>
+    <hr style="border: 1px solid #ccc;">
+    """,
+    unsafe_allow_html=True,
+)
+
+if not st.session_state.get('form_submitted', False):
+    st.warning("Please fill out the form on the 'User Input' page before exploring what-if scenarios.")
+    st.stop()
+
+if not os.path.exists(os.path.join(MODEL_DIR, MANIFEST_FILE)):
+    st.info("No models have been loaded yet. Make a prediction first.")
+    st.stop()
+
+model_choice = st.session_state.get('model_choice', "Random Forest")
+
+# The surface is precomputed per model version by price_surface.py, so this
+# page only reads a memory-mapped grid and never runs the ensemble
+@cached(st.cache_resource)
+def load_price_surface(version, model_dir=MODEL_DIR):
+    return load_surface(model_dir, version)
+
+version = shared_registry(MODEL_DIR, max_resident=2).store.version
+try:
+    surface = load_price_surface(version)
+except FileNotFoundError:
+    st.warning(f"No what-if data for model version v{version} yet. Run `python price_surface.py` to create it.")
+    st.stop()
+if model_choice not in surface.models:
+    st.warning(f"No what-if data for the {model_choice} model. Run `python price_surface.py` to create it.")
+    st.stop()
+timer.mark("load")
+
+user_data = {
+    'location_area': st.session_state['location_area'],
+    'number_of_rooms': st.session_state['number_of_rooms'],
+    'area': st.session_state['area'],
+    'rent': st.session_state['rent'],
+    'floor': st.session_state['floor'],
+    'has_elevator': st.session_state['has_elevator'],
+    'has_fireplace': st.session_state['has_fireplace'],
+    'has_outside': st.session_state['has_outside']
+}
+
+sweep = st.radio(
+    "Change",
+    ["Area", "Area and rooms", "Area and rent", "Rent", "Floor", "Location area"],
+    horizontal=True,
+)
+confidence = st.radio("Confidence level", ["90%", "50%"], horizontal=True)
+alpha = 0.1 if confidence == "90%" else 0.5
+
+# One input row per point of the sweep, everything else as in the form
+area_values = np.arange(10, 201, 5)
+rent_values = np.arange(500, 5001, 250)
+if sweep == "Area":
+    inputs = pd.DataFrame({'area': area_values})
+elif sweep == "Area and rooms":
+    rooms = surface.axes['number_of_rooms']
+    inputs = pd.DataFrame([(a, r) for r in rooms for a in area_values], columns=['area', 'number_of_rooms'])
+elif sweep == "Area and rent":
+    rents = surface.rent_knots
+    inputs = pd.DataFrame([(a, r) for r in rents for a in area_values], columns=['area', 'rent'])
+elif sweep == "Rent":
+    inputs = pd.DataFrame({'rent': rent_values})
+elif sweep == "Floor":
+    inputs = pd.DataFrame({'floor': list(FLOORS)})
+else:
+    # Every area the models know, plus the chosen one if it is not among them
+    areas = [area for area in surface.axes['location_area'] if area != OTHER_AREA]
+    if user_data['location_area'] not in areas:
+        areas.append(user_data['location_area'])
+    inputs = pd.DataFrame({'location_area': areas})
+for col, value in user_data.items():
+    if col not in inputs:
+        inputs[col] = value
+
+values = surface.lookup(model_choice, inputs)
+prices = pd.DataFrame({
+    'Predicted price': values['prediction'],
+    'Lower bound': values[f'lower_{alpha}'],
+    'Upper bound': values[f'upper_{alpha}'],
+}) / 1e6
+timer.mark("lookup")
+
+st.markdown(f"##### {model_choice} model, prices in MSEK")
+if sweep == "Area":
+    st.line_chart(prices.set_index(inputs['area'].rename("Area (m²)")))
+elif sweep == "Area and rooms":
+    chart = prices.assign(rooms=inputs['number_of_rooms'].map(lambda r: f"{r:g} rooms"), area=inputs['area'])
+    st.line_chart(chart.pivot(index='area', columns='rooms', values='Predicted price').rename_axis("Area (m²)"))
+elif sweep == "Area and rent":
+    chart = prices.assign(rent=inputs['rent'].map(lambda r: f"{r:,.0f} SEK rent"), area=inputs['area'])
+    st.line_chart(chart.pivot(index='area', columns='rent', values='Predicted price').rename_axis("Area (m²)"))
+elif sweep == "Rent":
+    st.line_chart(prices.set_index(inputs['rent'].rename("Rent (SEK)")))
+elif sweep == "Floor":
+    st.line_chart(prices.set_index(inputs['floor'].rename("Floor")))
+else:
+    chart = prices.set_index(inputs['location_area'].rename("Location area")).sort_values('Predicted price')
+    st.bar_chart(chart['Predicted price'])
+    st.dataframe(chart.sort_values('Predicted price', ascending=False).style.format("{:.2f}"))
+
+st.caption(
+    f"Precomputed for model version v{surface.version} on a grid of "
+    f"{len(surface.area_knots)} area and {len(surface.rent_knots)} rent values, "
+    "interpolated in between. Curves can differ slightly from the prediction page between grid points. "
+    f"Bounds are {confidence} prediction intervals. Location areas the models have not seen share one estimate."
+)
+timer.finish("render")
@@ -0,0 +1,104 @@
+
+import streamlit as st
+import pandas as pd
+import numpy as np
+from market_stats import QUANTILES, load_stats, source_mtimes
+from perf_metrics import cached, page_timer
+import warnings
+warnings.filterwarnings('ignore')
+
+st.set_page_config(page_title = "Market Overview",
+                   page_icon = "📊",)
+
+timer = page_timer("market")
+
+st.markdown(
+    """
+    <h2 style="text-align: center;">Market Overview 📊</h2>
+    <p style="text-align: center; font-size: 1.1rem;">
+    Prices, price per m² and rents of sold apartments per location area and number of rooms
+    </p>
+    <hr style="border: 1px solid #ccc;">
+    """,
+    unsafe_allow_html=True,
+)
+
+# The statistics are precomputed by market_stats.py and only refreshed with
+# new rows when the dataset changes, so this page never scans the sales
+@cached(st.cache_resource)
+def load_market_stats(mtimes):
+    return load_stats()
+
+stats = load_market_stats(source_mtimes())
+timer.mark("load")
+
+# --- All areas ---
+areas = stats.summary().sort_values('median_price_per_m2', ascending=False)
+st.subheader("All location areas")
+st.bar_chart(areas.set_index('location_area')['median_price_per_m2'].rename("Median price per m² (SEK)"),
+             horizontal=True, sort=False)
+st.dataframe(
+    areas[['location_area', 'sales', 'median_price', 'median_price_per_m2', 'median_rent', 'mean_area']].rename(columns={
+        'location_area': "Location area", 'sales': "Sales", 'median_price': "Median price (SEK)",
+        'median_price_per_m2': "Median price per m² (SEK)", 'median_rent': "Median rent (SEK)",
+        'mean_area': "Mean area (m²)",
+    }).style.format({"Median price (SEK)": "{:,.0f}", "Median price per m² (SEK)": "{:,.0f}",
+                     "Median rent (SEK)": "{:,.0f}", "Mean area (m²)": "{:.1f}"}),
+    hide_index=True,
+)
+
+# --- One area ---
+st.subheader("One location area")
+area_names = areas['location_area'].sort_values().tolist()
+chosen_area = st.session_state.get('location_area')
+col1, col2 = st.columns(2)
+with col1:
+    location_area = st.selectbox("Location area", area_names,
+                                 index=area_names.index(chosen_area) if chosen_area in area_names else 0)
+by_rooms = stats.summary(by_rooms=True)
+by_rooms = by_rooms[by_rooms['location_area'] == location_area]
+room_options = ["All"] + [f"{rooms:g}" for rooms in by_rooms['number_of_rooms']]
+with col2:
+    room_choice = st.selectbox("Number of rooms", room_options)
+rooms = None if room_choice == "All" else float(room_choice)
+
+col1, col2, col3, col4 = st.columns(4)
+col1.metric("Sales", f"{stats.count(location_area, rooms):,}")
+col2.metric("Median price", f"{stats.quantiles('price', [0.5], location_area, rooms)[0] / 1e6:.2f} MSEK")
+col3.metric("Median price per m²", f"{stats.quantiles('price_per_m2', [0.5], location_area, rooms)[0]:,.0f} SEK")
+col4.metric("Median rent", f"{stats.quantiles('rent', [0.5], location_area, rooms)[0]:,.0f} SEK")
+
+quantiles = pd.DataFrame(
+    {
+        "Price (SEK)": stats.quantiles('price', QUANTILES, location_area, rooms),
+        "Price per m² (SEK)": stats.quantiles('price_per_m2', QUANTILES, location_area, rooms),
+        "Rent (SEK)": stats.quantiles('rent', QUANTILES, location_area, rooms),
+    },
+    index=pd.Index([f"{q:.0%}" for q in QUANTILES], name="Percentile"),
+)
+st.dataframe(quantiles.style.format("{:,.0f}"))
+
+# The sketch's 2% buckets regrouped into 0.5 MSEK bars
+histogram = stats.histogram('price', location_area, rooms)
+edges = np.arange(np.floor(histogram.index.min() / 5e5), np.ceil(histogram.index.max() / 5e5) + 1) * 5e5
+counts, edges = np.histogram(histogram.index, bins=edges, weights=histogram.to_numpy())
+st.markdown("##### Price distribution")
+st.bar_chart(pd.Series(counts, index=pd.Index(edges[:-1] / 1e6, name="Price (MSEK)"), name="Sales"))
+
+if rooms is None:
+    st.markdown("##### By number of rooms")
+    st.dataframe(
+        by_rooms[['number_of_rooms', 'sales', 'median_price', 'median_price_per_m2', 'median_rent', 'mean_area']].rename(columns={
+            'number_of_rooms': "Rooms", 'sales': "Sales", 'median_price': "Median price (SEK)",
+            'median_price_per_m2': "Median price per m² (SEK)", 'median_rent': "Median rent (SEK)",
+            'mean_area': "Mean area (m²)",
+        }).style.format({"Rooms": "{:g}", "Median price (SEK)": "{:,.0f}", "Median price per m² (SEK)": "{:,.0f}",
+                         "Median rent (SEK)": "{:,.0f}", "Mean area (m²)": "{:.1f}"}),
+        hide_index=True,
+    )
+
+st.caption(
+    f"Precomputed from {int(stats.counts.sum()):,} sales in {len(stats)} area and room groups. "
+    f"Medians and percentiles are within 1% of the exact values."
+)
+timer.finish("render")
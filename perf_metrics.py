@@ -0,0 +1,264 @@
+"""Stage timings, cache hit counts and memory of the Streamlit pages.
+
+Pages time their stages (data load, filter, encode, predict, render) with a
+``PageTimer`` and wrap their cached loaders with ``cached`` instead of calling
+``st.cache_data`` / ``st.cache_resource`` directly, which also counts how often
+a call was answered from the cache. ``shared_metrics()`` collects everything
+for the process in rolling histograms; the Additional Information page shows
+them to admins and ``prometheus()`` renders them in the Prometheus text format.
+
+Configured with environment variables:
+    PERF_METRICS_FILE     file the Prometheus text is written to (default: none),
+                          e.g. for node_exporter's textfile collector
+    PERF_EXPORT_SECONDS   minimum seconds between writes (default 15)
+    PERF_WINDOW_SECONDS   window of the rolling histograms (default 900)
+    APP_ADMIN_TOKEN       shows the performance panel for ``?admin=<token>``
+"""
+
+import functools
+import os
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+
+EXPORT_FILE = os.environ.get("PERF_METRICS_FILE") or None
+EXPORT_SECONDS = float(os.environ.get("PERF_EXPORT_SECONDS", 15))
+WINDOW_SECONDS = float(os.environ.get("PERF_WINDOW_SECONDS", 15 * 60))
+ADMIN_TOKEN_ENV = "APP_ADMIN_TOKEN"
+# Upper bounds of the duration buckets in seconds, as Prometheus histograms use
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def rss_mb() -> float:
+    """Resident memory of this process in MB."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except OSError:
+        # Peak instead of current RSS where /proc is not available
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1e6 if sys.platform == "darwin" else peak / 1e3
+
+
+class RollingHistogram:
+    """Cumulative bucket counts for export plus a time window for percentiles."""
+
+    def __init__(self, buckets=BUCKETS, window_seconds: float = WINDOW_SECONDS, max_samples: int = 5000):
+        self.buckets = buckets
+        self.window_seconds = window_seconds
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self._samples = deque(maxlen=max_samples)
+
+    def observe(self, seconds: float, now: float) -> None:
+        self.bucket_counts[int(np.searchsorted(self.buckets, seconds))] += 1
+        self.total += seconds
+        self.count += 1
+        self._samples.append((now, seconds))
+
+    def window(self, now: float) -> np.ndarray:
+        cutoff = now - self.window_seconds
+        return np.array([seconds for t, seconds in self._samples if t >= cutoff])
+
+    def summary(self, now: float) -> dict:
+        values = self.window(now) * 1000
+        if len(values) == 0:
+            return {"count": 0, "p50_ms": None, "p95_ms": None, "p99_ms": None, "max_ms": None}
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        return {"count": len(values), "p50_ms": float(p50), "p95_ms": float(p95),
+                "p99_ms": float(p99), "max_ms": float(values.max())}
+
+
+class PerfMetrics:
+    """Process-wide stage timings, cache hits and memory samples."""
+
+    def __init__(self, export_file: str = EXPORT_FILE, export_seconds: float = EXPORT_SECONDS,
+                 window_seconds: float = WINDOW_SECONDS):
+        self.export_file = export_file
+        self.export_seconds = export_seconds
+        self.window_seconds = window_seconds
+        self.started = time.time()
+        self._stages = {}
+        self._cache = defaultdict(lambda: {"hit": 0, "miss": 0})
+        self._memory = deque(maxlen=2000)
+        self._lock = threading.Lock()
+        self._last_export = 0.0
+
+    def observe(self, page: str, stage: str, seconds: float) -> None:
+        now = time.time()
+        with self._lock:
+            if (page, stage) not in self._stages:
+                self._stages[page, stage] = RollingHistogram(window_seconds=self.window_seconds)
+            self._stages[page, stage].observe(seconds, now)
+
+    def record_cache(self, name: str, hit: bool) -> None:
+        with self._lock:
+            self._cache[name]["hit" if hit else "miss"] += 1
+
+    def sample_memory(self) -> float:
+        value = rss_mb()
+        with self._lock:
+            self._memory.append((time.time(), value))
+        return value
+
+    def stage_summary(self) -> list:
+        now = time.time()
+        with self._lock:
+            return [
+                {"page": page, "stage": stage, "total_count": h.count, **h.summary(now)}
+                for (page, stage), h in sorted(self._stages.items())
+            ]
+
+    def stage_window(self, page: str, stage: str) -> np.ndarray:
+        """Durations in ms of one stage within the rolling window."""
+        with self._lock:
+            histogram = self._stages.get((page, stage))
+            return np.array([]) if histogram is None else histogram.window(time.time()) * 1000
+
+    def cache_summary(self) -> list:
+        with self._lock:
+            return [
+                {"cache": name, "hits": c["hit"], "misses": c["miss"],
+                 "hit_rate": c["hit"] / (c["hit"] + c["miss"]) if c["hit"] + c["miss"] else 0.0}
+                for name, c in sorted(self._cache.items())
+            ]
+
+    def memory_samples(self) -> list:
+        with self._lock:
+            return list(self._memory)
+
+    def prometheus(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = [
+            "# HELP app_stage_duration_seconds Duration of page stages.",
+            "# TYPE app_stage_duration_seconds histogram",
+        ]
+        with self._lock:
+            for (page, stage), h in sorted(self._stages.items()):
+                labels = f'page="{page}",stage="{stage}"'
+                cumulative = np.cumsum(h.bucket_counts)
+                for bound, count in zip(h.buckets, cumulative):
+                    lines.append(f'app_stage_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'app_stage_duration_seconds_bucket{{{labels},le="+Inf"}} {h.count}')
+                lines.append(f"app_stage_duration_seconds_sum{{{labels}}} {h.total:.6f}")
+                lines.append(f"app_stage_duration_seconds_count{{{labels}}} {h.count}")
+
+            lines += [
+                "# HELP app_cache_requests_total Calls of cached Streamlit functions.",
+                "# TYPE app_cache_requests_total counter",
+            ]
+            for name, c in sorted(self._cache.items()):
+                for result in ("hit", "miss"):
+                    lines.append(f'app_cache_requests_total{{cache="{name}",result="{result}"}} {c[result]}')
+
+        from prediction_cache import shared_cache
+        lines += [
+            "# HELP app_prediction_cache_events_total Prediction cache lookups and evictions.",
+            "# TYPE app_prediction_cache_events_total counter",
+        ]
+        for event, count in shared_cache().counters.items():
+            lines.append(f'app_prediction_cache_events_total{{event="{event}"}} {count}')
+
+        lines += [
+            "# HELP app_process_resident_memory_bytes Resident memory of the app process.",
+            "# TYPE app_process_resident_memory_bytes gauge",
+            f"app_process_resident_memory_bytes {rss_mb() * 1e6:.0f}",
+            "# HELP app_process_start_time_seconds Start time of the metrics collection.",
+            "# TYPE app_process_start_time_seconds gauge",
+            f"app_process_start_time_seconds {self.started:.0f}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def maybe_export(self) -> None:
+        """Write the Prometheus text to ``export_file`` at most every ``export_seconds``."""
+        if not self.export_file or time.time() - self._last_export < self.export_seconds:
+            return
+        self._last_export = time.time()
+        tmp_path = f"{self.export_file}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus())
+        os.replace(tmp_path, self.export_file)
+
+
+class PageTimer:
+    """Times consecutive stages of one page run.
+
+    ``mark(stage)`` records the time since the previous mark under ``stage``;
+    ``finish`` also records the whole run, samples memory and exports.
+    """
+
+    def __init__(self, metrics: PerfMetrics, page: str):
+        self.metrics = metrics
+        self.page = page
+        self.start = self._last = time.perf_counter()
+
+    def mark(self, stage: str) -> None:
+        now = time.perf_counter()
+        self.metrics.observe(self.page, stage, now - self._last)
+        self._last = now
+
+    def finish(self, stage: str = "render") -> None:
+        self.mark(stage)
+        self.metrics.observe(self.page, "total", self._last - self.start)
+        self.metrics.sample_memory()
+        self.metrics.maybe_export()
+
+
+_local = threading.local()
+
+
+def _missed() -> set:
+    if not hasattr(_local, "missed"):
+        _local.missed = set()
+    return _local.missed
+
+
+def cached(cache_decorator, **options):
+    """``st.cache_data`` / ``st.cache_resource`` that also counts cache hits.
+
+    Streamlit runs the function body only on a miss, in the calling thread, so
+    a thread-local flag set by the body tells the caller which one it was.
+    """
+    def decorate(fn):
+        name = fn.__name__
+
+        @functools.wraps(fn)
+        def body(*args, **kwargs):
+            _missed().add(name)
+            return fn(*args, **kwargs)
+
+        cached_fn = cache_decorator(**options)(body) if options else cache_decorator(body)
+
+        @functools.wraps(fn)
+        def call(*args, **kwargs):
+            # One flag per function, since cached functions call each other
+            _missed().discard(name)
+            result = cached_fn(*args, **kwargs)
+            shared_metrics().record_cache(name, hit=name not in _missed())
+            return result
+
+        call.clear = cached_fn.clear
+        return call
+    return decorate
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_metrics() -> PerfMetrics:
+    """The metrics shared by every session in this process."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = PerfMetrics()
+        return _shared
+
+
+def page_timer(page: str) -> PageTimer:
+    return PageTimer(shared_metrics(), page)
@@ -0,0 +1,153 @@
+"""Process-wide cache of finished predictions.
+
+Many users submit the same common apartments. ``PredictionCache`` keeps the
+point prediction and interval for a canonicalized ``user_data`` dict, model,
+model version and alpha. It is bounded by LRU and expires entries after a TTL,
+and can also keep them in a local SQLite file that survives restarts. Hit and
+miss counters are shown on the Additional Information page.
+
+The cache is configured with environment variables:
+    PREDICTION_CACHE_SIZE  entries kept in memory (default 5000)
+    PREDICTION_CACHE_TTL   seconds before an entry expires (default 86400)
+    PREDICTION_CACHE_DB    SQLite file for persistence (default: memory only)
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_SIZE = int(os.environ.get("PREDICTION_CACHE_SIZE", 5000))
+DEFAULT_TTL = float(os.environ.get("PREDICTION_CACHE_TTL", 24 * 60 * 60))
+DEFAULT_DB = os.environ.get("PREDICTION_CACHE_DB") or None
+
+
+def canonical_key(user_data: dict, model_name: str, alpha, version: str = "") -> str:
+    """Key that is equal for equivalent inputs, e.g. 2 and 2.0 rooms.
+
+    ``alpha`` may be a single value or a list of alphas.
+    """
+    alphas = [float(a) for a in alpha] if isinstance(alpha, (list, tuple)) else float(alpha)
+    canonical = {}
+    for key, value in user_data.items():
+        if isinstance(value, str):
+            canonical[key] = value.strip()
+        else:
+            canonical[key] = float(value)
+    return json.dumps(
+        {"model": model_name, "version": version, "alpha": alphas, "input": canonical},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+
+
+class PredictionCache:
+    """LRU + TTL cache with an optional SQLite backing file."""
+
+    def __init__(self, max_entries: int = DEFAULT_SIZE, ttl_seconds: float = DEFAULT_TTL, db_path: str = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.counters = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS predictions (key TEXT PRIMARY KEY, value TEXT, created REAL)"
+            )
+            self._db.commit()
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, created = entry
+                if now - created <= self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self.counters["hits"] += 1
+                    return value
+                del self._entries[key]
+                self.counters["expirations"] += 1
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, created FROM predictions WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and now - row[1] <= self.ttl_seconds:
+                    value = json.loads(row[0])
+                    self._store(key, value, row[1])
+                    self.counters["hits"] += 1
+                    self.counters["disk_hits"] += 1
+                    return value
+
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, key: str, value) -> None:
+        now = time.time()
+        with self._lock:
+            self._store(key, value, now)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO predictions (key, value, created) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), now),
+                )
+                self._writes += 1
+                # Trim the file now and then instead of on every write
+                if self._writes % 100 == 0:
+                    self._trim_db(now)
+                self._db.commit()
+
+    def _store(self, key: str, value, created: float) -> None:
+        self._entries[key] = (value, created)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def _trim_db(self, now: float) -> None:
+        self._db.execute("DELETE FROM predictions WHERE created < ?", (now - self.ttl_seconds,))
+        self._db.execute(
+            "DELETE FROM predictions WHERE key NOT IN "
+            "(SELECT key FROM predictions ORDER BY created DESC LIMIT ?)",
+            (self.max_entries,),
+        )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM predictions")
+                self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                **self.counters,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hit_rate": self.counters["hits"] / lookups if lookups else 0.0,
+                "persistent": self._db is not None,
+            }
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_cache() -> PredictionCache:
+    """The cache shared by every session in this process."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = PredictionCache(DEFAULT_SIZE, DEFAULT_TTL, DEFAULT_DB)
+        return _shared
@@ -0,0 +1,362 @@
+"""Local prediction service shared by all Streamlit workers.
+
+Without it every Streamlit process loads its own models and runs them on the
+thread that renders the page. ``prediction_service.py`` serves the models of the
+model registry (hot swapped like in the app) from one warm process over HTTP,
+on a TCP port or a Unix socket, using only ``asyncio``.
+
+Requests for the same model that arrive within ``--batch-window`` milliseconds
+are encoded together and answered by one vectorized ensemble evaluation, run in
+a worker thread so the event loop keeps accepting requests. Finished
+predictions go through the same ``shared_cache()`` as the app.
+
+Endpoints:
+    POST /predict   {"model": "Random Forest", "input": {...}, "alpha": 0.1}
+    GET  /health    active model version and registry status
+    GET  /metrics   request counts, batch sizes and latency percentiles
+
+The prediction page becomes a client of the service when ``PREDICTION_SERVICE``
+is set to its address.
+
+Usage:
+    python prediction_service.py --port 8765
+    python prediction_service.py --unix /tmp/apartment-predict.sock
+    PREDICTION_SERVICE=http://127.0.0.1:8765 streamlit run Home.py
+    PREDICTION_SERVICE=unix:///tmp/apartment-predict.sock streamlit run Home.py
+"""
+
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import socket
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from conformal import compute_outputs
+from features import SCHEMA_FILE, FeatureEncoder, build_schema, clean_apartments, load_schema, save_schema
+from model_registry import shared_registry
+from model_store import MODEL_DIR
+from prediction_cache import canonical_key, shared_cache
+
+SERVICE_ENV = "PREDICTION_SERVICE"
+DEFAULT_PORT = 8765
+BATCH_WINDOW_MS = float(os.environ.get("PREDICTION_BATCH_WINDOW_MS", 5))
+MAX_BATCH = 64
+MAX_BODY_BYTES = 1 << 16
+
+
+class LatencyStats:
+    """Rolling window of request latencies in milliseconds."""
+
+    def __init__(self, window: int = 2048):
+        self._values = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, milliseconds: float) -> None:
+        with self._lock:
+            self._values.append(milliseconds)
+
+    def summary(self) -> dict:
+        with self._lock:
+            values = np.array(self._values)
+        if len(values) == 0:
+            return {"count": 0, "p50_ms": None, "p95_ms": None, "p99_ms": None}
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        return {"count": len(values), "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99)}
+
+
+class PredictionService:
+    """Micro-batching front of the model registry."""
+
+    def __init__(self, model_dir: str = MODEL_DIR, batch_window_ms: float = BATCH_WINDOW_MS,
+                 max_batch: int = MAX_BATCH):
+        self.model_dir = model_dir
+        self.registry = shared_registry(model_dir, max_resident=4)
+        self.batch_window = batch_window_ms / 1000
+        self.max_batch = max_batch
+        self.cache = shared_cache()
+        self.started = time.time()
+        self.counters = {"requests": 0, "errors": 0, "cache_hits": 0, "batches": 0, "batched_rows": 0}
+        self.latency = LatencyStats()
+        self.batch_sizes = deque(maxlen=2048)
+        self._queues = {}
+        self._encoders = {}
+        self._encoder_lock = threading.Lock()
+
+    def encoder(self, store) -> FeatureEncoder:
+        schema_file = store.manifest.get("schema", SCHEMA_FILE)
+        with self._encoder_lock:
+            if schema_file not in self._encoders:
+                if not os.path.exists(os.path.join(self.model_dir, schema_file)):
+                    # Same fallback as the prediction page for unversioned models
+                    from dataset import load_apartments
+                    save_schema(build_schema(clean_apartments(load_apartments())), self.model_dir, schema_file)
+                self._encoders[schema_file] = FeatureEncoder(load_schema(self.model_dir, schema_file))
+            return self._encoders[schema_file]
+
+    async def predict(self, model_name: str, user_data: dict, alpha) -> dict:
+        store = self.registry.store
+        if model_name not in store.names:
+            raise KeyError(f"Unknown model '{model_name}', available: {', '.join(store.names)}")
+
+        cache_key = canonical_key(user_data, model_name, alpha, store.fingerprint)
+        result = self.cache.get(cache_key)
+        if result is not None:
+            self.counters["cache_hits"] += 1
+            return result
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue(model_name).put((user_data, alpha, future))
+        result = await future
+        self.cache.put(cache_key, result)
+        return result
+
+    def _queue(self, model_name: str) -> asyncio.Queue:
+        # One queue and batching task per model, started on first use
+        if model_name not in self._queues:
+            self._queues[model_name] = asyncio.Queue()
+            asyncio.get_running_loop().create_task(self._batcher(model_name, self._queues[model_name]))
+        return self._queues[model_name]
+
+    async def _batcher(self, model_name: str, queue: asyncio.Queue) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                results = await loop.run_in_executor(None, self._predict_batch, model_name, batch)
+            except Exception as exc:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+            for (_, _, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def _predict_batch(self, model_name: str, batch: list) -> list:
+        """A result dict, or the exception to raise, for every request in ``batch``."""
+        # One model version for the whole batch
+        store = self.registry.store
+        encoder = self.encoder(store)
+        results = [None] * len(batch)
+        rows, positions = [], []
+        for i, (user_data, _, _) in enumerate(batch):
+            try:
+                rows.append(encoder.encode(user_data))
+                positions.append(i)
+            except (KeyError, TypeError, ValueError) as exc:
+                # A bad request fails on its own, not the whole batch
+                results[i] = ValueError(f"Invalid input: {exc}")
+        if not rows:
+            return results
+
+        outputs = compute_outputs(store.get(model_name), np.vstack(rows))
+        self.counters["batches"] += 1
+        self.counters["batched_rows"] += len(rows)
+        self.batch_sizes.append(len(rows))
+
+        # Requests in a batch usually share their alphas; look each set up once
+        intervals = {}
+        for row, i in enumerate(positions):
+            alpha = batch[i][1]
+            alpha_key = json.dumps(alpha)
+            try:
+                if alpha_key not in intervals:
+                    intervals[alpha_key] = outputs.intervals(alpha)
+            except (TypeError, ValueError) as exc:
+                results[i] = ValueError(str(exc))
+                continue
+            results[i] = {
+                "prediction": float(outputs.y_pred[row]),
+                "lower": intervals[alpha_key][row, 0].tolist(),
+                "upper": intervals[alpha_key][row, 1].tolist(),
+                "version": store.version,
+            }
+        return results
+
+    def health(self) -> dict:
+        store = self.registry.store
+        return {
+            "status": "ok",
+            "version": store.version,
+            "fingerprint": store.fingerprint,
+            "models": store.names,
+            "resident": store.resident(),
+            "uptime_seconds": time.time() - self.started,
+            "registry": self.registry.status,
+        }
+
+    def metrics(self) -> dict:
+        sizes = list(self.batch_sizes)
+        return {
+            **self.counters,
+            "mean_batch_size": float(np.mean(sizes)) if sizes else None,
+            "max_batch_size": max(sizes) if sizes else None,
+            "latency": self.latency.summary(),
+            "cache": dict(self.cache.counters),
+        }
+
+    # -----------------------------------------------------------------------
+    # HTTP
+    # -----------------------------------------------------------------------
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        start = time.perf_counter()
+        path = None
+        try:
+            method, path, body = await self._read_request(reader)
+            status, payload = await self._route(method, path, body)
+        except (KeyError, ValueError, TypeError) as exc:
+            # str() of a KeyError adds quotes around the message
+            status, payload = 400, {"error": str(exc.args[0]) if exc.args else str(exc)}
+        except Exception as exc:
+            status, payload = 500, {"error": f"{type(exc).__name__}: {exc}"}
+        if status >= 400:
+            self.counters["errors"] += 1
+
+        data = json.dumps(payload).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status} {http.client.responses.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+            f"Connection: close\r\n\r\n".encode("latin-1") + data
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+        # Only successful predictions count towards the latency percentiles
+        if path == "/predict" and status == 200:
+            self.latency.add((time.perf_counter() - start) * 1000)
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> tuple:
+        request_line = (await reader.readline()).decode("latin-1").split()
+        if len(request_line) < 2:
+            raise ValueError("Malformed request line")
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get("content-length", 0))
+        if length > MAX_BODY_BYTES:
+            raise ValueError("Request body too large")
+        body = await reader.readexactly(length) if length else b""
+        return request_line[0].upper(), request_line[1], body
+
+    async def _route(self, method: str, path: str, body: bytes) -> tuple:
+        if method == "GET" and path == "/health":
+            return 200, self.health()
+        if method == "GET" and path == "/metrics":
+            return 200, self.metrics()
+        if method == "POST" and path == "/predict":
+            self.counters["requests"] += 1
+            request = json.loads(body or b"{}")
+            result = await self.predict(request["model"], request["input"], request.get("alpha", 0.1))
+            return 200, result
+        return 404, {"error": f"No route for {method} {path}"}
+
+
+async def serve(service: PredictionService, host: str = "127.0.0.1", port: int = DEFAULT_PORT,
+                unix_path: str = None) -> None:
+    if unix_path:
+        if os.path.exists(unix_path):
+            os.remove(unix_path)
+        server = await asyncio.start_unix_server(service.handle, path=unix_path)
+    else:
+        server = await asyncio.start_server(service.handle, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+# ---------------------------------------------------------------------------
+# Client
+# ---------------------------------------------------------------------------
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+class PredictionClient:
+    """Blocking client for the service, e.g. ``http://127.0.0.1:8765`` or ``unix:///tmp/x.sock``."""
+
+    def __init__(self, address: str, timeout: float = 10.0):
+        self.address = address
+        self.timeout = timeout
+
+    def _connection(self) -> http.client.HTTPConnection:
+        if self.address.startswith("unix://"):
+            return _UnixHTTPConnection(self.address[len("unix://"):], self.timeout)
+        host = self.address.split("://", 1)[-1].rstrip("/")
+        return http.client.HTTPConnection(host, timeout=self.timeout)
+
+    def _request(self, method: str, path: str, payload: dict = None) -> dict:
+        connection = self._connection()
+        try:
+            body = None if payload is None else json.dumps(payload)
+            connection.request(method, path, body=body, headers={"Content-Type": "application/json"})
+            response = connection.getresponse()
+            result = json.loads(response.read())
+        finally:
+            connection.close()
+        if response.status != 200:
+            raise RuntimeError(f"Prediction service returned {response.status}: {result.get('error')}")
+        return result
+
+    def predict(self, user_data: dict, model_name: str, alpha) -> dict:
+        """Same result dict as the prediction page's ``cached_prediction``."""
+        return self._request("POST", "/predict", {"model": model_name, "input": user_data, "alpha": alpha})
+
+    def health(self) -> dict:
+        return self._request("GET", "/health")
+
+    def metrics(self) -> dict:
+        return self._request("GET", "/metrics")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the apartment price models to the Streamlit app.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="TCP port to listen on")
+    parser.add_argument("--unix", default=None, help="Listen on this Unix socket instead of TCP")
+    parser.add_argument("--model-dir", default=MODEL_DIR, help="Directory with the model manifest")
+    parser.add_argument("--batch-window", type=float, default=BATCH_WINDOW_MS,
+                        help="Milliseconds to wait for more requests to batch together")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH, help="Largest batch per model")
+    parser.add_argument("--preload", nargs="*", default=[], help="Models to load before accepting requests")
+    args = parser.parse_args()
+
+    service = PredictionService(args.model_dir, args.batch_window, args.max_batch)
+    for name in args.preload:
+        service.registry.store.get(name)
+    where = args.unix or f"http://{args.host}:{args.port}"
+    print(f"Serving model version {service.registry.store.version} on {where}")
+    asyncio.run(serve(service, args.host, args.port, args.unix))
@@ -0,0 +1,218 @@
+"""Precomputed price surface for the What-If page.
+
+The inputs of the User Input page are almost all discrete: location area, room
+count, floor -2..10 and three yes/no flags. ``build_surface`` predicts every
+combination of those on a grid of area and rent knots with vectorized batch
+predictions, once per model version, and stores the point prediction and the
+bounds for ``SURFACE_ALPHAS`` as uint16 thousands of SEK in one memory-mapped
+``.npy`` file per model. Location areas the models never saw all encode the
+same way and share the ``OTHER_AREA`` slice.
+
+``PriceSurface.lookup`` answers many inputs at once with index lookups on the
+discrete axes and bilinear interpolation between the area and rent knots, so
+the What-If page draws its sensitivity curves without running an ensemble.
+
+Usage:
+    python price_surface.py --model-dir models --workers 4
+    python price_surface.py --models "Decision Tree" AdaBoost
+"""
+
+import argparse
+import itertools
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from conformal import compute_outputs
+from features import SCHEMA_FILE, FeatureEncoder, load_schema
+from model_store import MODEL_DIR, ModelStore, model_slug
+
+AREA_KNOTS = np.arange(10.0, 201.0, 10.0)
+RENT_KNOTS = np.arange(500.0, 5001.0, 750.0)
+FLOORS = tuple(float(floor) for floor in range(-2, 11))
+FLAG_COLS = ("has_elevator", "has_fireplace", "has_outside")
+SURFACE_ALPHAS = (0.1, 0.5)
+OTHER_AREA = "(other)"
+# Stored as thousands of SEK so prices up to 65 MSEK fit in a uint16
+UNIT_SEK = 1000
+CHUNK_ROWS = 1000
+
+
+def surface_dir(version: int) -> str:
+    return f"price_surface-v{version}"
+
+
+def value_names(alphas=SURFACE_ALPHAS) -> list:
+    return ["prediction"] + [f"{bound}_{alpha}" for alpha in alphas for bound in ("lower", "upper")]
+
+
+def grid_axes(schema: dict) -> dict:
+    """Levels of every discrete axis, in storage order."""
+    return {
+        "location_area": list(schema["categories"]["location_area"]) + [OTHER_AREA],
+        "number_of_rooms": [float(rooms) for rooms in schema["categories"]["number_of_rooms"]],
+        "floor": list(FLOORS),
+        **{col: ["no", "yes"] for col in FLAG_COLS},
+    }
+
+
+def _slice_inputs(axes: dict, location_area: str) -> pd.DataFrame:
+    # Every combination of the other axes and knots for one location area
+    names = ["number_of_rooms", "floor", *FLAG_COLS, "area", "rent"]
+    levels = [axes["number_of_rooms"], axes["floor"], *(axes[col] for col in FLAG_COLS), AREA_KNOTS, RENT_KNOTS]
+    df = pd.DataFrame(list(itertools.product(*levels)), columns=names)
+    df["location_area"] = location_area
+    return df
+
+
+def _predict_slice(model_dir: str, entry: dict, schema_file: str, location_area: str) -> np.ndarray:
+    """Encoded values for one location area, shaped like one surface slice."""
+    store = ModelStore(model_dir, max_resident=1, manifest={"models": {"model": entry}})
+    model = store.get("model")
+    schema = load_schema(model_dir, schema_file)
+    axes = grid_axes(schema)
+    X = FeatureEncoder(schema).encode_frame(_slice_inputs(axes, location_area))
+
+    values = np.empty((len(X), 1 + 2 * len(SURFACE_ALPHAS)))
+    for start in range(0, len(X), CHUNK_ROWS):
+        # Chunks keep the sorted CV+ distributions of a batch small
+        outputs = compute_outputs(model, X[start:start + CHUNK_ROWS])
+        intervals = outputs.intervals(SURFACE_ALPHAS)
+        chunk = slice(start, start + len(outputs.y_pred))
+        values[chunk, 0] = outputs.y_pred
+        values[chunk, 1::2] = intervals[:, 0, :]
+        values[chunk, 2::2] = intervals[:, 1, :]
+
+    encoded = np.clip(np.rint(values / UNIT_SEK), 0, np.iinfo(np.uint16).max).astype(np.uint16)
+    shape = [len(axes["number_of_rooms"]), len(axes["floor"]), 2, 2, 2, len(AREA_KNOTS), len(RENT_KNOTS), values.shape[1]]
+    return encoded.reshape(shape)
+
+
+def build_surface(model_dir: str = MODEL_DIR, workers: int = None, models: list = None) -> dict:
+    """Write the surface of the active model version and return its meta data."""
+    store = ModelStore(model_dir)
+    schema_file = store.manifest.get("schema", SCHEMA_FILE)
+    axes = grid_axes(load_schema(model_dir, schema_file))
+    names = models or store.names
+    out_dir = os.path.join(model_dir, surface_dir(store.version))
+    tmp_dir = out_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for name in names:
+            entry = store.manifest["models"][name]
+            slices = pool.map(
+                _predict_slice,
+                *zip(*[(model_dir, entry, schema_file, area) for area in axes["location_area"]]),
+            )
+            np.save(os.path.join(tmp_dir, model_slug(name) + ".npy"), np.stack(list(slices)), allow_pickle=False)
+
+    meta = {
+        "version": store.version,
+        "fingerprint": store.fingerprint,
+        "models": {name: model_slug(name) + ".npy" for name in names},
+        "axes": axes,
+        "area_knots": AREA_KNOTS.tolist(),
+        "rent_knots": RENT_KNOTS.tolist(),
+        "alphas": list(SURFACE_ALPHAS),
+        "values": value_names(),
+        "unit_sek": UNIT_SEK,
+        "build_seconds": time.perf_counter() - start,
+    }
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2, ensure_ascii=False)
+    # Swap the finished directory in, so readers never see a partial surface
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    return meta
+
+
+def _interpolation(knots: np.ndarray, x: np.ndarray) -> tuple:
+    # Lower knot index and weight of the upper knot; clamped outside the grid
+    i = np.clip(np.searchsorted(knots, x, side="right") - 1, 0, len(knots) - 2)
+    t = np.clip((x - knots[i]) / (knots[i + 1] - knots[i]), 0.0, 1.0)
+    return i, t
+
+
+class PriceSurface:
+    """Read-only view of a price surface directory."""
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.version = self.meta["version"]
+        self.fingerprint = self.meta["fingerprint"]
+        self.axes = self.meta["axes"]
+        self.alphas = self.meta["alphas"]
+        self.area_knots = np.array(self.meta["area_knots"])
+        self.rent_knots = np.array(self.meta["rent_knots"])
+        self._arrays = {
+            name: np.load(os.path.join(path, file_name), mmap_mode="r", allow_pickle=False)
+            for name, file_name in self.meta["models"].items()
+        }
+        self._levels = {
+            axis: {FeatureEncoder._key(level): i for i, level in enumerate(levels)}
+            for axis, levels in self.axes.items()
+        }
+
+    @property
+    def models(self) -> list:
+        return list(self._arrays)
+
+    def _indices(self, axis: str, values) -> np.ndarray:
+        levels = self._levels[axis]
+        missing = levels.get(OTHER_AREA)
+        indices = [levels.get(FeatureEncoder._key(value), missing) for value in values]
+        if any(i is None for i in indices):
+            unknown = sorted({str(v) for v, i in zip(values, indices) if i is None})
+            raise KeyError(f"No surface values for {axis} {', '.join(unknown)}")
+        return np.array(indices, dtype=np.intp)
+
+    def lookup(self, model_name: str, inputs: pd.DataFrame) -> pd.DataFrame:
+        """Prediction and bounds in SEK for every row of ``inputs``.
+
+        ``inputs`` has the User Input page's columns. Discrete inputs are looked
+        up, area and rent are interpolated between the grid knots.
+        """
+        values = self._arrays[model_name]
+        discrete = tuple(
+            self._indices(axis, inputs[axis].tolist())
+            for axis in ("location_area", "number_of_rooms", "floor", *FLAG_COLS)
+        )
+        i, ti = _interpolation(self.area_knots, inputs["area"].to_numpy(dtype=float))
+        j, tj = _interpolation(self.rent_knots, inputs["rent"].to_numpy(dtype=float))
+
+        def corner(a, r):
+            return values[discrete + (a, r)].astype(float)
+
+        ti, tj = ti[:, np.newaxis], tj[:, np.newaxis]
+        result = ((1 - ti) * (1 - tj) * corner(i, j) + ti * (1 - tj) * corner(i + 1, j)
+                  + (1 - ti) * tj * corner(i, j + 1) + ti * tj * corner(i + 1, j + 1))
+        return pd.DataFrame(result * self.meta["unit_sek"], columns=self.meta["values"], index=inputs.index)
+
+
+def load_surface(model_dir: str = MODEL_DIR, version: int = 0) -> PriceSurface:
+    path = os.path.join(model_dir, surface_dir(version))
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        raise FileNotFoundError(f"No price surface for model version {version}; run price_surface.py")
+    return PriceSurface(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute the What-If page's price surface.")
+    parser.add_argument("--model-dir", default=MODEL_DIR, help="Directory with the model manifest")
+    parser.add_argument("--workers", type=int, default=None, help="Prediction processes (default: CPU count)")
+    parser.add_argument("--models", nargs="+", default=None, help="Models to include (default: all)")
+    args = parser.parse_args()
+
+    meta = build_surface(args.model_dir, args.workers, args.models)
+    cells = np.prod([len(levels) for levels in meta["axes"].values()]) * len(AREA_KNOTS) * len(RENT_KNOTS)
+    print(f"Version {meta['version']}: {cells:,} grid points per model for {', '.join(meta['models'])} "
+          f"in {meta['build_seconds']:.0f}s")
@@ -0,0 +1,226 @@
+"""Incremental update of the apartment price models with newly sold listings.
+
+Instead of rerunning the whole notebook, ``update``:
+
+- adds the new listings that are not stored yet after the existing rows
+  (``dataset.merge_apartments``),
+- adds one-hot columns for category levels the models have not seen, after the
+  existing columns so the trained trees keep reading the right features,
+- splits only the new rows into train/test and CV folds; existing rows keep the
+  split and fold recorded for the current version,
+- grows the Random Forests (also inside Soft Voting) by ``--new-trees`` trees
+  fitted on all training rows, keeping the existing trees as a warm start does,
+- refits the cheap Decision Tree and AdaBoost models,
+- recomputes the CV+ conformity scores out of fold on all training rows,
+
+and publishes the result as the next model version, the same way ``train.py``
+does, so running apps switch to it without a restart. Only then are the new
+listings written to ``apartments_appended.csv`` (``dataset.save_appended``) and
+added to the market statistics (``market_stats.refresh_stats``), so a failed
+update leaves the dataset untouched and can be run again. Like ``train.py`` it then
+fits the fast students of the new version (``distill.py``); ``--no-distill``
+skips that.
+
+Usage:
+    python retrain.py new_sales.csv --model-dir models --new-trees 20
+    python retrain.py new_sales.csv --no-distill
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from compact_model import compact_entry, export_update, load_compact
+from dataset import DATASET_FILE, RAW_CSV, merge_apartments, save_appended
+from distill import DISTILL_MODELS, distill
+from features import clean_apartments, extend_schema, load_schema, save_schema
+from market_stats import refresh_stats
+from model_registry import publish_version
+from model_store import MODEL_DIR, ModelStore, model_slug, next_version, versioned_name
+from train import (
+    BASE_MODELS, MAPIE_SEED, METRIC_NAMES, METRICS_FILE, N_FOLDS, REPORT_FILE, SPLIT_SEED, TEST_SIZE,
+    assemble_voting, encode, fit_base_models, make_estimator, schema_file, score, split_file,
+)
+
+NEW_TREES = 20
+
+
+def read_listings(path: str) -> pd.DataFrame:
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    return pd.read_csv(path)
+
+
+def split_new_rows(rows: np.ndarray, version: int) -> tuple:
+    """Train rows, test rows and CV folds of the train rows for new listings."""
+    from sklearn.model_selection import train_test_split
+
+    if len(rows) * TEST_SIZE >= 1:
+        train_rows, test_rows = train_test_split(rows, test_size=TEST_SIZE, random_state=SPLIT_SEED)
+    else:
+        train_rows, test_rows = rows, rows[:0]
+    # Spread the new rows evenly over the existing folds
+    rng = np.random.default_rng(MAPIE_SEED + version)
+    folds = rng.permutation(len(train_rows)) % N_FOLDS
+    return train_rows, test_rows, folds
+
+
+def update(
+    new_listings_path: str,
+    dataset_path: str = DATASET_FILE,
+    csv_path: str = RAW_CSV,
+    model_dir: str = MODEL_DIR,
+    new_trees: int = NEW_TREES,
+    workers: int = None,
+    metrics_path: str = METRICS_FILE,
+    distill_models: tuple = DISTILL_MODELS,
+) -> dict:
+    """Update the current model version with new listings; returns a report.
+
+    The new version's ``distill_models`` get fast students; pass an empty tuple
+    to skip them.
+    """
+    from sklearn.ensemble import RandomForestRegressor
+
+    stages = {}
+    start = time.perf_counter()
+
+    store = ModelStore(model_dir, max_resident=4)
+    if "split" not in store.manifest:
+        raise ValueError(f"The models in {model_dir} have no recorded training split; run train.py once first")
+    if store.manifest.get("mode") == "lightweight":
+        raise ValueError("Lightweight models cannot be updated; run train.py --lightweight again")
+    version = next_version(model_dir)
+    schema = load_schema(model_dir, store.manifest["schema"])
+    split = np.load(os.path.join(model_dir, store.manifest["split"]))
+    old_models = {name: store.get(name) for name in store.names}
+
+    combined, appended = merge_apartments(read_listings(new_listings_path), dataset_path, csv_path)
+    apartments = clean_apartments(combined)
+    new_rows = appended[np.isin(appended, apartments.index)]
+    if len(new_rows) == 0:
+        raise ValueError("None of the new listings are both usable for training and not stored yet")
+    schema, added_columns = extend_schema(schema, apartments.loc[new_rows])
+
+    new_train, new_test, new_folds = split_new_rows(new_rows, version)
+    train_rows = np.concatenate([split["train"], new_train])
+    test_rows = np.concatenate([split["test"], new_test])
+    fold_index = np.concatenate([old_models[BASE_MODELS[0]].fold_index, new_folds])
+    train_X, train_y = encode(apartments.loc[train_rows], schema)
+    test_X, test_y = encode(apartments.loc[test_rows], schema)
+    stages["load"] = time.perf_counter() - start
+
+    mark = time.perf_counter()
+    splits = [(np.flatnonzero(fold_index != k), np.flatnonzero(fold_index == k)) for k in range(N_FOLDS)]
+    estimators = {
+        "Decision Tree": make_estimator("Decision Tree"),
+        "AdaBoost": make_estimator("AdaBoost"),
+        # Only the additional trees; the existing ones are kept by export_update
+        "Random Forest": RandomForestRegressor(n_estimators=new_trees, random_state=version),
+    }
+    fitted, fit_timings = fit_base_models(train_X, train_y, splits, workers, estimators)
+    stages["fit"] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    entries, metrics, updated = {}, {}, {}
+    for name in BASE_MODELS:
+        directory = versioned_name(model_slug(name), version)
+        export_update(
+            os.path.join(model_dir, directory), old_models[name], fitted[name]["full"],
+            [fitted[name][k] for k in range(N_FOLDS)], fold_index, train_X, train_y,
+        )
+        updated[name] = load_compact(os.path.join(model_dir, directory))
+        metrics[name] = score(test_y, updated[name].predict(test_X))
+        entries[name] = compact_entry(model_dir, directory)
+
+    # Voting weights are the normalized R² scores of the updated base models
+    r2 = np.array([metrics[name]["R2 Score"] for name in BASE_MODELS])
+    weights = r2 / r2.sum()
+    name = "Soft Voting"
+    directory = versioned_name(model_slug(name), version)
+    export_update(
+        os.path.join(model_dir, directory), old_models[name],
+        assemble_voting([fitted[n]["full"] for n in BASE_MODELS], weights),
+        [assemble_voting([fitted[n][k] for n in BASE_MODELS], weights) for k in range(N_FOLDS)],
+        fold_index, train_X, train_y,
+    )
+    metrics[name] = score(test_y, load_compact(os.path.join(model_dir, directory)).predict(test_X))
+    entries[name] = compact_entry(model_dir, directory)
+    stages["conformalize"] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    save_schema(schema, model_dir, schema_file(version))
+    np.savez(os.path.join(model_dir, split_file(version)), train=train_rows, test=test_rows)
+    # Published last, once every file of the version exists
+    publish_version({
+        "models": entries,
+        "version": version,
+        "mode": "cv+",
+        "schema": schema_file(version),
+        "split": split_file(version),
+        "metrics": metrics,
+    }, model_dir)
+    # The dataset changes only once the version that trained on it is published
+    save_appended(combined, appended, dataset_path)
+    # Only the appended rows are added to the per-area statistics
+    refresh_stats(combined)
+    pd.DataFrame([
+        {"Model": METRIC_NAMES[name], **metrics[name]} for name in METRIC_NAMES
+    ]).to_csv(metrics_path, index=False)
+    stages["export"] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    student_reports = distill(model_dir, distill_models) if distill_models else {}
+    stages["distill"] = time.perf_counter() - mark
+
+    report = {
+        "version": version,
+        "mode": "update",
+        "new_listings": int(len(appended)),
+        "new_train": int(len(new_train)),
+        "new_test": int(len(new_test)),
+        "added_columns": added_columns,
+        "new_trees": new_trees,
+        "workers": workers or os.cpu_count(),
+        "n_train": int(len(train_y)),
+        "n_test": int(len(test_y)),
+        "n_features": int(train_X.shape[1]),
+        "stages": stages,
+        "fits": sorted(fit_timings, key=lambda t: (t["model"], str(t["fold"]))),
+        # Student fidelity without the per-region breakdown, which is in the student's meta.json
+        "students": {
+            name: {key: value for key, value in r.items() if key != "regions"} for name, r in student_reports.items()
+        },
+        "total_seconds": time.perf_counter() - start,
+    }
+    with open(os.path.join(model_dir, REPORT_FILE), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Update the apartment price models with newly sold listings.")
+    parser.add_argument("listings", help="CSV or Parquet file shaped like apartments_sweden.csv")
+    parser.add_argument("--dataset", default=DATASET_FILE, help="Typed dataset the listings are appended to")
+    parser.add_argument("--csv", default=RAW_CSV, help="Raw CSV, ingested when the dataset is missing or stale")
+    parser.add_argument("--model-dir", default=MODEL_DIR, help="Directory with the model manifest")
+    parser.add_argument("--new-trees", type=int, default=NEW_TREES, help="Trees added to every Random Forest")
+    parser.add_argument("--workers", type=int, default=None, help="Training processes (default: CPU count)")
+    parser.add_argument("--metrics", default=METRICS_FILE, help="Metrics CSV shown on the Additional Information page")
+    parser.add_argument("--no-distill", action="store_true", help="Do not fit the fast students")
+    args = parser.parse_args()
+
+    report = update(args.listings, args.dataset, args.csv, args.model_dir, args.new_trees, args.workers, args.metrics,
+                    () if args.no_distill else DISTILL_MODELS)
+    print(f"Version {report['version']}: {report['new_train']} new training rows, "
+          f"{report['new_test']} new test rows, {report['new_trees']} new trees per forest")
+    if report["added_columns"]:
+        print("New feature columns: " + ", ".join(report["added_columns"]))
+    for name, student in report["students"].items():
+        print(f"{name} student: {student['served_regions']} of {student['total_regions']} regions served, "
+              f"prediction within {student['prediction']['p90']:.1%} of the full model for 90% of inputs")
+    print(f"Done in {report['total_seconds']:.1f}s")
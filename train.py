@@ -0,0 +1,367 @@
+"""Training pipeline for the apartment price models.
+
+Builds the same four MAPIE models as ``apartment.ipynb`` from the command line.
+The notebook fits Decision Tree, Random Forest and AdaBoost up to four times
+each (standalone, inside the voting ensemble, inside their own CV+ wrapper and
+inside the voting CV+ wrapper). Here every base model is fitted once on the full
+training set and once per CV fold, in a process pool that reads the training
+arrays from memory-mapped ``.npy`` files. The voting ensemble and all MAPIE
+wrappers are then assembled from those fitted estimators, which gives the same
+models the notebook fits.
+
+Every run writes a new model version: the compact models go to
+``<slug>-v<N>`` directories next to a versioned feature schema and the
+train/test split, and the version is published to the model registry last
+(see ``model_registry.py``), so running apps keep serving the previous version
+until they switch. The metrics go to
+``model_performance.csv`` and a timing report to ``models/training_report.json``.
+``retrain.py`` updates a version with newly sold listings. Once the version is
+published, ``distill.py`` fits the fast students of ``DISTILL_MODELS`` against
+it and writes their fidelity reports; ``--no-distill`` skips that step.
+
+``--lightweight`` builds split-conformal models for low-memory deployments
+instead: every base model is fitted once on 80% of the training set and
+calibrated on the other 20%, so a version stores one copy of each estimator and
+its sorted calibration residuals instead of six. ``coverage_report.py``
+compares their coverage, interval width, size and latency with the CV+ models.
+
+Usage:
+    python train.py --workers 4 --model-dir models
+    python train.py --lightweight --model-dir models-lite
+    python train.py --pickle apartment_models.pickle   # also write the combined pickle
+    python train.py --no-distill                         # no fast students
+"""
+
+import argparse
+import json
+import os
+import pickle
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from compact_model import export_models_compact
+from dataset import DATASET_FILE, RAW_CSV, load_apartments
+from distill import DISTILL_MODELS, distill
+from features import FeatureEncoder, build_schema, clean_apartments, save_schema
+from model_store import MODEL_DIR, next_version
+
+TEST_SIZE = 0.2
+SPLIT_SEED = 1
+MAPIE_SEED = 42
+N_FOLDS = 5
+# Share of the training set held out to calibrate lightweight models
+CALIBRATION_SIZE = 0.2
+BASE_MODELS = ("Decision Tree", "Random Forest", "AdaBoost")
+# Estimator names inside the VotingRegressor, as in the notebook
+VOTING_NAMES = ("DecisionTree", "RandomForest", "AdaBoost")
+# Model names used in model_performance.csv
+METRIC_NAMES = {
+    "Decision Tree": "Decision Tree",
+    "Random Forest": "Random Forest",
+    "AdaBoost": "AdaBoost",
+    "Soft Voting": "Voting Regressor",
+}
+METRICS_FILE = "model_performance.csv"
+REPORT_FILE = "training_report.json"
+
+
+def make_estimator(name: str):
+    from sklearn.ensemble import AdaBoostRegressor, RandomForestRegressor
+    from sklearn.tree import DecisionTreeRegressor
+
+    if name == "Decision Tree":
+        return DecisionTreeRegressor(random_state=0)
+    if name == "Random Forest":
+        return RandomForestRegressor(n_estimators=100, random_state=0)
+    if name == "AdaBoost":
+        return AdaBoostRegressor(random_state=0)
+    raise KeyError(f"Unknown base model '{name}'")
+
+
+def schema_file(version: int) -> str:
+    return f"feature_schema-v{version}.json"
+
+
+def split_file(version: int) -> str:
+    return f"training_split-v{version}.npz"
+
+
+def encode(apartments: pd.DataFrame, schema: dict) -> tuple:
+    """Model inputs and target for cleaned apartment rows."""
+    X = FeatureEncoder(schema).encode_frame(apartments).astype(np.float32)
+    y = apartments["sold_price"].to_numpy(dtype=np.float64)
+    return X, y
+
+
+def load_training_data(dataset_path: str = DATASET_FILE, csv_path: str = RAW_CSV):
+    """Encoded features, target, feature schema and dataset row labels."""
+    apartments = clean_apartments(load_apartments(dataset_path, csv_path))
+    schema = build_schema(apartments)
+    X, y = encode(apartments, schema)
+    return X, y, schema, apartments.index.to_numpy()
+
+
+def fold_splits(n_samples: int) -> list:
+    """The (train, calibration) indices MapieRegressor(random_state=42) uses."""
+    from mapie.utils import check_cv
+
+    cv = check_cv(None, random_state=MAPIE_SEED)
+    return list(cv.split(np.zeros((n_samples, 1))))
+
+
+# ---------------------------------------------------------------------------
+# Worker side
+# ---------------------------------------------------------------------------
+
+_worker_arrays = {}
+
+
+def _init_worker(x_path: str, y_path: str) -> None:
+    # Every worker maps the same files, so the training data is in memory once
+    _worker_arrays["X"] = np.load(x_path, mmap_mode="r")
+    _worker_arrays["y"] = np.load(y_path, mmap_mode="r")
+
+
+def _fit_task(name: str, fold, estimator, train_index):
+    from sklearn.base import clone
+
+    start = time.perf_counter()
+    X, y = _worker_arrays["X"], _worker_arrays["y"]
+    if train_index is not None:
+        X, y = X[train_index], y[train_index]
+    estimator = clone(estimator).fit(X, y)
+    return name, fold, estimator, time.perf_counter() - start
+
+
+def fit_base_models(X: np.ndarray, y: np.ndarray, splits: list, workers: int = None, estimators: dict = None) -> tuple:
+    """Fit every base model on the full data and on each CV fold in parallel.
+
+    ``estimators`` maps names to unfitted estimators and defaults to the
+    notebook's base models. Returns
+    ``({name: {"full": estimator, 0: estimator, ...}}, fit timings)``.
+    """
+    if estimators is None:
+        estimators = {name: make_estimator(name) for name in BASE_MODELS}
+    fitted = {name: {} for name in estimators}
+    timings = []
+    with tempfile.TemporaryDirectory() as tmp:
+        x_path, y_path = os.path.join(tmp, "X.npy"), os.path.join(tmp, "y.npy")
+        np.save(x_path, X)
+        np.save(y_path, y)
+
+        tasks = [(name, "full", estimator, None) for name, estimator in estimators.items()]
+        tasks += [
+            (name, k, estimator, train)
+            for name, estimator in estimators.items()
+            for k, (train, _) in enumerate(splits)
+        ]
+        # Random Forest fits take longest, so start them first
+        tasks.sort(key=lambda task: task[0] != "Random Forest")
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(x_path, y_path)) as pool:
+            futures = [pool.submit(_fit_task, *task) for task in tasks]
+            for future in as_completed(futures):
+                name, fold, estimator, seconds = future.result()
+                fitted[name][fold] = estimator
+                timings.append({"model": name, "fold": fold, "seconds": seconds})
+    return fitted, timings
+
+
+# ---------------------------------------------------------------------------
+# Assembly
+# ---------------------------------------------------------------------------
+
+def assemble_voting(estimators: list, weights):
+    """A fitted VotingRegressor built from already fitted base estimators.
+
+    ``VotingRegressor.fit`` would refit clones of the same estimators on the
+    same data, which gives identical trees.
+    """
+    from sklearn.ensemble import VotingRegressor
+    from sklearn.utils import Bunch
+
+    voting = VotingRegressor(estimators=list(zip(VOTING_NAMES, estimators)), weights=weights)
+    voting.estimators_ = list(estimators)
+    voting.named_estimators_ = Bunch(**dict(zip(VOTING_NAMES, estimators)))
+    return voting
+
+
+def assemble_mapie(estimator, single_estimator, fold_estimators: list, X: np.ndarray, y: np.ndarray):
+    """A fitted CV+ MapieRegressor from the full-data and per-fold estimators.
+
+    Follows ``MapieRegressor.fit`` but skips the refits: the out-of-fold
+    predictions and conformity scores are computed by MAPIE itself.
+    """
+    from mapie.regression import MapieRegressor
+    from mapie.utils import check_no_agg_cv
+
+    mapie = MapieRegressor(estimator=estimator, n_jobs=1, random_state=MAPIE_SEED)
+    X, y, _, groups = mapie.init_fit(X, y)
+    ensemble = mapie.estimator_
+    ensemble.use_split_method_ = check_no_agg_cv(X, ensemble.cv, ensemble.no_agg_cv_)
+    ensemble.single_estimator_ = single_estimator
+    ensemble.estimators_ = list(fold_estimators)
+    ensemble.k_ = np.full((len(y), len(fold_estimators)), np.nan)
+    mapie._predict_params = False
+
+    y_pred = ensemble.predict_calib(X, y=y, groups=groups)
+    mapie.conformity_scores_ = mapie.conformity_score_function_.get_conformity_scores(y, y_pred, X=X)
+    return mapie
+
+
+def assemble_split(estimator, X_calib: np.ndarray, y_calib: np.ndarray):
+    """A split-conformal MapieRegressor for an estimator fitted without ``X_calib``."""
+    from mapie.regression import MapieRegressor
+
+    mapie = MapieRegressor(estimator=estimator, method="base", cv="prefit", n_jobs=1)
+    return mapie.fit(X_calib, y_calib)
+
+
+def score(y_true: np.ndarray, y_pred: np.ndarray) -> dict:
+    from sklearn.metrics import mean_squared_error, r2_score
+
+    return {"R2 Score": r2_score(y_true, y_pred), "RMSE": np.sqrt(mean_squared_error(y_true, y_pred))}
+
+
+# ---------------------------------------------------------------------------
+# Pipeline
+# ---------------------------------------------------------------------------
+
+def train(
+    dataset_path: str = DATASET_FILE,
+    csv_path: str = RAW_CSV,
+    model_dir: str = MODEL_DIR,
+    workers: int = None,
+    metrics_path: str = METRICS_FILE,
+    pickle_path: str = None,
+    lightweight: bool = False,
+    distill_models: tuple = DISTILL_MODELS,
+) -> dict:
+    """Fit, evaluate and export all four models; returns the timing report.
+
+    With ``lightweight`` the models are split-conformal instead of CV+. The
+    published version's ``distill_models`` get fast students; pass an empty
+    tuple to skip them.
+    """
+    from sklearn.model_selection import train_test_split
+
+    stages = {}
+    start = time.perf_counter()
+
+    X, y, schema, rows = load_training_data(dataset_path, csv_path)
+    train_X, test_X, train_y, test_y, train_rows, test_rows = train_test_split(
+        X, y, rows, test_size=TEST_SIZE, random_state=SPLIT_SEED
+    )
+    if lightweight:
+        fit_index, calib_index = train_test_split(
+            np.arange(len(train_y)), test_size=CALIBRATION_SIZE, random_state=MAPIE_SEED
+        )
+        calib_X, calib_y, calib_rows = train_X[calib_index], train_y[calib_index], train_rows[calib_index]
+        train_X, train_y, train_rows = train_X[fit_index], train_y[fit_index], train_rows[fit_index]
+    train_X = np.ascontiguousarray(train_X)
+    stages["load"] = time.perf_counter() - start
+
+    mark = time.perf_counter()
+    # Lightweight models only need the fits on the full (reduced) training set
+    splits = [] if lightweight else fold_splits(len(train_y))
+    fitted, fit_timings = fit_base_models(train_X, train_y, splits, workers)
+    stages["fit"] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    singles = {name: fitted[name]["full"] for name in BASE_MODELS}
+    metrics = {name: score(test_y, singles[name].predict(test_X)) for name in BASE_MODELS}
+
+    # Voting weights are the normalized R² scores of the base models
+    r2 = np.array([metrics[name]["R2 Score"] for name in BASE_MODELS])
+    weights = r2 / r2.sum()
+    voting = assemble_voting([singles[name] for name in BASE_MODELS], weights)
+    metrics["Soft Voting"] = score(test_y, voting.predict(test_X))
+
+    models = {}
+    if lightweight:
+        for name in BASE_MODELS:
+            models[name] = assemble_split(singles[name], calib_X, calib_y)
+        models["Soft Voting"] = assemble_split(voting, calib_X, calib_y)
+    else:
+        for name in BASE_MODELS:
+            folds = [fitted[name][k] for k in range(len(splits))]
+            models[name] = assemble_mapie(singles[name], singles[name], folds, train_X, train_y)
+        voting_folds = [
+            assemble_voting([fitted[name][k] for name in BASE_MODELS], weights) for k in range(len(splits))
+        ]
+        models["Soft Voting"] = assemble_mapie(voting, voting, voting_folds, train_X, train_y)
+    stages["conformalize"] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    version = next_version(model_dir)
+    save_schema(schema, model_dir, schema_file(version))
+    # Dataset rows of the training samples (in fold_index order) and test samples
+    split_rows = {"train": train_rows, "test": test_rows}
+    if lightweight:
+        split_rows["calibration"] = calib_rows
+    np.savez(os.path.join(model_dir, split_file(version)), **split_rows)
+    # The manifest is written last, once every file of the version exists
+    export_models_compact(models, model_dir, version, fields={
+        "mode": "lightweight" if lightweight else "cv+",
+        "schema": schema_file(version),
+        "split": split_file(version),
+        "metrics": metrics,
+    })
+    if pickle_path:
+        with open(pickle_path, "wb") as f:
+            pickle.dump(models, f)
+    pd.DataFrame([
+        {"Model": METRIC_NAMES[name], **metrics[name]} for name in METRIC_NAMES
+    ]).to_csv(metrics_path, index=False)
+    stages["export"] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    student_reports = distill(model_dir, distill_models) if distill_models else {}
+    stages["distill"] = time.perf_counter() - mark
+
+    report = {
+        "version": version,
+        "mode": "lightweight" if lightweight else "train",
+        "workers": workers or os.cpu_count(),
+        "n_train": int(len(train_y)),
+        "n_test": int(len(test_y)),
+        "n_features": int(X.shape[1]),
+        "stages": stages,
+        "fits": sorted(fit_timings, key=lambda t: (t["model"], str(t["fold"]))),
+        # Student fidelity without the per-region breakdown, which is in the student's meta.json
+        "students": {
+            name: {key: value for key, value in r.items() if key != "regions"} for name, r in student_reports.items()
+        },
+        "total_seconds": time.perf_counter() - start,
+    }
+    with open(os.path.join(model_dir, REPORT_FILE), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train and export the apartment price models.")
+    parser.add_argument("--dataset", default=DATASET_FILE, help="Typed dataset written by dataset.py")
+    parser.add_argument("--csv", default=RAW_CSV, help="Raw CSV, ingested when the dataset is missing or stale")
+    parser.add_argument("--model-dir", default=MODEL_DIR, help="Directory for the compact models and manifest")
+    parser.add_argument("--workers", type=int, default=None, help="Training processes (default: CPU count)")
+    parser.add_argument("--metrics", default=METRICS_FILE, help="Metrics CSV shown on the Additional Information page")
+    parser.add_argument("--pickle", default=None, help="Also write the combined MAPIE pickle to this path")
+    parser.add_argument("--lightweight", action="store_true", help="Split-conformal models with a small footprint")
+    parser.add_argument("--no-distill", action="store_true", help="Do not fit the fast students")
+    args = parser.parse_args()
+
+    report = train(args.dataset, args.csv, args.model_dir, args.workers, args.metrics, args.pickle, args.lightweight,
+                   () if args.no_distill else DISTILL_MODELS)
+    for stage, seconds in report["stages"].items():
+        print(f"{stage:<13} {seconds:7.1f}s")
+    print(f"{'total':<13} {report['total_seconds']:7.1f}s  "
+          f"({len(report['fits'])} fits on {report['workers']} workers, "
+          f"{report['n_train']} training rows)")
+    for name, student in report["students"].items():
+        print(f"{name} student: {student['served_regions']} of {student['total_regions']} regions served, "
+              f"prediction within {student['prediction']['p90']:.1%} of the full model for 90% of inputs")